@@ -1,13 +1,23 @@
 import os
+import random
+import time
 from importlib import import_module
-from subprocess import CalledProcessError
 
 from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, fail
+from twisted.python.failure import Failure
 
+import command
 import connect
 import external
-import ipvsadm
-from enums import Checktype
+import ipvs
+import limiter
+import metrics
+import ping
+import probe
+import target
+import wheel
+from enums import Checktype, Outcome, Weighting
 from pydexceptions import *
 
 
@@ -22,12 +32,11 @@ def __cb_running(_, virtual, real, global_config):
     :param global_config: the global configuration object.
     :return: nothing
     """
-    # check if we are in the process of being terminated
-    if global_config.terminated:
+    # check if we are in the process of being terminated or the real server has been removed in the meantime
+    if global_config.terminated or not real.active:
         return
 
     # determine specific configuration for this service
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
     real_hostname = real.ip.exploded + ":" + str(real.port)
 
     global_config.log.debug(real_hostname + "\tOK")
@@ -35,27 +44,45 @@ def __cb_running(_, virtual, real, global_config):
     # reset failure count
     real.failcount = 0
 
-    # check whether the real server is present and has its target weight
-    if not real.is_present or real.current_weight < real.weight:
-        real.current_weight = real.weight
+    # a failed real server has to pass 'risecount' checks in a row and must not be suppressed for flapping
+    if real.failed:
+        real.successcount += 1
+        if real.successcount < virtual.risecount:
+            return
+        if __suppressed(virtual, real, global_config):
+            return
+        real.failed = False
+        real.successcount = 0
+
+    # a slow-start in progress raises the weight by itself
+    if real.ramp_call is not None:
+        return
+
+    weight = __effective_weight(virtual, real)
+
+    # adjust the weight of a healthy real server, small changes of its latency are ignored
+    if real.target_present and real.target_weight > 0:
+        if real.target_weight != weight and __significant(virtual, real.target_weight, weight):
+            real.target_weight = weight
+            global_config.log.info("Setting real " + real_hostname + " to " + str(real.target_weight))
+            ipvs.edit_real_server(virtual, real, global_config)
+        return
 
-        global_config.log.info("Setting real " + real_hostname + " to " + str(real.current_weight))
-        if real.is_present:
-            ipvsadm.edit_real_server(virtual, real, global_config)
+    # check whether the real server is present and has its target weight
+    if not real.target_present or real.target_weight < weight:
+        if virtual.slowstart and weight > 1:
+            __start_ramp(virtual, real, global_config)
         else:
-            ipvsadm.add_real_server(virtual, real, global_config)
+            real.target_weight = weight
 
-        # check if the fallback is present
-        fallback = virtual.fallback
-        if fallback and (fallback.current_weight > 0 or fallback.is_present):
-            fallback.current_weight = 0
+        global_config.log.info("Setting real " + real_hostname + " to " + str(real.target_weight))
+        if real.target_present:
+            ipvs.edit_real_server(virtual, real, global_config)
+        else:
+            ipvs.add_real_server(virtual, real, global_config)
 
-            # remove it
-            if fallback.is_present:
-                global_config.log.info("Removing fallback from " + virtual_hostname)
-                ipvsadm.delete_real_server(virtual, fallback, global_config)
-            else:
-                pass  # nothing to do
+        # remove the fallback if it is present
+        update_fallback(virtual, global_config)
 
 
 def __cb_error(failure, virtual, real, global_config):
@@ -69,12 +96,11 @@ def __cb_error(failure, virtual, real, global_config):
     :param global_config: the global configuration object.
     :return: nothing
     """
-    # check if we are in the process of being terminated
-    if global_config.terminated:
+    # check if we are in the process of being terminated or the real server has been removed in the meantime
+    if global_config.terminated or not real.active:
         return
 
     # determine specific configuration for this service
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
     real_hostname = real.ip.exploded + ":" + str(real.port)
 
     try:
@@ -83,155 +109,551 @@ def __cb_error(failure, virtual, real, global_config):
         global_config.log.debug(real_hostname + "\tNOK: %s" % "no failure reason available")
 
     real.failcount += 1
+    real.successcount = 0  # a failed real server has to pass 'risecount' checks in a row again
 
     # check if we have reached the maximal permitted failure count
     if real.failcount >= virtual.failurecount:
         real.failcount = virtual.failurecount  # prevent infinite growth of this value
+        real.latency = None
+        __stop_ramp(real)
+
+        # every time a healthy real server fails counts towards its flap penalty
+        if not real.failed:
+            real.failed = True
+            __add_penalty(virtual, real, global_config)
 
         # just set weight to zero or delete real server altogether depending on quiescent
         if virtual.quiescent:
-            if real.is_present:
-                if real.current_weight == 0:
+            if real.target_present:
+                if real.target_weight == 0:
                     pass  # nothing to do
                 else:
-                    real.current_weight = 0
-                    global_config.log.info("Setting real " + real_hostname + " to " + str(real.current_weight))
-                    ipvsadm.edit_real_server(virtual, real, global_config)
+                    real.target_weight = 0
+                    global_config.log.info("Setting real " + real_hostname + " to " + str(real.target_weight))
+                    ipvs.edit_real_server(virtual, real, global_config)
             else:
                 if virtual.readdquiescent:
-                    real.current_weight = 0
-                    global_config.log.info("Adding real " + real_hostname + " with " + str(real.current_weight)
+                    real.target_weight = 0
+                    global_config.log.info("Adding real " + real_hostname + " with " + str(real.target_weight)
                                            + " due to readdquiescent")
-                    ipvsadm.add_real_server(virtual, real, global_config)
+                    ipvs.add_real_server(virtual, real, global_config)
                 else:
                     pass  # nothing to do
         else:
-            real.current_weight = 0
-            if real.is_present:
+            real.target_weight = 0
+            if real.target_present:
                 global_config.log.info("Removing real " + real_hostname)
-                ipvsadm.delete_real_server(virtual, real, global_config)
+                ipvs.delete_real_server(virtual, real, global_config)
             else:
                 pass  # nothing to do
 
-        # check if there are any real servers left
-        for real in virtual.real:
-            if real.is_present and real.current_weight > 0:
-                return
-
-        # use fallback otherwise if it is present
-        fallback = virtual.fallback
-        if fallback and (not fallback.is_present or fallback.current_weight < 1):
-            fallback.current_weight = 1
-            if not fallback.is_present:
-                global_config.log.info("Adding fallback for " + virtual_hostname)
-                ipvsadm.add_real_server(virtual, fallback, global_config)
-            else:
-                global_config.log.info(
-                    "Setting fallback for " + virtual_hostname + " to " + str(fallback.current_weight))
-                ipvsadm.edit_real_server(virtual, fallback, global_config)
+        # use the fallback if there are no real servers left
+        update_fallback(virtual, global_config)
+
+
+def __decay_penalty(real):
+    now = reactor.seconds()
+    if real.penalty:
+        real.penalty *= 0.5 ** ((now - real.penalty_updated) / external.flap_half_life)
+    real.penalty_updated = now
+
+
+def __add_penalty(virtual, real, global_config):
+    if not virtual.flapdamping:
+        return
+
+    __decay_penalty(real)
+    real.penalty += external.flap_penalty
+    if not real.suppressed and real.penalty >= external.flap_suppress:
+        real.suppressed = True
+        real_hostname = real.ip.exploded + ":" + str(real.port)
+        global_config.log.warning("Real " + real_hostname + " is flapping, it is not added again until it is stable")
+
+
+def __suppressed(virtual, real, global_config):
+    """
+    Checks whether a flapping real server is still kept out. Its penalty decays over time, once it dropped below the
+    reuse threshold the real server may be added again.
+    """
+    if not real.suppressed:
+        return False
+    if not virtual.flapdamping:
+        real.suppressed = False
+        return False
+
+    __decay_penalty(real)
+    if real.penalty >= external.flap_reuse:
+        return True
+
+    real.suppressed = False
+    real_hostname = real.ip.exploded + ":" + str(real.port)
+    global_config.log.info("Real " + real_hostname + " is stable again")
+    return False
+
+
+def __cb_measure(result, real, started):
+    # smooth the round-trip time of successful checks with an exponentially weighted moving average
+    elapsed = reactor.seconds() - started
+    if real.latency is None:
+        real.latency = elapsed
+    else:
+        real.latency = external.latency_ewma_alpha * elapsed + (1 - external.latency_ewma_alpha) * real.latency
+    return result
+
+
+def __effective_weight(virtual, real):
+    """
+    Determines the weight a healthy real server should have. With 'weighting = latency' its configured weight is scaled
+    by how its latency compares to the median latency of all healthy real servers of the virtual service.
+    """
+    if virtual.weighting != Weighting.latency or real.latency is None or real.weight == 0:
+        return real.weight
+
+    latencies = sorted(other.latency for other in virtual.real if other.latency is not None and other.failcount == 0)
+    if not latencies:
+        return real.weight
+    middle = len(latencies) // 2
+    median = latencies[middle] if len(latencies) % 2 else (latencies[middle - 1] + latencies[middle]) / 2
 
+    factor = median / max(real.latency, 1e-6)
+    factor = min(max(factor, external.latency_weight_min), external.latency_weight_max)
+    return max(1, int(round(real.weight * factor)))
 
-def __cb_repeat(_, virtual, real, global_config):
+
+def __significant(virtual, old, new):
+    if virtual.weighting != Weighting.latency:
+        return True
+    return abs(new - old) > external.latency_weight_hysteresis * old
+
+
+def __ramp_weight(virtual, real):
+    # weight the real server is supposed to have at this point of its slow-start
+    if not virtual.slowstart:
+        return real.weight
+    elapsed = reactor.seconds() - real.ramp_started
+    return max(1, min(real.weight, int(real.weight * elapsed / virtual.slowstart)))
+
+
+def __start_ramp(virtual, real, global_config):
+    """
+    Starts raising the weight of a recovered real server step by step up to its configured weight over 'slowstart'
+    seconds instead of exposing it to its full share of new connections at once. A real server that still has some
+    weight continues from there.
+    """
+    real.ramp_started = reactor.seconds() - virtual.slowstart * min(real.target_weight, real.weight) / real.weight
+    real.target_weight = __ramp_weight(virtual, real)
+
+    steps = min(real.weight - 1, external.slowstart_max_steps)
+    real.ramp_call = reactor.callLater(virtual.slowstart / steps, __ramp_step, virtual, real, global_config)
+
+
+def __ramp_step(virtual, real, global_config):
+    real.ramp_call = None
+    if global_config.terminated or not real.active:
+        return
+
+    weight = __ramp_weight(virtual, real)
+    if weight != real.target_weight:
+        real.target_weight = weight
+        real_hostname = real.ip.exploded + ":" + str(real.port)
+        global_config.log.debug("Slow-start: setting real " + real_hostname + " to " + str(real.target_weight))
+        ipvs.edit_real_server(virtual, real, global_config)
+
+    # continue until the configured weight has been reached
+    if real.target_weight < real.weight:
+        steps = min(real.weight - 1, external.slowstart_max_steps)
+        real.ramp_call = reactor.callLater(virtual.slowstart / steps, __ramp_step, virtual, real, global_config)
+    else:
+        real.ramp_started = None
+
+
+def __stop_ramp(real):
+    if real.ramp_call is not None and real.ramp_call.active():
+        real.ramp_call.cancel()
+    real.ramp_call = None
+    real.ramp_started = None
+
+
+def update_fallback(virtual, global_config):
+    """
+    Adds the fallback of a virtual service if none of its real servers carries any weight and removes it otherwise.
+
+    :param virtual: the virtual service whose fallback is to be updated.
+    :param global_config: the global configuration object.
+    :return: nothing
     """
-    Function called whether the outcome of a check-module was positive or negative. Used to reschedule another check in
-    the future.
+    fallback = virtual.fallback
+    if fallback is None:
+        return
+
+    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+
+    # check if there are any real servers left
+    for real in virtual.real:
+        if real.target_present and real.target_weight > 0:
+            # remove the fallback if it is present
+            if fallback.target_weight > 0 or fallback.target_present:
+                fallback.target_weight = 0
+                if fallback.target_present:
+                    global_config.log.info("Removing fallback from " + virtual_hostname)
+                    ipvs.delete_real_server(virtual, fallback, global_config)
+            return
+
+    # use fallback otherwise
+    if not fallback.target_present or fallback.target_weight < 1:
+        fallback.target_weight = 1
+        if not fallback.target_present:
+            global_config.log.info("Adding fallback for " + virtual_hostname)
+            ipvs.add_real_server(virtual, fallback, global_config)
+        else:
+            global_config.log.info(
+                "Setting fallback for " + virtual_hostname + " to " + str(fallback.target_weight))
+            ipvs.edit_real_server(virtual, fallback, global_config)
+
+
+def __cb_result(result, probe, started, global_config):
+    """
+    Function called when the outcome of a probe was positive. Hands the result to all real servers subscribed to it.
+
+    :param result: the result of the check-module.
+    :param probe: the probe that has been executed.
+    :param started: the point in time the probe was started.
+    :param global_config: the global configuration object.
+    :return: nothing
+    """
+    probe.outcome = (True, result)
+    probe.successes += 1
+    probe.failures = 0
+    for virtual, real in list(probe.subscribers):
+        __cb_measure(result, real, started)
+        __cb_running(result, virtual, real, global_config)
+
+
+def __cb_failure(failure, probe, global_config):
+    """
+    Function called when the outcome of a probe was negative. Hands the result to all real servers subscribed to it.
+
+    :param failure: the reason this function is called.
+    :param probe: the probe that has been executed.
+    :param global_config: the global configuration object.
+    :return: nothing
+    """
+    probe.outcome = (False, failure)
+    probe.successes = 0
+    probe.failures += 1
+    for virtual, real in list(probe.subscribers):
+        __cb_error(failure, virtual, real, global_config)
+
+
+def __interval(probe):
+    """
+    Determines the time until the next execution of a probe. A probe that has been successful 'stablecount' times in a
+    row is executed half as often, up to 'maxcheckinterval'. After a failure it is executed every 'fastcheckinterval'
+    seconds until the real servers are either considered failed or have recovered.
+    """
+    virtual = probe.virtual
+    if probe.failures:
+        if virtual.fastcheckinterval and probe.failures < virtual.failurecount:
+            return virtual.fastcheckinterval
+    elif virtual.maxcheckinterval:
+        doublings = min(probe.successes // virtual.stablecount, 32)  # prevent infinite growth of the multiplier
+        return min(virtual.checkinterval * 2 ** doublings, virtual.maxcheckinterval)
+    return virtual.checkinterval
+
+
+def __cb_repeat(_, probe, global_config):
+    """
+    Function called whether the outcome of a probe was positive or negative. Used to reschedule another check in the
+    future.
 
     :param _: the reason this function is called.
-    :param virtual: the virtual service this check was concerned with.
-    :param real: the specific real server this check was concerned with.
+    :param probe: the probe that has been executed.
     :param global_config: the global configuration object.
     :return: nothing
     """
-    # schedule check in the future
-    reactor.callLater(virtual.checkinterval, do_check, virtual, real, global_config)
+    # schedule check in the future unless all of its real servers have been removed in the meantime
+    if probe.subscribers:
+        virtual = probe.virtual
+        delay = __interval(probe) * (1 + random.uniform(-virtual.checkjitter, virtual.checkjitter) / 100)
+        probe.scheduled_check = global_config.check_wheel.call_later(delay, do_check, probe, global_config)
 
 
-def __cb_unexpected_failure(reason, virtual, real, global_config):
+def __cb_unexpected_failure(reason, probe, global_config):
     """
     Deal with unexpected failures.
     :param reason:
-    :param virtual:
-    :param real:
+    :param probe:
     :param global_config:
     :return:
     """
-    global_config.critical("Something went terribly wrong: " % str(reason.value))
+    global_config.log.critical("Something went terribly wrong: %s" % str(reason.value))
     reason.printDetailedTraceback()
     reactor.stop()
 
 
-def prepare_check_modules(global_config):
+def required_check_modules(virtuals):
+    """
+    :return: the names of the check-modules used by the 'negotiate' checks of the virtual services
+    """
+    return {virtual.service for virtual in virtuals if virtual.checktype == Checktype.negotiate}
+
+
+def load_check_module(name, global_config):
+    """
+    Imports a check-module unless it has been loaded already.
+
+    :param name: the name of the check-module, i.e. the service it checks.
+    :param global_config: the global configuration object.
+    :return: the check-module
+    :raises IllegalConfigurationException: if there is no such check-module or it cannot be loaded
+    """
+    module = global_config.checks.get(name)
+    if module is not None:
+        return module
+
+    if name is None:
+        raise IllegalConfigurationException("no 'service' specified for a 'negotiate' check")
+    if not os.path.isfile(external.check_path + name + ".py"):
+        raise IllegalConfigurationException("there is no check-module for service '%s'" % name)
+
+    started = time.monotonic()
+    try:
+        module = import_module('checks.' + name)
+    except (ImportError, SyntaxError) as e:
+        raise IllegalConfigurationException("check-module '%s' could not be loaded: %s" % (name, str(e)))
+    if not target.is_valid(module):
+        raise IllegalConfigurationException("check-module '%s' does not seem to be a valid check-module" % name)
+
+    global_config.checks[name] = module
+    global_config.log.info("Check-module '" + name + "' has been successfully loaded")
+    global_config.log.debug("Importing check-module '%s' took %.3fs" % (name, time.monotonic() - started))
+    return module
+
+
+def prepare_check_modules(virtuals, global_config):
     """
-    Loads all check-modules present in the correct path.
+    Loads the check-modules used by the virtual services, all others are not loaded at all.
 
     :return: nothing
+    :raises IllegalConfigurationException: if a check-module is missing or cannot be loaded
     """
     global_config.log.debug("Beginning with check-module loading...")
-    for fn in os.listdir(external.check_path):
-        if os.path.isfile(external.check_path + fn) and fn != "__init__.py" and fn.endswith(".py"):
-            module_name = fn[:-3]
-            try:
-                global_config.checks[module_name] = import_module('checks.' + module_name)
-                if hasattr(global_config.checks[module_name], 'check'):
-                    global_config.log.info("Check-module '" + module_name + "' has been successfully loaded")
-                else:
-                    global_config.log.error("Check-module '" + module_name
-                                            + "' does not seem to be a valid check-module and is therefore ignored")
-                    global_config.checks[module_name] = None
-            except SyntaxError as e:
-                global_config.log.error("Check-module '" + module_name
-                                        + "' caused a SyntaxError when loaded and is therefore ignored")
-                global_config.log.debug("SyntaxError: %s" % str(e))
-
-    global_config.log.debug("Check-module loading done")
+    started = time.monotonic()
+    for name in sorted(required_check_modules(virtuals), key=str):
+        load_check_module(name, global_config)
+    global_config.log.debug("Check-module loading done in %.3fs" % (time.monotonic() - started))
 
 
 def initialize(virtuals, global_config):
     # perform the initial setup within ipvsadm
-    ipvsadm.initial_ipvs_setup(virtuals, global_config)
+    ipvs.initial_ipvs_setup(virtuals, global_config)
+    global_config.check_limiter = limiter.CheckLimiter(global_config)
+    global_config.check_wheel = wheel.TimingWheel(global_config)
+    global_config.check_wheel.start()
 
-    # queue up the check jobs
+    # queue up the check jobs, spread over the first interval to avoid a burst of checks at startup
     for virtual in virtuals:
         for real in virtual.real:
-            do_check(virtual, real, global_config)
+            start_check(virtual, real, global_config, delay=random.uniform(0, virtual.checkinterval))
+
+
+def start_check(virtual, real, global_config, delay=0):
+    """
+    Starts checking a real server periodically. If an identical check is already running for another virtual service,
+    the real server merely subscribes to its results.
+
+    :param virtual: the virtual service the real server belongs to.
+    :param real: the real server to be checked.
+    :param global_config: the global configuration object.
+    :param delay: seconds to wait before the first check.
+    :return: nothing
+    """
+    real.active = True
+
+    key = probe.probe_key(virtual, real)
+    shared = global_config.probes.get(key)
+    if shared is not None:
+        shared.subscribe(virtual, real)
+
+        # take over the last result instead of waiting for the next execution
+        if shared.outcome is not None:
+            success, result = shared.outcome
+            if success:
+                __cb_running(result, virtual, real, global_config)
+            else:
+                __cb_error(result, virtual, real, global_config)
+        return
+
+    shared = probe.Probe(key)
+    shared.subscribe(virtual, real)
+    global_config.probes[key] = shared
+    if delay:
+        shared.scheduled_check = global_config.check_wheel.call_later(delay, do_check, shared, global_config)
+    else:
+        do_check(shared, global_config)
+
+
+def stop_check(real, global_config):
+    """
+    Stops checking a real server. A check currently in progress is still completed but its result is ignored.
+
+    :param real: the real server that is not to be checked anymore.
+    :param global_config: the global configuration object.
+    :return: nothing
+    """
+    real.active = False
+    __stop_ramp(real)
+
+    shared = real.probe
+    if shared is None:
+        return
+    shared.unsubscribe(real)
+
+    # stop the probe itself once nobody is interested in its results anymore
+    if not shared.subscribers:
+        if shared.scheduled_check is not None and shared.scheduled_check.active():
+            shared.scheduled_check.cancel()
+        shared.scheduled_check = None
+        target.release(shared.target, global_config)
+        shared.target = None
+        if global_config.probes.get(shared.key) is shared:
+            del global_config.probes[shared.key]
+
+
+def update_check(virtual, real, global_config):
+    """
+    Moves a real server to another probe if its check parameters have changed, e.g. after reloading the configuration.
+
+    :param virtual: the virtual service the real server belongs to.
+    :param real: the real server whose check might have changed.
+    :param global_config: the global configuration object.
+    :return: nothing
+    """
+    if real.active and real.probe is not None and real.probe.key != probe.probe_key(virtual, real):
+        stop_check(real, global_config)
+        start_check(virtual, real, global_config)
 
 
 def cleanup(virtuals, global_config):
     global_config.log.info("Received SIGTERM, starting cleanup...")
     global_config.terminated = True
+    if global_config.check_wheel is not None:
+        global_config.check_wheel.stop()
+    if global_config.check_workers is not None:
+        global_config.check_workers.stop()
+    if global_config.exporter is not None:
+        global_config.exporter.stop()
+    for shared in global_config.probes.values():
+        target.release(shared.target, global_config)
+        shared.target = None
+    command.stop(global_config)
 
     for virtual in virtuals:
-        if virtual.is_present and virtual.cleanstop:
+        if (virtual.is_present or virtual.target_present) and virtual.cleanstop:
             virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
             global_config.log.info("Removing virtual service " + virtual_hostname)
             try:
-                ipvsadm.delete_virtual_service(virtual, global_config, sync=True)
-            except CalledProcessError:
+                ipvs.delete_virtual_service(virtual, global_config, sync=True)
+            except ipvs.IPVS_ERRORS:
                 global_config.log.error("Could not remove virtual service " + virtual_hostname)
 
 
-def do_check(virtual, real, global_config):
-    # check if we are in the process of being terminated
-    if global_config.terminated:
-        global_config.log.debug("Scheduled check cancelled because PyDirectord is being terminated")
-        return
+def check_module(virtual, global_config):
+    """
+    Determines the check-module used to check the real servers of a virtual service.
 
+    :return: a tuple of the name of the check-module and the module itself
+    :raises IllegalConfigurationException: if there is no check-module for the requested 'negotiate' check
+    """
     if virtual.checktype == Checktype.negotiate:
-        try:
-            module = global_config.checks[virtual.service]
-        except KeyError:  # check if we have a check-module for the requested 'negotiate' check
-            global_config.log.error("No check-module found for '%s', no further checks are scheduled" % virtual.service)
-            return
+        return virtual.service, load_check_module(virtual.service, global_config)
     elif virtual.checktype == Checktype.connect:
-        module = connect
+        return "connect", connect
+    elif virtual.checktype == Checktype.ping:
+        return "ping", ping
+    elif virtual.checktype == Checktype.external:
+        return "external", command
     else:
         raise NotImplementedError(virtual.checktype)
 
+
+def do_check(shared, global_config):
+    # check if we are in the process of being terminated
+    if global_config.terminated:
+        global_config.log.debug("Scheduled check cancelled because PyDirectord is being terminated")
+        return
+
+    shared.scheduled_check = None
+    virtual = shared.virtual
+
+    try:
+        name, module = check_module(virtual, global_config)
+    except IllegalConfigurationException as e:  # check if we have a check-module for the requested 'negotiate' check
+        global_config.log.error("%s, no further checks are scheduled" % str(e))
+        return
+
+    # wait for a free slot if too many checks are running already
+    priority = max(subscriber.checkpriority for subscriber, _ in shared.subscribers)
+    global_config.check_limiter.submit(name, priority, __run_check, shared, name, module, global_config)
+
+
+def __expire(d, shared, global_config):
+    shared.expired = True
+    global_config.check_timeouts += 1
+    d.cancel()
+
+
+def __cb_settled(result, timer):
+    if timer.active():
+        timer.cancel()
+    return result
+
+
+def __cb_expired(failure, shared, deadline):
+    # report a check cancelled due to its deadline as a timeout instead of a cancellation
+    if shared.expired and failure.check(CancelledError):
+        raise CheckTimeoutException("no result within %gs" % deadline)
+    return failure
+
+
+def __cb_record(result, d, shared, name, started, global_config):
+    outcome = metrics.classify(result) if isinstance(result, Failure) else Outcome.ok
+    metrics.record(name, shared, outcome, reactor.seconds() - started, metrics.phases(d, started), global_config,
+                   getattr(d, "handshake", None))
+    return result
+
+
+def __run_check(shared, name, module, global_config):
+    # check if we are in the process of being terminated or the probe has been stopped while waiting
+    if global_config.terminated or not shared.subscribers:
+        return None
+
+    virtual = shared.virtual
+    started = reactor.seconds()
+    deadline = virtual.checkdeadline if virtual.checkdeadline else virtual.checktimeout + virtual.negotiatetimeout
     try:
-        d = module.check(virtual, real, global_config)
-        d.addCallback(__cb_running, virtual, real, global_config)
-        d.addErrback(__cb_error, virtual, real, global_config)
-        d.addCallback(__cb_repeat, virtual, real, global_config)
-        d.addErrback(__cb_unexpected_failure, virtual, real, global_config)
+        # hand the check to a worker process if there are any, they fall back to us while they are not available
+        d = None
+        if global_config.check_workers is not None:
+            d = global_config.check_workers.run(shared, deadline)
+        if d is None:
+            d = target.run(module, shared, virtual, shared.real, global_config)
     except IllegalConfigurationException as e:
         global_config.log.error("Illegal configuration: %s" % str(e))
+        return None
+    except Exception:
+        # a check-module raising instead of returning a failed Deferred must not stop its probe
+        d = fail()
+
+    # cancel the check if it has not completed in time, whatever it is waiting for
+    shared.expired = False
+    timer = global_config.check_wheel.call_later(deadline, __expire, d, shared, global_config)
+    d.addBoth(__cb_settled, timer)
+    d.addErrback(__cb_expired, shared, deadline)
+    d.addBoth(__cb_record, d, shared, name, started, global_config)
+
+    d.addCallbacks(__cb_result, __cb_failure, callbackArgs=(shared, started, global_config),
+                   errbackArgs=(shared, global_config))
+    d.addCallback(__cb_repeat, shared, global_config)
+    d.addErrback(__cb_unexpected_failure, shared, global_config)
+    return d
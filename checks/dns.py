@@ -0,0 +1,65 @@
+import socket
+import struct
+
+from twisted.names import dns
+
+import udp
+from pydexceptions import *
+
+
+def __transaction(data):
+    return struct.unpack("!H", data[:2])[0]
+
+
+def __answer(record):
+    """
+    :return: the data of a resource record as it would be written in a zone file
+    """
+    payload = record.payload
+    if record.type == dns.A:
+        return payload.dottedQuad()
+    elif record.type == dns.AAAA:
+        return socket.inet_ntop(socket.AF_INET6, payload.address)
+    elif record.type == dns.TXT:
+        return b"".join(payload.data).decode(errors="replace")
+    elif hasattr(payload, "name"):
+        return str(payload.name)
+    return str(payload)
+
+
+def __cb_response(data, name, receive):
+    message = dns.Message()
+    message.fromStr(data)
+    if message.rCode != dns.OK:
+        raise UnexpectedResultException("query for '%s' failed with rcode %d" % (name, message.rCode))
+
+    answers = [__answer(record) for record in message.answers]
+    if not answers:
+        raise UnexpectedResultException("no answer for '%s'" % name)
+    if receive is not None and receive not in answers:
+        raise UnexpectedResultException("got '" + ", ".join(answers) + "' expected '" + receive + "'")
+
+
+def check(virtual, real, global_config):
+    request = real.request if real.request else virtual.request
+    if request is None:
+        raise IllegalConfigurationException("no 'request' specified for dns check")
+
+    # 'request' is the name to query, optionally followed by the record type (e.g. 'example.com AAAA')
+    parts = request.split()
+    name = parts[0]
+    kind = dns.A
+    if len(parts) > 1:
+        kind = dns.REV_TYPES.get(parts[1].upper())
+        if kind is None:
+            raise IllegalConfigurationException("illegal record type '" + parts[1] + "' for dns check")
+
+    def build(transaction):
+        message = dns.Message(id=transaction, recDes=True)
+        message.queries = [dns.Query(name, kind, dns.IN)]
+        return message.toStr()
+
+    port = virtual.checkport if virtual.checkport else real.port
+    d = udp.query(real.ip, port, 16, build, __transaction, virtual.negotiatetimeout, global_config)
+    d.addCallback(__cb_response, name, real.receive if real.receive else virtual.receive)
+    return d
@@ -1,57 +1,109 @@
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
-from twisted.web.client import Agent, readBody
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
 from twisted.web.http_headers import Headers
 
+import metrics
+import target
 from pydexceptions import UnexpectedResultException
 from enums import *
 
 
-def __cb_check_body(body, receive):
-    if body != receive:
-        raise UnexpectedResultException("got '" + str(body) + "' expected '" + str(receive) + "'")
-
-
-def __cb_received_body(body, deferred):
-    deferred.callback(body)
-
-
-def __cb_error(reason, deferred):
-    deferred.errback(reason)
-
-
-def __cb_response(response, deferred):
-    d = readBody(response)
-    d.addCallback(__cb_received_body, deferred=deferred)
-
-
-def check(virtual, real, global_config):
-    # setup parameters
-    if virtual.httpmethod == HTTPMethod.GET:
-        method = b'GET'
-    elif virtual.httpmethod == HTTPMethod.HEAD:
-        method = b'HEAD'
-    else:
-        raise ValueError
-
-    hostname = virtual.hostname if virtual.hostname else real.ip.exploded
-    port = str(virtual.checkport if virtual.checkport else real.port)
-    path = real.request if real.request else virtual.request
-
-    uri = b'http://' + real.ip.exploded.encode() + b":" + port.encode() + b'/' + path.encode()
-
-    # prepare headers
-    headers = {'User-Agent': ['PyDirectord ' + global_config.version], 'Host': [hostname]}
-
-    # prepare deferred
-    receive = (real.receive if real.receive else virtual.receive).encode()
-    deferred = Deferred()
-    deferred.addCallback(__cb_check_body, receive)
-
-    # make request
-    agent = Agent(reactor, connectTimeout=virtual.negotiatetimeout)
-    d = agent.request(method, uri, Headers(headers), None)
-    d.addCallback(__cb_response, deferred=deferred)
-    d.addErrback(__cb_error, deferred=deferred)
-
-    return deferred
+class Target(target.CheckTarget):
+    """
+    Performs the checks with an agent that is kept between them. With 'httpkeepalive' set, the agent keeps its
+    connection open for up to that many idle seconds and reuses it for the next check. The connection is replaced after
+    'httpreconnect' checks, so accepting new connections is still checked, and right away if a check failed.
+    """
+    scheme = b'http://'
+
+    def __init__(self, virtual, real, global_config):
+        super(Target, self).__init__(virtual, real, global_config)
+
+        # setup parameters
+        if virtual.httpmethod == HTTPMethod.GET:
+            self.method = b'GET'
+        elif virtual.httpmethod == HTTPMethod.HEAD:
+            self.method = b'HEAD'
+        else:
+            raise ValueError
+
+        self.hostname = virtual.hostname if virtual.hostname else real.ip.exploded
+        port = str(virtual.checkport if virtual.checkport else real.port)
+        path = real.request if real.request else virtual.request
+
+        self.uri = self.scheme + real.ip.exploded.encode() + b":" + port.encode() + b'/' + path.encode()
+        self.receive = (real.receive if real.receive else virtual.receive).encode()
+
+        # variable initialization
+        self.pool = None
+        self.agent = None
+        self.checks = 0
+
+    def setup(self):
+        if self.virtual.httpkeepalive:
+            self.pool = HTTPConnectionPool(reactor, persistent=True)
+            self.pool.maxPersistentPerHost = 1
+            self.pool.cachedConnectionTimeout = self.virtual.httpkeepalive
+        self.agent = self.create_agent()
+
+    def create_agent(self):
+        return Agent(reactor, connectTimeout=self.virtual.negotiatetimeout, pool=self.pool)
+
+    def probe(self):
+        # replace the connection every 'httpreconnect' checks
+        self.checks += 1
+        if self.pool is not None and self.virtual.httpreconnect and self.checks > self.virtual.httpreconnect:
+            self.pool.closeCachedConnections()
+            self.checks = 1
+
+        # prepare headers
+        headers = {'User-Agent': ['PyDirectord ' + self.global_config.version], 'Host': [self.hostname]}
+
+        # prepare deferred
+        # cancelling the check aborts the request or the transfer of the body, whichever is in progress
+        current = [None]
+        deferred = Deferred(lambda _: current[0].cancel())
+        deferred.addCallback(self.__cb_check_body, self.receive)
+        deferred.addErrback(self.__eb_reconnect)
+
+        # make request
+        d = self.agent.request(self.method, self.uri, Headers(headers), None)
+        current[0] = d
+        d.addCallback(self.__cb_response, deferred=deferred, current=current)
+        d.addErrback(self.__cb_error, deferred=deferred)
+
+        return deferred
+
+    def teardown(self):
+        if self.pool is not None:
+            self.pool.closeCachedConnections()
+
+    def __eb_reconnect(self, failure):
+        # do not trust a kept connection after a failure
+        if self.pool is not None:
+            self.pool.closeCachedConnections()
+            self.checks = 0
+        return failure
+
+    @staticmethod
+    def __cb_check_body(body, receive):
+        if body != receive:
+            raise UnexpectedResultException("got '" + str(body) + "' expected '" + str(receive) + "'")
+
+    @staticmethod
+    def __cb_received_body(body, deferred):
+        deferred.callback(body)
+
+    @staticmethod
+    def __cb_error(reason, deferred):
+        deferred.errback(reason)
+
+    @staticmethod
+    def __cb_response(response, deferred, current):
+        metrics.mark(deferred, metrics.FIRST_BYTE)
+
+        d = readBody(response)
+        d.addCallback(Target.__cb_received_body, deferred=deferred)
+        d.addErrback(Target.__cb_error, deferred=deferred)
+        current[0] = d
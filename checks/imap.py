@@ -3,6 +3,8 @@ from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 from twisted.mail import imap4
 
+import metrics
+
 
 class _IMAP4CheckClient(imap4.IMAP4Client):
     """
@@ -10,6 +12,9 @@ class _IMAP4CheckClient(imap4.IMAP4Client):
     """
 
     def serverGreeting(self, caps):
+        if self.factory.cancelled:
+            return
+        metrics.mark(self.imapDeferred, metrics.FIRST_BYTE)
         self.factory.greetingReceived()
         self.logout()
         if caps is not None:
@@ -20,6 +25,7 @@ class _IMAP4CheckClient(imap4.IMAP4Client):
 
 class _IMAP4CheckFactory(protocol.ClientFactory):
     usedUp = False
+    cancelled = False
 
     protocol = _IMAP4CheckClient
 
@@ -35,6 +41,7 @@ class _IMAP4CheckFactory(protocol.ClientFactory):
         p = self.protocol()
         p.factory = self
         p.imapDeferred = self.imapDeferred
+        metrics.mark(self.imapDeferred, metrics.CONNECT)
         p.setTimeout(self.timeout)
 
         return p
@@ -46,20 +53,31 @@ class _IMAP4CheckFactory(protocol.ClientFactory):
         """
         self.greeting_received = True
 
+    def cancel(self, connector):
+        """
+        Closes the connection of a cancelled check. The Deferred fails with a CancelledError, so closing the connection
+        must not fire it as well.
+        """
+        self.cancelled = True
+        connector.disconnect()
+
     def clientConnectionFailed(self, connector, reason):
-        self.imapDeferred.errback(reason)
+        if not self.cancelled:
+            self.imapDeferred.errback(reason)
 
     def clientConnectionLost(self, connector, reason):
-        if not self.greeting_received:
+        if not self.greeting_received and not self.cancelled:
             self.imapDeferred.errback(reason)
 
 
 def check(virtual, real, global_config):
     port = virtual.checkport if virtual.checkport else real.port
 
-    deferred = Deferred()
+    # closes the connection if the check is cancelled, e.g. because it exceeded its deadline
+    factory, connector = None, None
+    deferred = Deferred(lambda _: factory.cancel(connector))
 
     factory = _IMAP4CheckFactory(deferred, virtual.negotiatetimeout)
-    reactor.connectTCP(real.ip.exploded.encode(), port, factory, timeout=virtual.negotiatetimeout)
+    connector = reactor.connectTCP(real.ip.exploded.encode(), port, factory, timeout=virtual.negotiatetimeout)
 
     return deferred
@@ -1,9 +1,12 @@
 from twisted.internet import protocol
 from twisted.internet import reactor
-from twisted.internet._sslverify import optionsForClientTLS
 from twisted.internet.defer import Deferred
 from twisted.mail import imap4
 
+import metrics
+import target
+import tls
+
 
 class _IMAP4CheckClient(imap4.IMAP4Client):
     """
@@ -12,6 +15,9 @@ class _IMAP4CheckClient(imap4.IMAP4Client):
     deferred = None
 
     def serverGreeting(self, caps):
+        if self.factory.cancelled:
+            return
+        metrics.mark(self.deferred, metrics.FIRST_BYTE)
         self.factory.greetingReceived()
         self.logout()
         if caps is not None:
@@ -22,6 +28,7 @@ class _IMAP4CheckClient(imap4.IMAP4Client):
 
 class _IMAP4CheckFactory(protocol.ClientFactory):
     usedUp = False
+    cancelled = False
 
     protocol = _IMAP4CheckClient
 
@@ -37,6 +44,7 @@ class _IMAP4CheckFactory(protocol.ClientFactory):
         self.p = self.protocol()
         self.p.factory = self
         self.p.deferred = self.deferred
+        metrics.mark(self.deferred, metrics.CONNECT)
         self.p.setTimeout(self.timeout)
 
         return self.p
@@ -48,22 +56,47 @@ class _IMAP4CheckFactory(protocol.ClientFactory):
         """
         self.greeting_received = True
 
+    def cancel(self, connector):
+        """
+        Closes the connection of a cancelled check. The Deferred fails with a CancelledError, so closing the connection
+        must not fire it as well.
+        """
+        self.cancelled = True
+        connector.disconnect()
+
     def clientConnectionFailed(self, connector, reason):
-        self.deferred.errback(reason)
+        if not self.cancelled:
+            self.deferred.errback(reason)
 
     def clientConnectionLost(self, connector, reason):
-        if not self.greeting_received:
+        if not self.greeting_received and not self.cancelled:
             self.deferred.errback(reason)
 
 
-def check(virtual, real, global_config):
-    hostname = virtual.hostname if virtual.hostname else real.ip.exploded
-    port = virtual.checkport if virtual.checkport else real.port
+class Target(target.CheckTarget):
+    """
+    Keeps the TLS session between the checks, so the server can resume it instead of performing a full handshake.
+    """
+
+    def __init__(self, virtual, real, global_config):
+        super(Target, self).__init__(virtual, real, global_config)
+
+        hostname = virtual.hostname if virtual.hostname else real.ip.exploded
+        self.port = virtual.checkport if virtual.checkport else real.port
+        self.session = tls.Session(hostname, global_config)
+
+    def probe(self):
+        # closes the connection if the check is cancelled, e.g. because it exceeded its deadline
+        factory, connector = None, None
+        deferred = Deferred(lambda _: factory.cancel(connector))
 
-    deferred = Deferred()
+        factory = _IMAP4CheckFactory(deferred, timeout=self.virtual.negotiatetimeout)
+        connector = reactor.connectSSL(self.real.ip.exploded.encode(), self.port, factory, self.session,
+                                       timeout=self.virtual.negotiatetimeout)
 
-    factory = _IMAP4CheckFactory(deferred, timeout=virtual.negotiatetimeout)
-    contextFactory = optionsForClientTLS(hostname=hostname)
-    reactor.connectSSL(real.ip.exploded.encode(), port, factory, contextFactory, timeout=virtual.negotiatetimeout)
+        deferred.addBoth(self.__cb_settle, deferred)
+        return deferred
 
-    return deferred
+    def __cb_settle(self, result, d):
+        metrics.handshake(d, self.session.settle())
+        return result
@@ -0,0 +1,57 @@
+"""
+RADIUS check using a Status-Server request (RFC 5997), which asks the server whether it is alive without needing the
+credentials of a user. The request is signed with 'secret' and the response is only accepted if it is signed with it as
+well.
+"""
+import hashlib
+import hmac
+import os
+import struct
+
+import udp
+from pydexceptions import *
+
+STATUS_SERVER = 12
+ACCESS_ACCEPT = 2
+ACCOUNTING_RESPONSE = 5
+MESSAGE_AUTHENTICATOR = 80
+
+
+def __transaction(data):
+    return data[1]
+
+
+def __build(identifier, authenticator, secret):
+    # the Message-Authenticator is computed over the request with the attribute itself set to zero
+    attribute = struct.pack("!BB", MESSAGE_AUTHENTICATOR, 18)
+    header = struct.pack("!BBH", STATUS_SERVER, identifier, 20 + len(attribute) + 16) + authenticator
+    signature = hmac.new(secret, header + attribute + b"\0" * 16, hashlib.md5).digest()
+    return header + attribute + signature
+
+
+def __cb_response(data, authenticator, secret):
+    if len(data) < 20 or struct.unpack("!H", data[2:4])[0] > len(data):
+        raise UnexpectedResultException("malformed response")
+    length = struct.unpack("!H", data[2:4])[0]
+    data = data[:length]
+
+    # Response Authenticator = MD5(Code + Identifier + Length + Request Authenticator + Attributes + Secret)
+    expected = hashlib.md5(data[:4] + authenticator + data[20:] + secret).digest()
+    if not hmac.compare_digest(expected, data[4:20]):
+        raise UnexpectedResultException("response not signed with the shared secret")
+    if data[0] not in (ACCESS_ACCEPT, ACCOUNTING_RESPONSE):
+        raise UnexpectedResultException("got code %d expected %d or %d" % (data[0], ACCESS_ACCEPT,
+                                                                          ACCOUNTING_RESPONSE))
+
+
+def check(virtual, real, global_config):
+    if virtual.secret is None:
+        raise IllegalConfigurationException("no 'secret' specified for radius check")
+
+    secret = virtual.secret.encode()
+    authenticator = os.urandom(16)
+    port = virtual.checkport if virtual.checkport else real.port
+    d = udp.query(real.ip, port, 8, lambda identifier: __build(identifier, authenticator, secret), __transaction,
+                  virtual.negotiatetimeout, global_config)
+    d.addCallback(__cb_response, authenticator, secret)
+    return d
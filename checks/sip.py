@@ -0,0 +1,63 @@
+"""
+SIP check sending an OPTIONS request over UDP. The response is matched to the request by the branch of its Via header,
+which carries the transaction id.
+"""
+import os
+import re
+
+import udp
+from pydexceptions import *
+
+BRANCH_PREFIX = "z9hG4bK"  # magic cookie of RFC 3261 branches
+
+__branch = re.compile(r"^(?:via|v)\s*:[^\r\n]*;\s*branch=" + BRANCH_PREFIX + r"([0-9a-f]+)", re.I | re.M)
+
+
+def __transaction(data):
+    response = data.decode(errors="replace")
+    if response.startswith("SIP/2.0 1"):
+        return None  # provisional responses are followed by the final one
+    match = __branch.search(response)
+    if match is None:
+        raise ValueError("no branch in the Via header")
+    return int(match.group(1), 16)
+
+
+def __build(transaction, host, port):
+    uri = "sip:%s:%d" % (host, port)
+    tag = os.urandom(4).hex()
+    return ("OPTIONS %s SIP/2.0\r\n"
+            "Via: SIP/2.0/UDP pydirectord.invalid;branch=%s%016x;rport\r\n"
+            "Max-Forwards: 70\r\n"
+            "From: <sip:pydirectord@pydirectord.invalid>;tag=%s\r\n"
+            "To: <%s>\r\n"
+            "Call-ID: %016x@pydirectord.invalid\r\n"
+            "CSeq: 1 OPTIONS\r\n"
+            "Accept: application/sdp\r\n"
+            "Content-Length: 0\r\n"
+            "\r\n" % (uri, BRANCH_PREFIX, transaction, tag, uri, transaction)).encode()
+
+
+def __cb_response(data, receive):
+    response = data.decode(errors="replace")
+    status = response.split("\r\n", 1)[0]
+    parts = status.split(" ", 2)
+    if len(parts) < 2 or parts[0] != "SIP/2.0" or not parts[1].isdigit():
+        raise UnexpectedResultException("malformed status line '" + status + "'")
+    if receive is not None:
+        if receive not in response:
+            raise UnexpectedResultException("got '" + status + "' expected '" + receive + "'")
+    elif parts[1] != "200":
+        raise UnexpectedResultException("got '" + status + "' expected 'SIP/2.0 200'")
+
+
+def check(virtual, real, global_config):
+    port = virtual.checkport if virtual.checkport else real.port
+    host = virtual.hostname if virtual.hostname is not None else real.ip.compressed
+    if real.ip.version == 6 and virtual.hostname is None:
+        host = "[" + host + "]"
+
+    d = udp.query(real.ip, port, 64, lambda transaction: __build(transaction, host, port), __transaction,
+                  virtual.negotiatetimeout, global_config)
+    d.addCallback(__cb_response, real.receive if real.receive else virtual.receive)
+    return d
@@ -7,6 +7,8 @@ from twisted.mail.smtp import DNSNAME, SUCCESS
 from twisted.protocols import basic
 from twisted.protocols.policies import TimeoutMixin
 
+import metrics
+
 
 class _SMTPConnectProtocol(basic.LineReceiver, TimeoutMixin):
     timeout = None
@@ -28,6 +30,7 @@ class _SMTPConnectProtocol(basic.LineReceiver, TimeoutMixin):
             self.log.debug("Connection to server made")
 
         self.setTimeout(self.timeout)
+        metrics.mark(self.factory.result, metrics.CONNECT)
 
         self._expected = [220]
         self._okresponse = self.smtpState_helo
@@ -51,6 +54,10 @@ class _SMTPConnectProtocol(basic.LineReceiver, TimeoutMixin):
 
         self.resetTimeout()
 
+        # the result is gone once the check has been completed
+        if hasattr(self.factory, "result"):
+            metrics.mark(self.factory.result, metrics.FIRST_BYTE)
+
         why = None
 
         try:
@@ -97,6 +104,10 @@ class _SMTPConnectProtocol(basic.LineReceiver, TimeoutMixin):
     def smtpState_disconnect(self, code, resp):
         self.transport.loseConnection()
 
+        # the result is gone once the check has been completed or cancelled
+        if not hasattr(self.factory, "result"):
+            return
+
         if code in SUCCESS:
             self.factory.result.callback(code)
         else:
@@ -133,6 +144,7 @@ class _SMTPConnectProtocol(basic.LineReceiver, TimeoutMixin):
 class _SMTPConnectFactory(ClientFactory):
     domain = DNSNAME
     protocol = _SMTPConnectProtocol
+    cancelled = False
 
     def __init__(self, deferred, timeout=None, log=None):
         """
@@ -155,6 +167,14 @@ class _SMTPConnectFactory(ClientFactory):
         del self.result
         return result
 
+    def cancel(self, connector):
+        """
+        Closes the connection of a cancelled check. The Deferred fails with a CancelledError, so closing the connection
+        must not fire it as well.
+        """
+        self.cancelled = True
+        connector.disconnect()
+
     def clientConnectionFailed(self, connector, err):
         self._processConnectionError(connector, err)
 
@@ -166,7 +186,8 @@ class _SMTPConnectFactory(ClientFactory):
             err.value = SMTPConnectError(-1, "Unable to connect to server.")
 
         self.currentProtocol = None
-        self.result.errback(err.value)
+        if not self.cancelled and hasattr(self, "result"):
+            self.result.errback(err.value)
 
     def buildProtocol(self, addr):
         p = self.protocol(self.domain, log=self.log)
@@ -193,9 +214,11 @@ class _SMTPConnectFactory(ClientFactory):
 def check(virtual, real, global_config):
     port = virtual.checkport if virtual.checkport else real.port
 
-    deferred = Deferred()
+    # closes the connection if the check is cancelled, e.g. because it exceeded its deadline
+    factory, connector = None, None
+    deferred = Deferred(lambda _: factory.cancel(connector))
 
     factory = _SMTPConnectFactory(deferred, timeout=virtual.negotiatetimeout)
-    reactor.connectTCP(real.ip.exploded.encode(), port, factory, timeout=virtual.negotiatetimeout)
+    connector = reactor.connectTCP(real.ip.exploded.encode(), port, factory, timeout=virtual.negotiatetimeout)
 
     return deferred
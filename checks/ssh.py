@@ -3,10 +3,15 @@ from twisted.conch.ssh import transport
 from twisted.internet import defer, protocol, reactor
 from twisted.internet.defer import Deferred
 
+import metrics
 from pydexceptions import UnexpectedResultException
 
 
 class _SSHCheckClient(transport.SSHClientTransport):
+    def dataReceived(self, data):
+        metrics.mark(self.factory.deferred, metrics.FIRST_BYTE)
+        transport.SSHClientTransport.dataReceived(self, data)
+
     def verifyHostKey(self, pubKey, fingerprint):
         if self.fingerprint is not None and fingerprint != self.fingerprint:
             self.stateGood = False
@@ -23,6 +28,7 @@ class _SSHCheckClient(transport.SSHClientTransport):
 
 class _SSHCheckClientFactory(protocol.ClientFactory):
     protocol = _SSHCheckClient
+    cancelled = False
 
     def __init__(self, deferred, fingerprint=None):
         self.deferred = deferred
@@ -31,14 +37,26 @@ class _SSHCheckClientFactory(protocol.ClientFactory):
     def buildProtocol(self, addr):
         self.p = self.protocol()
         self.p.factory = self
+        metrics.mark(self.deferred, metrics.CONNECT)
         self.p.fingerprint = self.fingerprint
         self.p.stateGood = False
         return self.p
 
+    def cancel(self, connector):
+        """
+        Closes the connection of a cancelled check. The Deferred fails with a CancelledError, so closing the connection
+        must not fire it as well.
+        """
+        self.cancelled = True
+        connector.disconnect()
+
     def clientConnectionFailed(self, connector, reason):
-        self.deferred.errback(reason)
+        if not self.cancelled:
+            self.deferred.errback(reason)
 
     def clientConnectionLost(self, connector, reason):
+        if self.cancelled:
+            return
         if self.p.stateGood:
             self.deferred.callback("ok")
         else:
@@ -48,9 +66,11 @@ class _SSHCheckClientFactory(protocol.ClientFactory):
 def check(virtual, real, global_config):
     port = virtual.checkport if virtual.checkport else real.port
 
-    deferred = Deferred()
+    # closes the connection if the check is cancelled, e.g. because it exceeded its deadline
+    factory, connector = None, None
+    deferred = Deferred(lambda _: factory.cancel(connector))
 
     factory = _SSHCheckClientFactory(deferred, fingerprint=virtual.fingerprint.encode())
-    reactor.connectTCP(virtual.ip.exploded.encode(), port, factory, timeout=virtual.negotiatetimeout)
+    connector = reactor.connectTCP(virtual.ip.exploded.encode(), port, factory, timeout=virtual.negotiatetimeout)
 
     return deferred
@@ -0,0 +1,228 @@
+"""
+Check of the 'external' checktype, which runs 'checkcommand' to decide whether a real server is healthy.
+
+By default, the command is executed for every single check like ldirectord does, with the address and port of the
+virtual service and of the real server as arguments. The real server is healthy if the command exits with status 0.
+
+With 'externalhelpers' set to a number of processes, the command is instead started that many times and kept running.
+Each of these helpers reads one request per line from its standard input, consisting of the same four values separated
+by spaces, and answers with one line on its standard output: 'OK' (optionally followed by a message) if the real server
+is healthy, anything else is taken as the reason why it is not. The helpers are shared by all checks using the same
+command and are reused for every interval. A helper that exceeds 'checktimeout' or exits is replaced by a new one.
+"""
+import collections
+import os
+import shlex
+import signal
+
+from twisted.internet import error, reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ProcessProtocol
+
+from pydexceptions import *
+
+
+def _kill(transport):
+    try:
+        transport.signalProcess(signal.SIGKILL)
+    except error.ProcessExitedAlready:
+        pass
+
+
+class _CommandProtocol(ProcessProtocol):
+    """
+    A command executed for a single check.
+    """
+
+    def __init__(self, deferred):
+        self.deferred = deferred
+        self.output = b""
+
+    def outReceived(self, data):
+        # only the end of the output is kept to report it if the check failed
+        self.output = (self.output + data)[-1024:]
+
+    def processEnded(self, reason):
+        if self.deferred.called:
+            return
+        if reason.check(error.ProcessDone):
+            self.deferred.callback(self.output)
+        elif reason.value.signal is not None:
+            self.deferred.errback(UnexpectedResultException("killed by signal %d" % reason.value.signal))
+        else:
+            output = self.output.decode(errors="replace").strip()
+            self.deferred.errback(UnexpectedResultException("exit status %d: %s" % (reason.value.exitCode, output)))
+
+
+class _Helper(ProcessProtocol):
+    """
+    A long-lived helper answering one request at a time.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.buffer = b""
+        self.current = None  # (Deferred, timeout) of the request in progress
+
+    def outReceived(self, data):
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            self.pool.answered(self, line.decode(errors="replace").strip())
+
+    def errReceived(self, data):
+        self.pool.global_config.log.debug("Helper '%s': %s" % (self.pool.command,
+                                                                data.decode(errors="replace").strip()))
+
+    def processEnded(self, reason):
+        self.pool.ended(self, reason)
+
+
+class HelperPool(object):
+    def __init__(self, command, size, global_config):
+        self.command = command
+        self.args = shlex.split(command)
+        self.size = size
+        self.global_config = global_config
+
+        # variable initialization
+        self.helpers = []
+        self.idle = []
+        self.waiting = collections.deque()  # [request, Deferred, timeout in seconds]
+
+    def stop(self):
+        for helper in self.helpers:
+            _kill(helper.transport)
+
+    def run(self, request, timeout):
+        """
+        Hands a request to the next free helper.
+
+        :return: a Deferred firing with the answer of the helper
+        """
+        entry = [request, None, timeout]
+        d = entry[1] = Deferred(lambda _: self.__cancel(entry))
+        self.waiting.append(entry)
+        self.__dispatch()
+        return d
+
+    def __cancel(self, entry):
+        if entry in self.waiting:
+            self.waiting.remove(entry)
+            return
+
+        # the helper is busy with this request, we cannot tell when it will be ready again
+        for helper in self.helpers:
+            if helper.current is not None and helper.current[0] is entry[1]:
+                _, timer = helper.current
+                if timer.active():
+                    timer.cancel()
+                helper.current = None
+                _kill(helper.transport)
+
+    def __dispatch(self):
+        while self.waiting:
+            if self.idle:
+                helper = self.idle.pop()
+            elif len(self.helpers) < self.size:
+                helper = _Helper(self)
+                reactor.spawnProcess(helper, self.args[0], self.args, env=os.environ)
+                self.helpers.append(helper)
+            else:
+                return
+
+            request, d, timeout = self.waiting.popleft()
+            helper.current = (d, reactor.callLater(timeout, self.__timeout, helper))
+            helper.transport.write(request.encode() + b"\n")
+
+    def __timeout(self, helper):
+        d, _ = helper.current
+        helper.current = None
+        _kill(helper.transport)
+        d.errback(error.TimeoutError(string="no answer from '%s'" % self.command))
+
+    def answered(self, helper, line):
+        if helper.current is None:
+            return  # answer to a request that has been cancelled
+        d, timer = helper.current
+        helper.current = None
+        timer.cancel()
+        self.idle.append(helper)
+
+        if line.split(" ", 1)[0] == "OK":
+            d.callback(line)
+        else:
+            d.errback(UnexpectedResultException(line if line else "empty answer"))
+        self.__dispatch()
+
+    def ended(self, helper, reason):
+        self.helpers.remove(helper)
+        if helper in self.idle:
+            self.idle.remove(helper)
+        if not self.global_config.terminated:
+            self.global_config.log.warning("Helper '%s' exited: %s" % (self.command, str(reason.value)))
+
+        if helper.current is not None:
+            d, timer = helper.current
+            helper.current = None
+            timer.cancel()
+            d.errback(error.ConnectionLost("helper '%s' exited" % self.command))
+
+        # replace it if there is anything left to do
+        if not self.global_config.terminated:
+            self.__dispatch()
+
+
+def __cb_stop_timer(result, timer, protocol):
+    if timer.active():
+        timer.cancel()
+    else:
+        _kill(protocol.transport)
+    return result
+
+
+def check(virtual, real, global_config):
+    if virtual.checkcommand is None:
+        raise IllegalConfigurationException("no 'checkcommand' specified for external check")
+
+    port = virtual.checkport if virtual.checkport else real.port
+    args = [virtual.ip.exploded, str(virtual.port), real.ip.exploded, str(port)]
+
+    # hand the check to a helper if requested
+    if virtual.externalhelpers:
+        key = (virtual.checkcommand, virtual.externalhelpers)
+        pool = global_config.helper_pools.get(key)
+        if pool is None:
+            pool = global_config.helper_pools[key] = HelperPool(virtual.checkcommand, virtual.externalhelpers,
+                                                                global_config)
+        return pool.run(" ".join(args), virtual.checktimeout)
+
+    # execute the command just for this check, it is killed if it does not complete in time
+    protocol = None
+    deferred = Deferred(lambda _: _kill(protocol.transport))
+    protocol = _CommandProtocol(deferred)
+    command = shlex.split(virtual.checkcommand) + args
+    reactor.spawnProcess(protocol, command[0], command, env=os.environ)
+
+    timer = reactor.callLater(virtual.checktimeout, deferred.errback,
+                              error.TimeoutError(string="'%s' did not complete in time" % virtual.checkcommand))
+    deferred.addBoth(__cb_stop_timer, timer, protocol)
+    return deferred
+
+
+def prune(virtuals, global_config):
+    """
+    Terminates the helpers no virtual service uses anymore, e.g. after reloading the configuration.
+    """
+    used = {(virtual.checkcommand, virtual.externalhelpers) for virtual in virtuals}
+    for key in list(global_config.helper_pools):
+        if key not in used:
+            global_config.helper_pools.pop(key).stop()
+
+
+def stop(global_config):
+    """
+    Terminates all helpers.
+    """
+    for pool in global_config.helper_pools.values():
+        pool.stop()
@@ -1,4 +1,5 @@
 import configparser
+import ipaddress
 import json
 import sys
 
@@ -13,7 +14,10 @@ def __illegal_config_value(section, key, value, allowed):
 
 
 def __parse_host(hoststring):
-    tmp1 = hoststring.rsplit(" ", 1)
+    # 'ip:port method [weight]' like ldirectord, the weight defaults to 1
+    tmp1 = hoststring.split()
+    if len(tmp1) not in (2, 3):
+        raise ValueError
     tmp2 = tmp1[0].rsplit(":", 1)
 
     host = tmp2[0]
@@ -27,7 +31,21 @@ def __parse_host(hoststring):
     else:
         raise ValueError
 
-    return host, port, method
+    weight = int(tmp1[2]) if len(tmp1) == 3 else 1
+    if not 0 <= weight <= 65535:
+        raise ValueError
+
+    return host, port, method, weight
+
+
+def __parse_address(addressstring):
+    host, port = addressstring.rsplit(":", 1)
+    host = ipaddress.ip_address(host.strip("[]")).exploded
+    port = int(port)
+    if not 0 < port < 65536:
+        raise ValueError
+
+    return host, port
 
 
 def parse_config(file):
@@ -43,6 +61,7 @@ def parse_config(file):
         if section == "global":
             global_args = dict()
             global_args["configfile"] = file
+            cur_section = config[section]
             for key in config[section]:
                 if key == "autoreload":
                     try:
@@ -66,6 +85,66 @@ def parse_config(file):
                     global_args["maintenancedir"] = cur_section[key]
                 elif key == "configfile":
                     global_args["configfile"] = cur_section[key]
+                elif key == "ipvsbackend":
+                    raw = cur_section[key]
+                    if raw == "ipvsadm":
+                        global_args["ipvsbackend"] = IPVSBackend.ipvsadm
+                    elif raw == "netlink":
+                        global_args["ipvsbackend"] = IPVSBackend.netlink
+                    else:
+                        __illegal_config_value(section, key, cur_section[key], "ipvsadm, netlink")
+                elif key == "ipvsbatchwindow":
+                    try:
+                        global_args["ipvsbatchwindow"] = int(cur_section[key])
+                        if not 0 <= global_args["ipvsbatchwindow"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= ipvsbatchwindow")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= ipvsbatchwindow")
+                elif key == "ipvsconcurrency":
+                    try:
+                        global_args["ipvsconcurrency"] = int(cur_section[key])
+                        if not 0 < global_args["ipvsconcurrency"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 < ipvsconcurrency")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 < ipvsconcurrency")
+                elif key == "checkconcurrency":
+                    try:
+                        global_args["checkconcurrency"] = int(cur_section[key])
+                        if not 0 <= global_args["checkconcurrency"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= checkconcurrency")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= checkconcurrency")
+                elif key == "checkmoduleconcurrency":
+                    try:
+                        global_args["checkmoduleconcurrency"] = json.loads(cur_section[key])
+                        if not isinstance(global_args["checkmoduleconcurrency"], dict) or \
+                                not all(isinstance(limit, int) and 0 < limit
+                                        for limit in global_args["checkmoduleconcurrency"].values()):
+                            __illegal_config_value(section, key, cur_section[key],
+                                                   "a JSON object mapping check-modules to limits > 0")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key],
+                                               "a JSON object mapping check-modules to limits > 0")
+                elif key == "checkworkers":
+                    try:
+                        global_args["checkworkers"] = int(cur_section[key])
+                        if not 0 <= global_args["checkworkers"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= checkworkers")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= checkworkers")
+                elif key == "metricsaddress":
+                    try:
+                        global_args["metricsaddress"] = __parse_address(cur_section[key])
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key],
+                                               "an IP address and a port, e.g. 127.0.0.1:9120 or [::1]:9120")
+                elif key == "reconcileinterval":
+                    try:
+                        global_args["reconcileinterval"] = int(cur_section[key])
+                        if not 0 <= global_args["reconcileinterval"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= reconcileinterval")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= reconcileinterval")
             global_config = GlobalConfig(**global_args)
         else:
             virtual_args = dict()
@@ -76,11 +155,15 @@ def parse_config(file):
             for key in config[section]:
                 if key == "real":
                     for hoststring in json.loads(cur_section[key]):
-                        ip, port, method = __parse_host(hoststring)
-                        real = Real4(ip=ip, port=port, method=method)
+                        try:
+                            ip, port, method, weight = __parse_host(hoststring)
+                        except (ValueError, IndexError):
+                            __illegal_config_value(section, key, hoststring,
+                                                   "ip:port gate|masq|ipip [0 <= weight <= 65535]")
+                        real = Real4(ip=ip, port=port, method=method, weight=weight)
                         reals.append(real)
                 elif key == "fallback":
-                    ip, port, method = __parse_host(cur_section[key])
+                    ip, port, method, _ = __parse_host(cur_section[key])
                     fallback = Fallback4(ip=ip, port=port, method=method)
                 elif key == "host":
                     virtual_args["ip"] = cur_section[key]  # TODO: handle hostnames
@@ -105,6 +188,41 @@ def parse_config(file):
                             __illegal_config_value(section, key, cur_section[key], "0 < checktimeout")
                     except ValueError:
                         __illegal_config_value(section, key, cur_section[key], "0 < checktimeout")
+                elif key == "checkdeadline":
+                    try:
+                        virtual_args["checkdeadline"] = int(cur_section[key])
+                        if not 0 <= virtual_args["checkdeadline"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= checkdeadline")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= checkdeadline")
+                elif key == "externalhelpers":
+                    try:
+                        virtual_args["externalhelpers"] = int(cur_section[key])
+                        if not 0 <= virtual_args["externalhelpers"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= externalhelpers")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= externalhelpers")
+                elif key == "httpkeepalive":
+                    try:
+                        virtual_args["httpkeepalive"] = int(cur_section[key])
+                        if not 0 <= virtual_args["httpkeepalive"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= httpkeepalive")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= httpkeepalive")
+                elif key == "httpreconnect":
+                    try:
+                        virtual_args["httpreconnect"] = int(cur_section[key])
+                        if not 0 <= virtual_args["httpreconnect"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= httpreconnect")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= httpreconnect")
+                elif key == "dbkeepalive":
+                    try:
+                        virtual_args["dbkeepalive"] = int(cur_section[key])
+                        if not 0 <= virtual_args["dbkeepalive"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= dbkeepalive")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= dbkeepalive")
                 elif key == "negotiatetimeout":
                     try:
                         virtual_args["negotiatetimeout"] = int(cur_section[key])
@@ -119,6 +237,39 @@ def parse_config(file):
                             __illegal_config_value(section, key, cur_section[key], "0 < checkinterval")
                     except ValueError:
                         __illegal_config_value(section, key, cur_section[key], "0 < checkinterval")
+                elif key == "checkpriority":
+                    try:
+                        virtual_args["checkpriority"] = int(cur_section[key])
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "an integer")
+                elif key == "checkjitter":
+                    try:
+                        virtual_args["checkjitter"] = int(cur_section[key])
+                        if not 0 <= virtual_args["checkjitter"] <= 100:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= checkjitter <= 100")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= checkjitter <= 100")
+                elif key == "maxcheckinterval":
+                    try:
+                        virtual_args["maxcheckinterval"] = int(cur_section[key])
+                        if not 0 <= virtual_args["maxcheckinterval"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= maxcheckinterval")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= maxcheckinterval")
+                elif key == "fastcheckinterval":
+                    try:
+                        virtual_args["fastcheckinterval"] = int(cur_section[key])
+                        if not 0 <= virtual_args["fastcheckinterval"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= fastcheckinterval")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= fastcheckinterval")
+                elif key == "stablecount":
+                    try:
+                        virtual_args["stablecount"] = int(cur_section[key])
+                        if not 0 < virtual_args["stablecount"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 < stablecount")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 < stablecount")
                 elif key == "failurecount":
                     try:
                         virtual_args["failurecount"] = int(cur_section[key])
@@ -126,6 +277,19 @@ def parse_config(file):
                             __illegal_config_value(section, key, cur_section[key], "0 <= failurecount")
                     except ValueError:
                         __illegal_config_value(section, key, cur_section[key], "0 <= failurecount")
+                elif key == "risecount":
+                    try:
+                        virtual_args["risecount"] = int(cur_section[key])
+                        if not 0 < virtual_args["risecount"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 < risecount")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 < risecount")
+                elif key == "flapdamping":
+                    try:
+                        virtual_args["flapdamping"] = cur_section.getboolean("flapdamping")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key],
+                                               "'yes'/'no', 'on'/'off', 'true'/'false' and '1'/'0'")
                 elif key == "cleanstop":
                     try:
                         virtual_args["cleanstop"] = cur_section.getboolean("cleanstop")
@@ -144,6 +308,13 @@ def parse_config(file):
                     except ValueError:
                         __illegal_config_value(section, key, cur_section[key],
                                                "'yes'/'no', 'on'/'off', 'true'/'false' and '1'/'0'")
+                elif key == "slowstart":
+                    try:
+                        virtual_args["slowstart"] = int(cur_section[key])
+                        if not 0 <= virtual_args["slowstart"]:
+                            __illegal_config_value(section, key, cur_section[key], "0 <= slowstart")
+                    except ValueError:
+                        __illegal_config_value(section, key, cur_section[key], "0 <= slowstart")
                 elif key == "persistent":
                     try:
                         virtual_args["persistent"] = int(cur_section[key])
@@ -205,6 +376,14 @@ def parse_config(file):
                     else:
                         __illegal_config_value(section, key, cur_section[key],
                                                "rr, wrr, lc, wlc, lblc, lblcr, dh, sh, sed, nq")
+                elif key == "weighting":
+                    raw = cur_section[key]
+                    if raw == "static":
+                        virtual_args["weighting"] = Weighting.static
+                    elif raw == "latency":
+                        virtual_args["weighting"] = Weighting.latency
+                    else:
+                        __illegal_config_value(section, key, cur_section[key], "static, latency")
                 elif key == "httpmethod":
                     raw = cur_section[key]
                     if raw == "get":
@@ -4,6 +4,8 @@ from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ClientEndpoint, TCP6ClientEndpoint
 from twisted.internet.protocol import Protocol, Factory
 
+import metrics
+
 from structures import Virtual4, Virtual6
 
 
@@ -16,7 +18,8 @@ class _DummyFactory(Factory):
         return _DummyProtocol()
 
 
-def __cb_connection_established(protocol):
+def __cb_connection_established(protocol, d):
+    metrics.mark(d, metrics.CONNECT)
     protocol.transport.loseConnection()
 
 
@@ -32,5 +35,5 @@ def check(virtual, real, global_config):
         sys.exit(1)
 
     d = point.connect(_DummyFactory())
-    d.addCallback(__cb_connection_established)
+    d.addCallback(__cb_connection_established, d)
     return d
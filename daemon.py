@@ -165,6 +165,33 @@ class Daemon:
         self.stop()
         self.start()
 
+    def reload(self):
+        """Make the daemon reload its configuration."""
+        self.send_signal(signal.SIGHUP)
+
+    def send_signal(self, signum):
+        """Send a signal to the daemon."""
+
+        # Get the pid from the pidfile
+        try:
+            with open(self.pidfile, 'r') as pf:
+                pid = int(pf.read().strip())
+        except IOError:
+            pid = None
+
+        if not pid:
+            message = "pidfile {0} does not exist. " + \
+                      "Daemon not running?\n"
+            sys.stderr.write(message.format(self.pidfile))
+            sys.exit(1)
+
+        # Send the signal
+        try:
+            os.kill(pid, signum)
+        except OSError as err:
+            print(str(err.args))
+            sys.exit(1)
+
     def run(self):
         """You should override this method when you subclass Daemon.
 
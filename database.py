@@ -0,0 +1,128 @@
+"""
+Common base of the check-modules running a query against a database. The blocking DB-API calls of all of these checks
+are executed by a single thread pool of 'database_threads' threads instead of a connection pool with a thread of its own
+per real server:
+
+* by default, every check opens a new connection and closes it once the query completed,
+* with 'dbkeepalive' set, the connection is kept open for up to that many idle seconds and reused by the next check. It
+  is closed right away if a check failed, so the next check connects again.
+"""
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+import external
+import target
+from pydexceptions import *
+
+
+def thread_pool(global_config):
+    """
+    :return: the thread pool shared by all database checks, it is started on first use
+    """
+    if global_config.db_threadpool is None:
+        global_config.db_threadpool = ThreadPool(minthreads=0, maxthreads=external.database_threads,
+                                                 name="database checks")
+        global_config.db_threadpool.start()
+        # the connections closed while cleaning up are closed before the thread pool stops
+        reactor.addSystemEventTrigger("during", "shutdown", __stop, global_config)
+    return global_config.db_threadpool
+
+
+def __stop(global_config):
+    global_config.db_threadpool.stop()
+    global_config.db_threadpool = None
+
+
+class DatabaseTarget(target.CheckTarget):
+    """
+    Runs the query 'request' which has to return at least one row. Subclasses provide the DB-API module as 'dbapi', the
+    name of the database used in messages as 'name' and the name of the password argument of its 'connect' as
+    'password'.
+    """
+    dbapi = None
+    name = None
+    password = 'password'
+
+    def __init__(self, virtual, real, global_config):
+        super(DatabaseTarget, self).__init__(virtual, real, global_config)
+
+        # prepare the parameters of the connection and perform some sanity checks
+        self.db_args = dict()
+        self.db_args['connect_timeout'] = virtual.negotiatetimeout
+        self.db_args['host'] = real.ip.exploded
+        self.db_args['port'] = virtual.checkport if virtual.checkport else real.port
+        self.db_args[self.password] = virtual.passwd if virtual.passwd else ""
+        if virtual.login is None:
+            raise IllegalConfigurationException("no username ('login') specified for %s check" % self.name)
+        else:
+            self.db_args['user'] = virtual.login
+        if virtual.database is None:
+            raise IllegalConfigurationException("no database specified for %s check" % self.name)
+        else:
+            self.db_args['database'] = virtual.database
+        if virtual.request is None:
+            raise IllegalConfigurationException("no query ('request') specified for %s check" % self.name)
+
+        # variable initialization
+        self.connection = None  # idle connection kept for the next check
+        self.idle_call = None
+
+    def connect(self):
+        return self.dbapi.connect(**self.db_args)
+
+    def probe(self):
+        # the connection belongs to the thread running the query until it is handed back
+        connection = self.connection
+        self.connection = None
+        if self.idle_call is not None and self.idle_call.active():
+            self.idle_call.cancel()
+        self.idle_call = None
+
+        d = threads.deferToThreadPool(reactor, thread_pool(self.global_config), self.__query, connection)
+        d.addCallback(self.__cb_check_value)
+        return d
+
+    def __query(self, connection):
+        if connection is None:
+            connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(self.virtual.request, ())
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            self.__close(connection)
+            raise
+
+        if self.virtual.dbkeepalive:
+            return connection, rows
+        self.__close(connection)
+        return None, rows
+
+    def __cb_check_value(self, result):
+        self.connection, value = result
+        if value is None or len(value) == 0:
+            self.__release()
+            raise UnexpectedResultException("got nothing, expected something")
+        if self.connection is not None:
+            self.idle_call = reactor.callLater(self.virtual.dbkeepalive, self.__release)
+
+    def __close(self, connection):
+        try:
+            connection.close()
+        except Exception as e:
+            self.global_config.log.error("Closing the %s connection failed: %s" % (self.name, str(e)))
+
+    def __release(self):
+        self.idle_call = None
+        connection = self.connection
+        self.connection = None
+        if connection is not None:
+            thread_pool(self.global_config).callInThread(self.__close, connection)
+
+    def teardown(self):
+        if self.idle_call is not None and self.idle_call.active():
+            self.idle_call.cancel()
+        self.__release()
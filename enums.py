@@ -83,4 +83,30 @@ class Action(Enum):
     restart = 2
     reload = 3
     status = 4
-    force_start = 5
\ No newline at end of file
+    force_start = 5
+    stats = 6
+
+
+class IPVSBackend(Enum):
+    ipvsadm = 0
+    netlink = 1
+
+
+class IPVSCommand(Enum):
+    add = 0
+    edit = 1
+    delete = 2
+
+
+class Weighting(Enum):
+    static = 0
+    latency = 1
+
+
+class Outcome(Enum):
+    ok = 0
+    timeout = 1
+    refused = 2
+    tls = 3
+    mismatch = 4
+    error = 5
@@ -0,0 +1,246 @@
+"""
+Optional HTTP listener exposing the state of PyDirectord in the text format of Prometheus. It is enabled by setting
+'metricsaddress' in the global section.
+
+All values are read from counters that are maintained anyway (the check statistics, the command pipeline, the check
+limiter and the state of the real servers), nothing is computed for a scrape except the text itself. Since the response
+for a large number of real servers is still long, it is produced in small chunks by a cooperative task, so the reactor
+keeps running the checks while a scrape is in progress.
+"""
+import os
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall, TaskDone, TaskStopped, cooperate
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+import external
+import metrics
+from enums import Outcome
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, value) for name, value in sorted(labels.items())) + "}"
+
+
+def _family(name, kind, description):
+    return "# HELP %s %s\n# TYPE %s %s\n" % (name, description, name, kind)
+
+
+def _histogram(name, histogram, **labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(external.check_histogram_buckets + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append("%s_bucket%s %d\n" % (name, _labels(le=bound, **labels), cumulative))
+    lines.append("%s_sum%s %f\n" % (name, _labels(**labels), histogram.sum))
+    lines.append("%s_count%s %d\n" % (name, _labels(**labels), histogram.count))
+    return "".join(lines)
+
+
+# values exported for every (virtual service, real server) pair
+_REAL_GAUGES = (
+    ("pydirectord_real_healthy", "Whether the checks consider the real server to be healthy",
+     lambda real: 0 if real.failed else 1),
+    ("pydirectord_real_present", "Whether the real server is present in the ipvs table",
+     lambda real: 1 if real.is_present else 0),
+    ("pydirectord_real_weight", "Weight of the real server in the ipvs table",
+     lambda real: real.current_weight),
+    ("pydirectord_real_target_weight", "Weight the real server is supposed to have in the ipvs table",
+     lambda real: real.target_weight),
+    ("pydirectord_real_configured_weight", "Weight of the real server in the configuration",
+     lambda real: real.weight),
+    ("pydirectord_real_failcount", "Number of consecutive failed checks of the real server",
+     lambda real: real.failcount),
+    ("pydirectord_real_suppressed", "Whether the real server is kept out of the ipvs table for flapping",
+     lambda real: 1 if real.suppressed else 0),
+    ("pydirectord_real_latency_seconds", "Smoothed duration of the successful checks of the real server",
+     lambda real: real.latency),
+)
+
+
+class _MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, exporter):
+        super(_MetricsResource, self).__init__()
+        self.exporter = exporter
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+
+        task = cooperate(request.write(chunk.encode()) for chunk in self.exporter.render())
+        task.whenDone().addCallbacks(lambda _: request.finish(), self.__cb_failed, errbackArgs=(request,))
+        request.notifyFinish().addErrback(self.__cb_disconnected, task)
+        return NOT_DONE_YET
+
+    def __cb_failed(self, failure, request):
+        # the task is stopped once the client went away, there is nobody left to respond to
+        if failure.check(TaskStopped):
+            return
+        self.exporter.global_config.log.error("Rendering the metrics failed: %s" % str(failure.value))
+        # the status has been sent already, so only an incomplete response tells the client that something went wrong
+        request.loseConnection()
+
+    @staticmethod
+    def __cb_disconnected(_, task):
+        # stop rendering for a client that went away
+        try:
+            task.stop()
+        except TaskDone:
+            pass
+
+
+class Exporter(object):
+    def __init__(self, virtuals, global_config):
+        self.virtuals = virtuals
+        self.global_config = global_config
+
+        # variable initialization
+        self.port = None
+        self.lag = 0.0
+        self.lag_histogram = metrics.Histogram()
+        self.last_tick = None
+        self.loop = LoopingCall(self.__measure_lag)
+
+    def start(self):
+        host, port = self.global_config.metricsaddress
+        self.port = reactor.listenTCP(port, Site(_MetricsResource(self)), interface=host)
+        self.loop.start(external.exporter_lag_interval)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+        if self.port is not None:
+            self.port.stopListening()
+            self.port = None
+
+    def __measure_lag(self):
+        # how much later than requested the reactor got around to calling us
+        now = reactor.seconds()
+        if self.last_tick is not None:
+            self.lag = max(0.0, now - self.last_tick - external.exporter_lag_interval)
+            self.lag_histogram.observe(self.lag)
+        self.last_tick = now
+
+    def render(self):
+        """
+        Produces the metrics in the text format of Prometheus.
+
+        :return: a generator of chunks of the response
+        """
+        global_config = self.global_config
+
+        # per (virtual service, real server) pair, one chunk per virtual service and metric
+        for name, description, value in _REAL_GAUGES:
+            yield _family(name, "gauge", description)
+            for virtual in self.virtuals:
+                virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+                lines = []
+                for real in virtual.real:
+                    current = value(real)
+                    if current is not None:
+                        labels = _labels(virtual=virtual_hostname, real=real.ip.exploded + ":" + str(real.port))
+                        lines.append("%s%s %s\n" % (name, labels, current))
+                yield "".join(lines)
+
+        name = "pydirectord_real_check_duration_seconds"
+        yield _family(name, "summary", "Duration of the checks of the real server")
+        for virtual in self.virtuals:
+            virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+            lines = []
+            for real in virtual.real:
+                if real.probe is not None:
+                    labels = _labels(virtual=virtual_hostname, real=real.ip.exploded + ":" + str(real.port))
+                    duration = real.probe.metrics.duration
+                    lines.append("%s_sum%s %f\n%s_count%s %d\n" % (name, labels, duration.sum, name, labels,
+                                                                     duration.count))
+            yield "".join(lines)
+
+        # per check-module
+        module_metrics = sorted(global_config.check_metrics.items())
+        for name, description, phase in (
+                ("pydirectord_check_duration_seconds", "Duration of the checks", "duration"),
+                ("pydirectord_check_connect_seconds", "Time until the connection of a check was established",
+                 "connect"),
+                ("pydirectord_check_first_byte_seconds", "Time until the first response to a check arrived",
+                 "first_byte")):
+            yield _family(name, "histogram", description)
+            yield "".join(_histogram(name, getattr(entry, phase), module=module) for module, entry in module_metrics)
+
+        yield _family("pydirectord_checks_total", "counter", "Number of completed checks by their outcome")
+        yield "".join("pydirectord_checks_total%s %d\n" % (_labels(module=module, outcome=outcome.name),
+                                                          entry.outcomes[outcome.value])
+                      for module, entry in module_metrics for outcome in Outcome)
+
+        yield _family("pydirectord_tls_handshakes_total", "counter",
+                      "Number of TLS handshakes of the checks by whether they resumed a session")
+        yield "".join("pydirectord_tls_handshakes_total%s %d\n" % (_labels(module=module, kind=kind), count)
+                      for module, entry in module_metrics for kind, count in sorted(entry.handshakes.items())
+                      if any(entry.handshakes.values()))
+
+        yield _family("pydirectord_check_timeouts_total", "counter", "Number of checks cancelled at their deadline")
+        yield "pydirectord_check_timeouts_total %d\n" % global_config.check_timeouts
+        yield _family("pydirectord_probes", "gauge", "Number of distinct probes")
+        yield "pydirectord_probes %d\n" % len(global_config.probes)
+
+        if global_config.check_limiter is not None:
+            stats = global_config.check_limiter.stats()
+            yield _family("pydirectord_checks_running", "gauge", "Number of checks in progress")
+            yield "pydirectord_checks_running %d\n" % stats["running"]
+            yield _family("pydirectord_checks_waiting", "gauge", "Number of checks waiting for a free slot")
+            yield "pydirectord_checks_waiting %d\n" % stats["waiting"]
+            yield _family("pydirectord_checks_delayed_total", "counter", "Number of checks that had to wait")
+            yield "pydirectord_checks_delayed_total %d\n" % stats["delayed"]
+
+        # the command pipeline of the ipvs table
+        pipeline = global_config.pipeline
+        if pipeline is not None:
+            stats = pipeline.stats()
+            for name, kind, description, value in (
+                    ("pydirectord_ipvs_queue_depth", "gauge", "Number of ipvs commands waiting to be executed",
+                     stats["queue_depth"]),
+                    ("pydirectord_ipvs_in_flight", "gauge", "Number of ipvs commands being executed",
+                     stats["in_flight"]),
+                    ("pydirectord_ipvs_commands_total", "counter", "Number of ipvs commands submitted",
+                     stats["submitted"]),
+                    ("pydirectord_ipvs_commands_coalesced_total", "counter",
+                     "Number of ipvs commands superseded before their execution", stats["coalesced"]),
+                    ("pydirectord_ipvs_commands_executed_total", "counter", "Number of ipvs commands executed",
+                     stats["executed"]),
+                    ("pydirectord_ipvs_commands_failed_total", "counter", "Number of failed ipvs commands",
+                     stats["failed"]),
+                    ("pydirectord_ipvs_drift_total", "counter", "Number of repaired differences of the ipvs table",
+                     stats["drifted"])):
+                yield _family(name, kind, description)
+                yield "%s %s\n" % (name, value)
+
+            name = "pydirectord_ipvs_command_latency_seconds"
+            yield _family(name, "summary", "Time from the submission of ipvs commands until their confirmation")
+            yield "%s_sum %f\n%s_count %d\n" % (name, pipeline.latency_sum, name, pipeline.latency_count)
+
+        # the process itself
+        yield _family("pydirectord_reactor_lag_seconds", "histogram", "Delay of timed calls of the reactor")
+        yield _histogram("pydirectord_reactor_lag_seconds", self.lag_histogram)
+        try:
+            with open("/proc/self/statm") as f:
+                resident = int(f.read().split()[1]) * _PAGE_SIZE
+            yield _family("process_resident_memory_bytes", "gauge", "Resident memory size in bytes")
+            yield "process_resident_memory_bytes %d\n" % resident
+            yield _family("process_open_fds", "gauge", "Number of open file descriptors")
+            yield "process_open_fds %d\n" % len(os.listdir("/proc/self/fd"))
+        except OSError:
+            pass
+
+
+def start_exporter(virtuals, global_config):
+    """
+    Starts the metrics exporter, if an address is configured for it.
+    """
+    if global_config.metricsaddress is not None:
+        global_config.exporter = Exporter(virtuals, global_config)
+        global_config.exporter.start()
@@ -1,6 +1,50 @@
 # ipvsadm related configuration
 ipvsadm_name = "ipvsadm"
 ipvsadm_path = "/sbin/ipvsadm"
+ipvs_proc_path = "/proc/net/ip_vs"
+
+# ipvs command pipeline related configuration
+ipvs_retry_delay = 0.5
+ipvs_retry_max_delay = 30
+
+# check scheduling related configuration
+check_wheel_tick = 0.1
+check_wheel_slots = 256
+check_wheel_levels = 4
+
+# check worker related configuration
+worker_ring_replicas = 64
+worker_restart_delay = 5
+worker_spec_cache = 65536
+
+# check instrumentation related configuration, upper bounds of the histogram buckets in seconds
+check_histogram_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# metrics exporter related configuration
+exporter_lag_interval = 1
+
+# slow-start related configuration
+slowstart_max_steps = 10
+
+# flap damping related configuration
+flap_penalty = 1000
+flap_suppress = 2000
+flap_reuse = 750
+flap_half_life = 300
+
+# latency weighting related configuration
+latency_ewma_alpha = 0.3
+latency_weight_min = 0.1
+latency_weight_max = 1.0
+latency_weight_hysteresis = 0.1
+
+# netlink related configuration
+netlink_batch_size = 65536
+netlink_receive_buffer = 1048576
+netlink_sync_timeout = 5
+
+# database check related configuration
+database_threads = 16
 
 # check-module related configuration
 check_path = "/home/martin/git/pydirectord/checks/"
@@ -11,3 +55,4 @@ config_check_period = 10
 
 # run directory related configuration
 pid_path = "/run/"
+stats_timeout = 5
@@ -0,0 +1,333 @@
+"""
+Backend-independent access to the ipvs table of the kernel. All changes are forwarded to the backend selected during
+the sanity check, i.e. either the 'ipvsadm' tool or the generic-netlink interface of the kernel. Synchronous changes are
+executed immediately, all others are handed to the command pipeline.
+"""
+import ipaddress
+import subprocess
+import sys
+
+import external
+import pipeline
+from enums import *
+from pydexceptions import IPVSException
+from structures import Real4, Real6
+
+# errors a backend raises when a synchronous command fails
+IPVS_ERRORS = (subprocess.CalledProcessError, IPVSException, OSError)
+
+# names used in /proc/net/ip_vs
+__PROTOCOLS = {"TCP": Protocol.tcp, "UDP": Protocol.udp}
+__FORWARDING_METHODS = {"Route": ForwardingMethod.gate, "Masq": ForwardingMethod.masq, "Tunnel": ForwardingMethod.ipip}
+
+
+def virtual_key(virtual):
+    """
+    Identifies a virtual service independent of its configuration object.
+    """
+    return virtual.protocol, virtual.ip.exploded, virtual.port
+
+
+def real_key(virtual, real):
+    """
+    Identifies a real server (or fallback) of a virtual service independent of its configuration object.
+    """
+    return virtual_key(virtual), real.ip.exploded, real.port
+
+
+class Command(object):
+    """
+    A single change of the ipvs table concerning either a virtual service or one of its real servers (or fallbacks).
+    """
+
+    def __init__(self, action, virtual, real=None):
+        self.action = action
+        self.virtual = virtual
+        self.real = real
+
+        # the state the entry is supposed to be in afterwards
+        if real is None:
+            self.key = virtual_key(virtual)
+            self.present = virtual.target_present
+            self.value = virtual.scheduler if self.present else None
+        else:
+            self.key = real_key(virtual, real)
+            self.present = real.target_present
+            self.value = real.target_weight if self.present else None
+
+    def __str__(self):
+        description = self.action.name + " " + self.virtual.ip.exploded + ":" + str(self.virtual.port)
+        if self.real is not None:
+            description += " real " + self.real.ip.exploded + ":" + str(self.real.port)
+        if self.value is not None:
+            description += " (" + (self.value.name if self.real is None else str(self.value)) + ")"
+        return description
+
+
+def __parse_address(raw):
+    # IPv6 addresses are printed in brackets, IPv4 addresses as a single hex number
+    if raw.startswith("["):
+        host, port = raw[1:].rsplit("]:", 1)
+        ip = ipaddress.ip_address(host)
+    else:
+        host, port = raw.rsplit(":", 1)
+        ip = ipaddress.ip_address(int(host, 16))
+    return ip.exploded, int(port, 16)
+
+
+def read_ipvs_table(global_config):
+    """
+    Reads the complete ipvs table of the kernel with a single read of /proc/net/ip_vs.
+
+    :param global_config: the global configuration
+    :return: a dict mapping virtual keys to tuples of the scheduler and a dict mapping the (ip, port) of each real
+             server to a tuple of its forwarding method and its weight. The scheduler or forwarding method is None if it
+             is unknown to PyDirectord.
+    """
+    table = dict()
+
+    try:
+        with open(external.ipvs_proc_path, "r") as f:
+            lines = f.read().splitlines()
+    except IOError as e:
+        global_config.log.debug("Could not read the ipvs table (%s), assuming it is empty" % str(e))
+        return table
+
+    reals = None
+    for line in lines[3:]:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+
+        if fields[0] == "->":
+            if reals is None:
+                continue  # real server of a service we do not handle
+            reals[__parse_address(fields[1])] = (__FORWARDING_METHODS.get(fields[2]), int(fields[3]))
+        elif fields[0] in __PROTOCOLS:
+            ip, port = __parse_address(fields[1])
+            try:
+                scheduler = Scheduler[fields[2]]
+            except KeyError:
+                scheduler = None
+            reals = dict()
+            table[(__PROTOCOLS[fields[0]], ip, port)] = (scheduler, reals)
+        else:
+            reals = None  # e.g. firewall-mark services
+
+    return table
+
+
+def lookup(table, key):
+    """
+    Looks up the state of a virtual service or real server in a table returned by read_ipvs_table.
+
+    :return: None if the entry is not present, a tuple of True and its scheduler or weight otherwise
+    """
+    if isinstance(key[0], Protocol):
+        if key in table:
+            return True, table[key][0]
+    elif key[0] in table:
+        reals = table[key[0]][1]
+        if (key[1], key[2]) in reals:
+            return True, reals[(key[1], key[2])][1]
+    return None
+
+
+def __stale_real(virtual, ip, port):
+    # placeholder for a real server found in the ipvs table which is not part of the configuration
+    if virtual.ip.version == 4:
+        return Real4(ip=ip, port=port, method=ForwardingMethod.gate)
+    else:
+        return Real6(ip=ip, port=port, method=ForwardingMethod.gate)
+
+
+def __setup_step(function, description, global_config, *args, critical=True):
+    global_config.log.info(description)
+    try:
+        function(*args, global_config, True)
+    except IPVS_ERRORS:
+        if critical:
+            global_config.log.critical(description + " failed during initialization")
+            sys.exit(1)
+        else:
+            global_config.log.error(description + " failed during initialization")
+
+
+def initial_ipvs_setup(virtuals, global_config):
+    """
+    Brings the ipvs table of the kernel in line with the configuration. The table is read once and only the differences
+    are applied, virtual services and real servers that are already set up correctly are adopted as they are, so
+    restarting PyDirectord does not disturb any established connection.
+
+    :param virtuals: the list containing all virtual services.
+    :param global_config: the global configuration
+    :return: nothing
+    """
+    global_config.log.debug("Beginning initial ipvs table setup")
+    table = read_ipvs_table(global_config)
+    global_config.pipeline = pipeline.CommandPipeline(global_config, table)
+
+    for virtual in virtuals:
+        virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+
+        # add the virtual service or correct its scheduler
+        key = virtual_key(virtual)
+        if key not in table:
+            __setup_step(add_virtual_service, "Adding virtual service for " + virtual_hostname, global_config, virtual)
+            present = dict()
+        else:
+            scheduler, present = table[key]
+            if scheduler != virtual.scheduler:
+                __setup_step(edit_virtual_service, "Setting scheduler of virtual service " + virtual_hostname + " to "
+                             + virtual.scheduler.name, global_config, virtual)
+            else:
+                global_config.log.info("Keeping virtual service " + virtual_hostname)
+                virtual.is_present = virtual.target_present = True
+
+        # adopt existing real servers with their current weight, add missing ones if we are quiescent
+        healthy = False
+        for real in virtual.real:
+            real_hostname = real.ip.exploded + ":" + str(real.port)
+            if (real.ip.exploded, real.port) in present:
+                method, weight = present.pop((real.ip.exploded, real.port))
+                real.target_weight = min(weight, real.weight)
+                if (method is not None and method != real.method) or weight != real.target_weight:
+                    __setup_step(edit_real_server, "Setting real server " + real_hostname + " to "
+                                 + str(real.target_weight), global_config, virtual, real)
+                else:
+                    global_config.log.info("Keeping real server " + real_hostname + " with " + str(real.target_weight))
+                    real.is_present = real.target_present = True
+                    real.current_weight = real.target_weight
+                healthy = healthy or real.target_weight > 0
+            elif virtual.quiescent:
+                __setup_step(add_real_server, "Adding real server " + real_hostname, global_config, virtual, real)
+
+        # the fallback is only needed if none of the adopted real servers carries any weight
+        fallback = virtual.fallback
+        if fallback is not None:
+            in_table = (fallback.ip.exploded, fallback.port) in present
+            method, weight = present.pop((fallback.ip.exploded, fallback.port), (None, None))
+            if healthy:
+                fallback.target_weight = 0
+                if in_table:
+                    __setup_step(delete_real_server, "Removing fallback server for " + virtual_hostname,
+                                 global_config, virtual, fallback, critical=False)
+            else:
+                fallback.target_weight = 1
+                if not in_table:
+                    __setup_step(add_real_server, "Adding fallback server for " + virtual_hostname, global_config,
+                                 virtual, fallback)
+                elif (method is not None and method != fallback.method) or weight != fallback.target_weight:
+                    __setup_step(edit_real_server, "Setting fallback server for " + virtual_hostname + " to "
+                                 + str(fallback.target_weight), global_config, virtual, fallback)
+                else:
+                    fallback.is_present = fallback.target_present = True
+                    fallback.current_weight = fallback.target_weight
+
+        # remove real servers which are not configured (anymore)
+        for (ip, port) in present:
+            __setup_step(delete_real_server, "Removing unconfigured real server " + ip + ":" + str(port),
+                         global_config, virtual, __stale_real(virtual, ip, port), critical=False)
+
+    global_config.log.debug("Initial ipvs table setup done")
+
+
+def __repair(command, state, global_config):
+    global_config.log.warning("ipvs table drifted from the configuration, repairing: " + str(command))
+    global_config.pipeline.drifted += 1
+    global_config.pipeline.observed(command, state)
+    global_config.pipeline.submit(command)
+
+
+def reconcile(virtuals, global_config):
+    """
+    Compares the ipvs table of the kernel to the state the configuration and the health checks demand, e.g. to notice
+    that the table has been flushed by hand, and repairs the differences. The table is read once for all virtual
+    services, entries with a change on its way are left alone.
+
+    :param virtuals: the list containing all virtual services.
+    :param global_config: the global configuration
+    :return: the number of entries that had to be repaired
+    """
+    table = read_ipvs_table(global_config)
+    pipeline = global_config.pipeline
+    drifted = pipeline.drifted
+
+    for virtual in virtuals:
+        key = virtual_key(virtual)
+        if pipeline.busy(key):
+            continue
+
+        state = lookup(table, key)
+        if virtual.target_present:
+            if state is None:
+                __repair(Command(IPVSCommand.add, virtual), state, global_config)
+            elif state[1] is not None and state[1] != virtual.scheduler:
+                __repair(Command(IPVSCommand.edit, virtual), state, global_config)
+        else:
+            if state is not None:
+                __repair(Command(IPVSCommand.delete, virtual), state, global_config)
+            continue
+
+        # real servers of a missing virtual service are added back after it
+        present = dict(table[key][1]) if key in table else dict()
+        for real in virtual.real + ([virtual.fallback] if virtual.fallback is not None else []):
+            state = lookup(table, real_key(virtual, real))
+            present.pop((real.ip.exploded, real.port), None)
+            if pipeline.busy(real_key(virtual, real)):
+                continue
+
+            if real.target_present:
+                if state is None:
+                    __repair(Command(IPVSCommand.add, virtual, real), state, global_config)
+                elif state[1] != real.target_weight:
+                    __repair(Command(IPVSCommand.edit, virtual, real), state, global_config)
+            elif state is not None:
+                __repair(Command(IPVSCommand.delete, virtual, real), state, global_config)
+
+        # real servers somebody else added
+        for (ip, port), (_, weight) in present.items():
+            stale = __stale_real(virtual, ip, port)
+            if not pipeline.busy(real_key(virtual, stale)):
+                __repair(Command(IPVSCommand.delete, virtual, stale), (True, weight), global_config)
+
+    return pipeline.drifted - drifted
+
+
+def __execute(command, global_config, sync):
+    if sync:
+        global_config.log.debug(str(command))
+        global_config.ipvs.execute_sync(command, global_config)
+        global_config.pipeline.applied(command)
+    else:
+        global_config.pipeline.submit(command)
+
+
+def add_virtual_service(virtual, global_config, sync=False):
+    virtual.target_present = True
+    __execute(Command(IPVSCommand.add, virtual), global_config, sync)
+
+
+def delete_virtual_service(virtual, global_config, sync=False):
+    virtual.target_present = False
+    __execute(Command(IPVSCommand.delete, virtual), global_config, sync)
+
+
+def edit_virtual_service(virtual, global_config, sync=False):
+    virtual.target_present = True
+    __execute(Command(IPVSCommand.edit, virtual), global_config, sync)
+
+
+def add_real_server(virtual, real, global_config, sync=False):
+    real.target_present = True
+    __execute(Command(IPVSCommand.add, virtual, real), global_config, sync)
+
+
+def delete_real_server(virtual, real, global_config, sync=False):
+    real.target_present = False
+    __execute(Command(IPVSCommand.delete, virtual, real), global_config, sync)
+
+
+def edit_real_server(virtual, real, global_config, sync=False):
+    real.target_present = True
+    __execute(Command(IPVSCommand.edit, virtual, real), global_config, sync)
@@ -1,130 +1,25 @@
+"""
+Backend using the 'ipvsadm' tool. Synchronous commands are executed one by one, batches of asynchronous commands are
+applied together by a single 'ipvsadm --restore' process. Since 'ipvsadm --restore' only reports the exit status of the
+last line it processed, the outcome of every command is verified against the ipvs table afterwards.
+"""
 import subprocess
-import sys
 
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.internet.protocol import ProcessProtocol
 
 import external
+import ipvs
 from enums import *
 
 
-def initial_ipvs_setup(virtuals, global_config):
-    global_config.log.debug("Beginning initial ipvs table setup")
-    for virtual in virtuals:
-        virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-
-        # delete the virtual service in case it might be present
-        try:
-            delete_virtual_service(virtual, global_config, True)
-        except subprocess.CalledProcessError:
-            global_config.log.debug(
-                "Deleting the virtual service for " + virtual_hostname + " failed during initialization (probably ok)")
-
-        # add the virtual service
-        global_config.log.info("Adding virtual service for " + virtual_hostname)
-        try:
-            add_virtual_service(virtual, global_config, True)
-        except subprocess.CalledProcessError:
-            global_config.log.critical(
-                "Adding the virtual service for " + virtual_hostname + " failed during initialization")
-            sys.exit(1)
-
-        # loop all real servers and set them up if we quiescent
-        if virtual.quiescent:
-            for real in virtual.real:
-                real_hostname = real.ip.exploded + ":" + str(real.port)
-                global_config.log.info("Adding real server " + real_hostname)
-                try:
-                    add_real_server(virtual, real, global_config, True)
-                except subprocess.CalledProcessError:
-                    global_config.log.critical(
-                        "Adding the real server " + real_hostname + " failed during initialization")
-                    sys.exit(1)
-
-        # add the fallback if it exists
-        if virtual.fallback is not None:
-            global_config.log.info("Adding fallback server for " + virtual_hostname)
-            try:
-                add_real_server(virtual, virtual.fallback, global_config, True)
-            except:
-                global_config.log.critical(
-                    "Adding the fallback server for " + virtual_hostname + " failed during initialization")
-                sys.exit(1)
-    global_config.log.debug("Initial ipvs table setup done")
-
-
-def add_virtual_service(virtual, global_config, sync=False):
-    args = [external.ipvsadm_name, "-A"]
-
-    # use correct protocol
-    if virtual.protocol == Protocol.tcp:
-        args.append("-t")
-    elif virtual.protocol == Protocol.udp:
-        args.append("-u")
-    elif virtual.protocol == Protocol.fwm:
-        raise NotImplementedError("firewall-marks are not implemented yet")
-    else:
-        raise ValueError
-
-    # set virtual hostname
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-    args.append(virtual_hostname)
-
-    # set scheduler
-    args.append("-s")
-    args.append(virtual.scheduler.name)
-
-    global_config.log.debug(args)
-
-    # execute the prepared command
-    if sync:
-        args[0] = external.ipvsadm_path
-        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
-    else:
-        reactor.spawnProcess(__IPVSProcessProtocol(global_config), external.ipvsadm_path, args, {})
-
-    # set is_present
-    virtual.is_present = True
-
-
-def delete_virtual_service(virtual, global_config, sync=False):
-    args = [external.ipvsadm_name, "-D"]
-
-    # use correct protocol
-    if virtual.protocol == Protocol.tcp:
-        args.append("-t")
-    elif virtual.protocol == Protocol.udp:
-        args.append("-u")
-    elif virtual.protocol == Protocol.fwm:
-        raise NotImplementedError("firewall-marks are not implemented yet")
-    else:
-        raise ValueError
-
-    # set virtual hostname
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-    args.append(virtual_hostname)
-
-    global_config.log.debug(args)
-
-    # execute the prepared command
-    if sync:
-        args[0] = external.ipvsadm_path
-        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
-    else:
-        reactor.spawnProcess(__IPVSProcessProtocol(global_config), external.ipvsadm_path, args, {})
-
-    # set is_present
-    virtual.is_present = False
-
-
-def edit_virtual_service(virtual, global_config, sync=False):
-    args = [external.ipvsadm_name, "-E"]
-
+def __service_args(virtual):
     # use correct protocol
     if virtual.protocol == Protocol.tcp:
-        args.append("-t")
+        protocol = "-t"
     elif virtual.protocol == Protocol.udp:
-        args.append("-u")
+        protocol = "-u"
     elif virtual.protocol == Protocol.fwm:
         raise NotImplementedError("firewall-marks are not implemented yet")
     else:
@@ -132,46 +27,16 @@ def edit_virtual_service(virtual, global_config, sync=False):
 
     # set virtual hostname
     virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-    args.append(virtual_hostname)
-
-    # set scheduler
-    args.append("-s")
-    args.append(virtual.scheduler.name)
-
-    global_config.log.debug(args)
-
-    # execute the prepared command
-    if sync:
-        args[0] = external.ipvsadm_path
-        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
-    else:
-        reactor.spawnProcess(__IPVSProcessProtocol(global_config), external.ipvsadm_path, args, {})
-
-    # set is_present
-    virtual.is_present = True
-
-
-def add_real_server(virtual, real, global_config, sync=False):
-    args = [external.ipvsadm_name, "-a"]
-
-    # use correct protocol
-    if virtual.protocol == Protocol.tcp:
-        args.append("-t")
-    elif virtual.protocol == Protocol.udp:
-        args.append("-u")
-    elif virtual.protocol == Protocol.fwm:
-        raise NotImplementedError("firewall-marks are not implemented yet")
-    else:
-        raise ValueError
+    return [protocol, virtual_hostname]
 
-    # set virtual hostname
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-    args.append(virtual_hostname)
 
+def __real_args(real, weight=None):
     # set real hostname
-    args.append("-r")
     real_hostname = real.ip.exploded + ":" + str(real.port)
-    args.append(real_hostname)
+    args = ["-r", real_hostname]
+
+    if weight is None:
+        return args
 
     # set forwarding method
     if real.method == ForwardingMethod.gate:
@@ -185,110 +50,85 @@ def add_real_server(virtual, real, global_config, sync=False):
 
     # set weight
     args.append("-w")
-    args.append(str(real.current_weight))
-
-    global_config.log.debug(args)
-
-    # execute the prepared command
-    if sync:
-        args[0] = external.ipvsadm_path
-        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
-    else:
-        reactor.spawnProcess(__IPVSProcessProtocol(global_config), external.ipvsadm_path, args, {})
-
-    # set is_present
-    real.is_present = True
-
-
-def delete_real_server(virtual, real, global_config, sync=False):
-    args = [external.ipvsadm_name, "-d"]
-
-    # use correct protocol
-    if virtual.protocol == Protocol.tcp:
-        args.append("-t")
-    elif virtual.protocol == Protocol.udp:
-        args.append("-u")
-    elif virtual.protocol == Protocol.fwm:
-        raise NotImplementedError("firewall-marks are not implemented yet")
+    args.append(str(weight))
+
+    return args
+
+
+def _command_args(command):
+    """
+    Builds the arguments (without the program name) of 'ipvsadm' for a command.
+    """
+    if command.real is None:
+        if command.action == IPVSCommand.add:
+            args = ["-A"] + __service_args(command.virtual)
+        elif command.action == IPVSCommand.edit:
+            args = ["-E"] + __service_args(command.virtual)
+        else:
+            return ["-D"] + __service_args(command.virtual)
+
+        # set scheduler
+        args.append("-s")
+        args.append(command.value.name)
+        return args
     else:
-        raise ValueError
+        if command.action == IPVSCommand.add:
+            return ["-a"] + __service_args(command.virtual) + __real_args(command.real, command.value)
+        elif command.action == IPVSCommand.edit:
+            return ["-e"] + __service_args(command.virtual) + __real_args(command.real, command.value)
+        else:
+            return ["-d"] + __service_args(command.virtual) + __real_args(command.real)
 
-    # set virtual hostname
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-    args.append(virtual_hostname)
 
-    # set real hostname
-    args.append("-r")
-    real_hostname = real.ip.exploded + ":" + str(real.port)
-    args.append(real_hostname)
+def execute_sync(command, global_config):
+    """
+    Executes a single command and waits for it to finish.
 
+    :raises subprocess.CalledProcessError: if 'ipvsadm' failed
+    """
+    args = [external.ipvsadm_path] + _command_args(command)
     global_config.log.debug(args)
-
-    # execute the prepared command
-    if sync:
-        args[0] = external.ipvsadm_path
-        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
-    else:
-        reactor.spawnProcess(__IPVSProcessProtocol(global_config), external.ipvsadm_path, args, {})
-
-    # set is_present
-    real.is_present = False
+    subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
 
 
-def edit_real_server(virtual, real, global_config, sync=False):
-    args = [external.ipvsadm_name, "-e"]
+def __cb_verify(exit_code, commands, global_config):
+    if exit_code:
+        global_config.log.debug("'ipvsadm -R' exited with status %d" % exit_code)
 
-    # use correct protocol
-    if virtual.protocol == Protocol.tcp:
-        args.append("-t")
-    elif virtual.protocol == Protocol.udp:
-        args.append("-u")
-    elif virtual.protocol == Protocol.fwm:
-        raise NotImplementedError("firewall-marks are not implemented yet")
-    else:
-        raise ValueError
-
-    # set virtual hostname
-    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
-    args.append(virtual_hostname)
-
-    # set real hostname
-    args.append("-r")
-    real_hostname = real.ip.exploded + ":" + str(real.port)
-    args.append(real_hostname)
-
-    # set forwarding method
-    if real.method == ForwardingMethod.gate:
-        args.append("-g")
-    elif real.method == ForwardingMethod.masq:
-        args.append("-m")
-    elif real.method == ForwardingMethod.ipip:
-        args.append("-i")
-    else:
-        raise ValueError
+    table = ipvs.read_ipvs_table(global_config)
+    results = []
+    for command in commands:
+        state = ipvs.lookup(table, command.key)
+        if command.present:
+            results.append(state is not None and state[1] == command.value)
+        else:
+            results.append(state is None)
+    return results
 
-    # set weight
-    args.append("-w")
-    args.append(str(real.current_weight))
 
-    global_config.log.debug(args)
+def execute(commands, global_config):
+    """
+    Executes a batch of commands with one 'ipvsadm -R' process.
 
-    # execute the prepared command
-    if sync:
-        args[0] = external.ipvsadm_path
-        subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
-    else:
-        reactor.spawnProcess(__IPVSProcessProtocol(global_config), external.ipvsadm_path, args, {})
+    :return: a Deferred firing with a list containing whether each of the commands succeeded
+    """
+    data = "".join(" ".join(_command_args(command)) + "\n" for command in commands).encode()
 
-    # set is_present
-    real.is_present = True
+    deferred = Deferred()
+    deferred.addCallback(__cb_verify, commands, global_config)
+    reactor.spawnProcess(_IPVSRestoreProcessProtocol(global_config, data, deferred), external.ipvsadm_path,
+                         [external.ipvsadm_name, "-R"], {})
+    return deferred
 
 
-class __IPVSProcessProtocol(ProcessProtocol):
-    def __init__(self, global_config):
+class _IPVSRestoreProcessProtocol(ProcessProtocol):
+    def __init__(self, global_config, data, deferred):
         self.global_config = global_config
+        self.data = data
+        self.deferred = deferred
 
     def connectionMade(self):
+        self.transport.write(self.data)
         self.transport.closeStdin()
 
     def errReceived(self, data):
@@ -297,3 +137,6 @@ class __IPVSProcessProtocol(ProcessProtocol):
     def outReceived(self, data):
         if data is not None:
             self.global_config.log.warning("From 'ipvsadm': " + str(data))
+
+    def processEnded(self, reason):
+        self.deferred.callback(reason.value.exitCode)
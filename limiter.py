@@ -0,0 +1,109 @@
+"""
+Limits the number of checks running at the same time. Without a limit, a mass failure of real servers makes every check
+wait for its timeout at once, which can exhaust the file descriptors of PyDirectord or saturate the reactor thread.
+Checks due while the limit is reached wait in a queue ordered by the priority of their virtual service and the time
+they were due. Besides the global limit 'checkconcurrency', single check-modules can be limited further with
+'checkmoduleconcurrency', e.g. those using a thread pool.
+"""
+import heapq
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+
+class CheckLimiter(object):
+    def __init__(self, global_config):
+        self.global_config = global_config
+
+        # variable initialization
+        self.waiting = []
+        self.running = 0
+        self.running_per_module = dict()
+        self.seq = 0
+        self.draining = False
+        self.generation = 0  # number of the current pass over the queue
+
+        # counters
+        self.started = 0
+        self.delayed = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    def stats(self):
+        """
+        :return: a dict containing the current number of running and waiting checks as well as the counters
+        """
+        return {"running": self.running,
+                "waiting": len(self.waiting),
+                "started": self.started,
+                "delayed": self.delayed,
+                "wait_avg": self.wait_sum / self.started if self.started else 0.0,
+                "wait_max": self.wait_max}
+
+    def __available(self, module):
+        limit = self.global_config.checkmoduleconcurrency.get(module)
+        return limit is None or self.running_per_module.get(module, 0) < limit
+
+    def submit(self, module, priority, function, *args):
+        """
+        Runs a check as soon as the limits permit it.
+
+        :param module: the name of the check-module used by the check
+        :param priority: checks with a higher priority are started first
+        :param function: the function performing the check, it returns a Deferred firing once the check is completed or
+                         None if no check has been started
+        :param args: the arguments of the function
+        :return: nothing
+        """
+        self.seq += 1
+        # a check started by the pass over the queue this submission belongs to did not have to wait for a free slot
+        generation = self.generation if self.draining else self.generation + 1
+        heapq.heappush(self.waiting, (-priority, reactor.seconds(), self.seq, generation, module, function, args))
+        self.__drain()
+
+    def __release(self, result, module):
+        self.running -= 1
+        self.running_per_module[module] -= 1
+        self.__drain()
+        return result
+
+    def __drain(self):
+        # checks completing synchronously release their slot while we are still draining
+        if self.draining:
+            return
+        self.draining = True
+        self.generation += 1
+
+        limit = self.global_config.checkconcurrency
+        blocked = []
+        try:
+            while self.waiting and (not limit or self.running < limit):
+                entry = heapq.heappop(self.waiting)
+                _, due, _, generation, module, function, args = entry
+                if not self.__available(module):
+                    blocked.append(entry)
+                    continue
+
+                wait = reactor.seconds() - due
+                self.started += 1
+                self.wait_sum += wait
+                self.wait_max = max(self.wait_max, wait)
+                if generation != self.generation:
+                    self.delayed += 1
+                    self.global_config.log.debug("Check using '%s' waited %.3fs for a free slot" % (module, wait))
+
+                self.running += 1
+                self.running_per_module[module] = self.running_per_module.get(module, 0) + 1
+                try:
+                    d = function(*args)
+                except Exception:
+                    self.__release(None, module)
+                    raise
+                if isinstance(d, Deferred):
+                    d.addBoth(self.__release, module)
+                else:
+                    self.__release(None, module)
+        finally:
+            for entry in blocked:
+                heapq.heappush(self.waiting, entry)
+            self.draining = False
@@ -0,0 +1,173 @@
+"""
+Instrumentation of the checks. For every check-module and every probe, the time until the connection was established,
+the time until the first response of the real server arrived and the total duration of the checks are counted in
+histograms with fixed buckets, together with the outcome of the checks. Recording a check therefore only increments a
+few counters on the reactor thread, everything else is done when the statistics are requested.
+
+Check-modules report the phases of a check with 'mark', those not doing so only contribute their total duration. Those
+using TLS also report with 'handshake' whether the TLS session of a check was resumed.
+"""
+import bisect
+
+from twisted.internet import reactor
+from twisted.python.failure import Failure
+
+import external
+from enums import Outcome
+from pydexceptions import *
+
+# phases of a check that can be reported by check-modules
+CONNECT = "connect"
+FIRST_BYTE = "first_byte"
+
+# kinds of TLS handshakes
+FULL = "full"
+RESUMED = "resumed"
+UNKNOWN = "unknown"
+
+# modules defining the exceptions raised by failed TLS handshakes or certificate verifications
+__TLS_MODULES = ("OpenSSL", "ssl", "service_identity")
+
+
+class Histogram(object):
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(external.check_histogram_buckets) + 1)  # the last bucket is unbounded
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(external.check_histogram_buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+class CheckMetrics(object):
+    """
+    Histograms of the phases and counters of the outcomes of the checks of either a check-module or a probe.
+    """
+    __slots__ = ("connect", "first_byte", "duration", "outcomes", "handshakes")
+
+    def __init__(self):
+        self.connect = Histogram()
+        self.first_byte = Histogram()
+        self.duration = Histogram()
+        self.outcomes = [0] * len(Outcome)
+        self.handshakes = {FULL: 0, RESUMED: 0, UNKNOWN: 0}
+
+    def record(self, outcome, duration, marks, handshake=None):
+        self.duration.observe(duration)
+        if CONNECT in marks:
+            self.connect.observe(marks[CONNECT])
+        if FIRST_BYTE in marks:
+            self.first_byte.observe(marks[FIRST_BYTE])
+        self.outcomes[outcome.value] += 1
+        if handshake is not None:
+            self.handshakes[handshake] += 1
+
+    def to_dict(self):
+        return {"connect": self.connect.to_dict(),
+                "first_byte": self.first_byte.to_dict(),
+                "duration": self.duration.to_dict(),
+                "outcomes": {outcome.name: self.outcomes[outcome.value] for outcome in Outcome},
+                "handshakes": dict(self.handshakes)}
+
+
+def mark(deferred, phase):
+    """
+    Called by check-modules once a phase of a check has been reached.
+
+    :param deferred: the Deferred returned by the check-module.
+    :param phase: either CONNECT or FIRST_BYTE.
+    :return: nothing
+    """
+    marks = getattr(deferred, "marks", None)
+    if marks is None:
+        marks = deferred.marks = dict()
+    marks.setdefault(phase, reactor.seconds())
+
+
+def handshake(deferred, kind):
+    """
+    Called by check-modules once the TLS handshake of a check is known to have been completed.
+
+    :param deferred: the Deferred returned by the check-module.
+    :param kind: either FULL, RESUMED or UNKNOWN, None if there was no handshake.
+    :return: nothing
+    """
+    if kind is not None:
+        deferred.handshake = kind
+
+
+def phases(deferred, started):
+    """
+    :return: a dict containing the seconds from the start of a check until each phase reported by its check-module
+    """
+    return {phase: time - started for phase, time in getattr(deferred, "marks", dict()).items()}
+
+
+def classify(failure):
+    """
+    Determines the outcome class of a failed check.
+
+    :param failure: the Failure or exception the check failed with.
+    :return: the Outcome
+    """
+    exception = failure.value if isinstance(failure, Failure) else failure
+
+    # the http client wraps the actual reasons of a failed request
+    while getattr(exception, "reasons", None):
+        exception = exception.reasons[0].value
+    if isinstance(exception, RemoteCheckException):
+        return Outcome[exception.outcome] if exception.outcome else Outcome.error
+
+    for cls in type(exception).__mro__:
+        name = cls.__name__
+        if cls is CheckTimeoutException or "Timeout" in name or "TimedOut" in name:
+            return Outcome.timeout
+        elif name == "ConnectionRefusedError":
+            return Outcome.refused
+        elif cls is UnexpectedResultException:
+            return Outcome.mismatch
+        elif cls.__module__.split(".")[0] in __TLS_MODULES:
+            return Outcome.tls
+    return Outcome.error
+
+
+def record(name, shared, outcome, duration, marks, global_config, handshake=None):
+    """
+    Records a completed check for its check-module and its probe.
+    """
+    module_metrics = global_config.check_metrics.get(name)
+    if module_metrics is None:
+        module_metrics = global_config.check_metrics[name] = CheckMetrics()
+    module_metrics.record(outcome, duration, marks, handshake)
+    shared.metrics.record(outcome, duration, marks, handshake)
+
+
+def dump(virtuals, global_config):
+    """
+    Collects the statistics of all check-modules and of every (virtual service, real server) pair.
+
+    :return: a dict that can be serialized to JSON
+    """
+    reals = []
+    for virtual in virtuals:
+        virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+        for real in virtual.real:
+            if real.probe is None:
+                continue
+            entry = real.probe.metrics.to_dict()
+            entry["virtual"] = virtual_hostname
+            entry["real"] = real.ip.exploded + ":" + str(real.port)
+            entry["latency"] = real.latency
+            reals.append(entry)
+
+    return {"buckets": list(external.check_histogram_buckets),
+            "timeouts": global_config.check_timeouts,
+            "modules": {name: module_metrics.to_dict() for name, module_metrics in global_config.check_metrics.items()},
+            "reals": reals}
@@ -0,0 +1,411 @@
+"""
+Backend talking to the IPVS generic-netlink family of the kernel directly instead of spawning 'ipvsadm' for every single
+change. Messages are queued and sent in batches from within the reactor, the acknowledgements of the kernel are matched
+to the corresponding requests by their sequence numbers.
+"""
+import errno
+import os
+import socket
+import struct
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.interfaces import IReadDescriptor
+from zope.interface import implementer
+
+import external
+from enums import *
+from pydexceptions import IPVSException
+
+# netlink constants (see: linux/netlink.h)
+NETLINK_GENERIC = 16
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLMSG_ERROR = 0x02
+NLMSG_DONE = 0x03
+NLA_F_NESTED = 0x8000
+
+# generic-netlink constants (see: linux/genetlink.h)
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# ipvs constants (see: linux/ip_vs.h)
+IPVS_GENL_NAME = b"IPVS"
+IPVS_GENL_VERSION = 0x1
+
+IPVS_CMD_NEW_SERVICE = 1
+IPVS_CMD_SET_SERVICE = 2
+IPVS_CMD_DEL_SERVICE = 3
+IPVS_CMD_NEW_DEST = 5
+IPVS_CMD_SET_DEST = 6
+IPVS_CMD_DEL_DEST = 7
+
+IPVS_CMD_ATTR_SERVICE = 1
+IPVS_CMD_ATTR_DEST = 2
+
+IPVS_SVC_ATTR_AF = 1
+IPVS_SVC_ATTR_PROTOCOL = 2
+IPVS_SVC_ATTR_ADDR = 3
+IPVS_SVC_ATTR_PORT = 4
+IPVS_SVC_ATTR_SCHED_NAME = 6
+IPVS_SVC_ATTR_FLAGS = 7
+IPVS_SVC_ATTR_TIMEOUT = 8
+IPVS_SVC_ATTR_NETMASK = 9
+
+IPVS_DEST_ATTR_ADDR = 1
+IPVS_DEST_ATTR_PORT = 2
+IPVS_DEST_ATTR_FWD_METHOD = 3
+IPVS_DEST_ATTR_WEIGHT = 4
+IPVS_DEST_ATTR_U_THRESH = 5
+IPVS_DEST_ATTR_L_THRESH = 6
+
+IP_VS_CONN_F_MASQ = 0
+IP_VS_CONN_F_TUNNEL = 2
+IP_VS_CONN_F_DROUTE = 3
+
+__NLMSGHDR = struct.Struct("=LHHLL")
+__GENLMSGHDR = struct.Struct("=BBH")
+__NLATTR = struct.Struct("=HH")
+
+
+def __align(length):
+    return (length + 3) & ~3
+
+
+def __attr(attr_type, payload):
+    length = __NLATTR.size + len(payload)
+    return __NLATTR.pack(length, attr_type) + payload + b"\0" * (__align(length) - length)
+
+
+def __nested(attr_type, *attrs):
+    return __attr(attr_type | NLA_F_NESTED, b"".join(attrs))
+
+
+def __parse_attrs(data):
+    attrs = dict()
+    offset = 0
+    while offset + __NLATTR.size <= len(data):
+        length, attr_type = __NLATTR.unpack_from(data, offset)
+        if length < __NLATTR.size:
+            break
+        attrs[attr_type & ~NLA_F_NESTED] = data[offset + __NLATTR.size:offset + length]
+        offset += __align(length)
+    return attrs
+
+
+def _build_message(msg_type, cmd, seq, payload, flags=NLM_F_REQUEST | NLM_F_ACK, version=IPVS_GENL_VERSION):
+    body = __GENLMSGHDR.pack(cmd, version, 0) + payload
+    return __NLMSGHDR.pack(__NLMSGHDR.size + len(body), msg_type, flags, seq, 0) + body
+
+
+def _parse_messages(data):
+    """
+    Splits a buffer received from a netlink socket into its messages.
+
+    :param data: the received buffer
+    :return: a list of (type, seq, payload) tuples
+    """
+    messages = []
+    offset = 0
+    while offset + __NLMSGHDR.size <= len(data):
+        length, msg_type, _, seq, _ = __NLMSGHDR.unpack_from(data, offset)
+        if length < __NLMSGHDR.size:
+            break
+        messages.append((msg_type, seq, data[offset + __NLMSGHDR.size:offset + length]))
+        offset += __align(length)
+    return messages
+
+
+def _message_seq(message):
+    """
+    Extracts the sequence number from a message built by '_build_message'.
+    """
+    return __NLMSGHDR.unpack_from(message)[3]
+
+
+def _error_code(payload):
+    """
+    Extracts the error code from the payload of an NLMSG_ERROR message. An error code of zero is an acknowledgement.
+    """
+    return struct.unpack_from("=i", payload)[0]
+
+
+def __service_attrs(virtual, scheduler=None):
+    if virtual.protocol == Protocol.tcp:
+        protocol = socket.IPPROTO_TCP
+    elif virtual.protocol == Protocol.udp:
+        protocol = socket.IPPROTO_UDP
+    elif virtual.protocol == Protocol.fwm:
+        raise NotImplementedError("firewall-marks are not implemented yet")
+    else:
+        raise ValueError
+
+    family = socket.AF_INET if virtual.ip.version == 4 else socket.AF_INET6
+    attrs = [__attr(IPVS_SVC_ATTR_AF, struct.pack("=H", family)),
+             __attr(IPVS_SVC_ATTR_PROTOCOL, struct.pack("=H", protocol)),
+             __attr(IPVS_SVC_ATTR_ADDR, virtual.ip.packed.ljust(16, b"\0")),
+             __attr(IPVS_SVC_ATTR_PORT, struct.pack("!H", virtual.port))]
+
+    # adding and editing a service requires the full set of attributes
+    if scheduler is not None:
+        netmask = 0xffffffff if virtual.ip.version == 4 else 128
+        attrs.append(__attr(IPVS_SVC_ATTR_SCHED_NAME, scheduler.name.encode() + b"\0"))
+        attrs.append(__attr(IPVS_SVC_ATTR_FLAGS, struct.pack("=LL", 0, 0xffffffff)))
+        attrs.append(__attr(IPVS_SVC_ATTR_TIMEOUT, struct.pack("=L", 0)))
+        attrs.append(__attr(IPVS_SVC_ATTR_NETMASK, struct.pack("=L", netmask)))
+
+    return __nested(IPVS_CMD_ATTR_SERVICE, *attrs)
+
+
+def __dest_attrs(real, weight=None):
+    attrs = [__attr(IPVS_DEST_ATTR_ADDR, real.ip.packed.ljust(16, b"\0")),
+             __attr(IPVS_DEST_ATTR_PORT, struct.pack("!H", real.port))]
+
+    # adding and editing a destination requires the full set of attributes
+    if weight is not None:
+        if real.method == ForwardingMethod.gate:
+            method = IP_VS_CONN_F_DROUTE
+        elif real.method == ForwardingMethod.masq:
+            method = IP_VS_CONN_F_MASQ
+        elif real.method == ForwardingMethod.ipip:
+            method = IP_VS_CONN_F_TUNNEL
+        else:
+            raise ValueError
+
+        attrs.append(__attr(IPVS_DEST_ATTR_FWD_METHOD, struct.pack("=L", method)))
+        attrs.append(__attr(IPVS_DEST_ATTR_WEIGHT, struct.pack("=l", weight)))
+        attrs.append(__attr(IPVS_DEST_ATTR_U_THRESH, struct.pack("=L", 0)))
+        attrs.append(__attr(IPVS_DEST_ATTR_L_THRESH, struct.pack("=L", 0)))
+
+    return __nested(IPVS_CMD_ATTR_DEST, *attrs)
+
+
+def resolve_family(sock):
+    """
+    Asks the generic-netlink controller for the id of the IPVS family. Must be called on a blocking socket.
+
+    :param sock: a bound NETLINK_GENERIC socket
+    :return: the numeric family id
+    """
+    payload = __attr(CTRL_ATTR_FAMILY_NAME, IPVS_GENL_NAME + b"\0")
+    sock.sendto(_build_message(GENL_ID_CTRL, CTRL_CMD_GETFAMILY, 1, payload, flags=NLM_F_REQUEST, version=1), (0, 0))
+
+    for msg_type, seq, data in _parse_messages(sock.recv(65536)):
+        if msg_type == NLMSG_ERROR:
+            code = _error_code(data)
+            raise IPVSException("resolving the IPVS netlink family failed: %s" % os.strerror(-code))
+        elif msg_type == GENL_ID_CTRL:
+            attrs = __parse_attrs(data[__GENLMSGHDR.size:])
+            if CTRL_ATTR_FAMILY_ID in attrs:
+                return struct.unpack("=H", attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+
+    raise IPVSException("the generic-netlink controller did not return the IPVS family")
+
+
+@implementer(IReadDescriptor)
+class _IPVSNetlinkConnection(object):
+    """
+    A non-blocking netlink socket registered with the reactor. Requests are collected and sent together once per
+    reactor iteration, each request is answered by the kernel with an acknowledgement carrying the same sequence number.
+    """
+
+    def __init__(self, global_config):
+        self.global_config = global_config
+
+        # socket used from within the reactor
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, external.netlink_receive_buffer)
+        self.sock.bind((0, 0))
+        self.sock.settimeout(external.netlink_sync_timeout)
+        try:
+            self.family = resolve_family(self.sock)
+        except (OSError, IPVSException):
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+
+        # blocking socket used for synchronous requests (e.g. during setup and cleanup)
+        self.sync_sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self.sync_sock.bind((0, 0))
+        self.sync_sock.settimeout(external.netlink_sync_timeout)
+
+        # variable initialization
+        self.seq = 0
+        self.pending = dict()
+        self.outgoing = []
+        self.flush_call = None
+
+        reactor.addReader(self)
+
+    def __next_seq(self):
+        self.seq = (self.seq + 1) & 0xffffffff
+        return self.seq
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def logPrefix(self):
+        return "IPVSNetlink"
+
+    def connectionLost(self, reason):
+        self.__fail_pending(IPVSException("netlink socket closed"))
+
+    def doRead(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # the kernel dropped messages, the outcome of all outstanding requests is unknown
+                    self.global_config.log.error("Netlink receive buffer overrun, acknowledgements were lost")
+                    self.__fail_pending(IPVSException("acknowledgement lost"))
+                    continue
+                raise
+
+            for msg_type, seq, payload in _parse_messages(data):
+                if msg_type != NLMSG_ERROR:
+                    continue
+                try:
+                    deferred, description = self.pending.pop(seq)
+                except KeyError:
+                    continue
+                code = _error_code(payload)
+                if code == 0:
+                    deferred.callback(description)
+                else:
+                    deferred.errback(IPVSException("%s: %s" % (description, os.strerror(-code))))
+
+    def __fail_pending(self, exception):
+        pending = self.pending
+        self.pending = dict()
+        for deferred, _ in pending.values():
+            deferred.errback(exception)
+
+    def submit(self, cmd, payload, description):
+        """
+        Queues a request to be sent with the next batch.
+
+        :return: a Deferred firing once the kernel acknowledged the request
+        """
+        seq = self.__next_seq()
+        deferred = Deferred()
+        self.pending[seq] = (deferred, description)
+        self.outgoing.append(_build_message(self.family, cmd, seq, payload))
+
+        if self.flush_call is None:
+            self.flush_call = reactor.callLater(0, self.flush)
+
+        return deferred
+
+    def flush(self):
+        self.flush_call = None
+
+        while self.outgoing:
+            # combine as many messages as fit into one batch
+            size = 0
+            count = 0
+            for message in self.outgoing:
+                if count > 0 and size + len(message) > external.netlink_batch_size:
+                    break
+                size += len(message)
+                count += 1
+
+            try:
+                self.sock.sendto(b"".join(self.outgoing[:count]), (0, 0))
+            except BlockingIOError:
+                self.flush_call = reactor.callLater(0.01, self.flush)
+                return
+            except OSError as e:
+                # the kernel will never acknowledge the requests of a batch it refused, fail them instead of waiting
+                self.global_config.log.error("Sending %d netlink requests failed: %s" % (count, str(e)))
+                for message in self.outgoing[:count]:
+                    entry = self.pending.pop(_message_seq(message), None)
+                    if entry is not None:
+                        deferred, description = entry
+                        deferred.errback(IPVSException("%s: %s" % (description, str(e))))
+            del self.outgoing[:count]
+
+    def request_sync(self, cmd, payload, description):
+        """
+        Sends a single request and blocks until the kernel acknowledged it.
+
+        :raises IPVSException: if the kernel rejected the request
+        """
+        seq = self.__next_seq()
+        self.sync_sock.sendto(_build_message(self.family, cmd, seq, payload), (0, 0))
+
+        while True:
+            for msg_type, msg_seq, data in _parse_messages(self.sync_sock.recv(65536)):
+                if msg_type == NLMSG_ERROR and msg_seq == seq:
+                    code = _error_code(data)
+                    if code != 0:
+                        raise IPVSException("%s: %s" % (description, os.strerror(-code)))
+                    return
+
+
+def open_connection(global_config):
+    """
+    Opens the netlink connection to the IPVS family of the kernel and stores it in the global configuration.
+
+    :raises OSError: if netlink is not available
+    :raises IPVSException: if the IPVS family is not known to the kernel (e.g. 'ip_vs' is not loaded)
+    """
+    global_config.netlink = _IPVSNetlinkConnection(global_config)
+    global_config.log.info("Using netlink IPVS family %d" % global_config.netlink.family)
+
+
+def __command_message(command):
+    """
+    :return: the generic-netlink command and the attributes for an ipvs command
+    """
+    if command.real is None:
+        if command.action == IPVSCommand.add:
+            return IPVS_CMD_NEW_SERVICE, __service_attrs(command.virtual, command.value)
+        elif command.action == IPVSCommand.edit:
+            return IPVS_CMD_SET_SERVICE, __service_attrs(command.virtual, command.value)
+        else:
+            return IPVS_CMD_DEL_SERVICE, __service_attrs(command.virtual)
+    else:
+        if command.action == IPVSCommand.add:
+            return IPVS_CMD_NEW_DEST, __service_attrs(command.virtual) + __dest_attrs(command.real, command.value)
+        elif command.action == IPVSCommand.edit:
+            return IPVS_CMD_SET_DEST, __service_attrs(command.virtual) + __dest_attrs(command.real, command.value)
+        else:
+            return IPVS_CMD_DEL_DEST, __service_attrs(command.virtual) + __dest_attrs(command.real)
+
+
+def execute_sync(command, global_config):
+    """
+    Executes a single command and waits for the kernel to acknowledge it.
+
+    :raises IPVSException: if the kernel rejected the command
+    """
+    cmd, payload = __command_message(command)
+    global_config.netlink.request_sync(cmd, payload, str(command))
+
+
+def __cb_results(results, global_config):
+    for success, value in results:
+        if not success:
+            global_config.log.error("Error from netlink: " + str(value.value))
+    return [success for success, _ in results]
+
+
+def execute(commands, global_config):
+    """
+    Sends a batch of commands to the kernel.
+
+    :return: a Deferred firing with a list containing whether each of the commands succeeded
+    """
+    deferreds = []
+    for command in commands:
+        cmd, payload = __command_message(command)
+        deferreds.append(global_config.netlink.submit(cmd, payload, str(command)))
+
+    d = DeferredList(deferreds, consumeErrors=True)
+    d.addCallback(__cb_results, global_config)
+    return d
@@ -0,0 +1,177 @@
+"""
+Check of the 'ping' checktype. Instead of spawning 'ping' for every real server, all echo requests are sent through a
+single raw ICMP socket per address family that is watched by the reactor. The replies are matched to the checks by the
+identifier and the sequence number of the echo requests, so any number of real servers can be pinged at the same time
+using two file descriptors and without forking.
+
+If raw sockets are not permitted, the unprivileged ICMP datagram sockets of Linux are used instead (see
+'net.ipv4.ping_group_range'). The kernel replaces the identifier of their echo requests, so replies are only matched by
+their sequence number and source address then.
+"""
+import os
+import socket
+import struct
+
+from twisted.internet import error, reactor
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.interfaces import IReadDescriptor
+from zope.interface import implementer
+
+# ICMP types (echo request, echo reply, errors that quote the echo request) per address family
+_ICMP_TYPES = {socket.AF_INET: (8, 0, (3, 11)),
+               socket.AF_INET6: (128, 129, (1, 3))}
+
+_PAYLOAD = b"PyDirectord ping"
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+@implementer(IReadDescriptor)
+class _Pinger(object):
+    """
+    Owner of the ICMP socket of an address family and of all echo requests waiting for their reply.
+    """
+
+    def __init__(self, family, global_config):
+        self.family = family
+        self.global_config = global_config
+        self.request_type, self.reply_type, self.error_types = _ICMP_TYPES[family]
+        protocol = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+
+        try:
+            self.socket = socket.socket(family, socket.SOCK_RAW, protocol)
+            self.raw = True
+        except PermissionError:
+            self.socket = socket.socket(family, socket.SOCK_DGRAM, protocol)
+            self.raw = False
+        self.socket.setblocking(False)
+
+        # variable initialization
+        self.identifier = os.getpid() & 0xffff
+        self.sequence = 0
+        self.waiting = dict()  # sequence number -> (address, Deferred, timeout)
+
+        reactor.addReader(self)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def logPrefix(self):
+        return "ping"
+
+    def connectionLost(self, reason):
+        self.socket.close()
+
+    def __next_sequence(self):
+        # skip the sequence numbers of echo requests still waiting for their reply
+        for _ in range(0x10000):
+            self.sequence = (self.sequence + 1) & 0xffff
+            if self.sequence not in self.waiting:
+                return self.sequence
+        raise error.ConnectError(string="too many echo requests waiting for their reply")
+
+    def ping(self, address, timeout):
+        """
+        Sends an echo request.
+
+        :param address: the address to be pinged.
+        :param timeout: seconds to wait for the echo reply.
+        :return: a Deferred firing once the echo reply has been received
+        """
+        sequence = self.__next_sequence()
+        header = struct.pack("!BBHHH", self.request_type, 0, 0, self.identifier, sequence)
+        checksum = _checksum(header + _PAYLOAD) if self.family == socket.AF_INET else 0  # the kernel does it for IPv6
+        packet = header[:2] + struct.pack("!H", checksum) + header[4:] + _PAYLOAD
+
+        d = Deferred(lambda _: self.__forget(sequence))
+        try:
+            self.socket.sendto(packet, (address, 0))
+        except OSError as e:
+            d.errback(e)
+            return d
+
+        self.waiting[sequence] = (address, d, reactor.callLater(timeout, self.__timeout, sequence))
+        return d
+
+    def __forget(self, sequence):
+        _, _, timer = self.waiting.pop(sequence, (None, None, None))
+        if timer is not None and timer.active():
+            timer.cancel()
+
+    def __timeout(self, sequence):
+        address, d, _ = self.waiting.pop(sequence)
+        d.errback(error.TimeoutError(string="no echo reply from %s" % address))
+
+    def doRead(self):
+        # handle everything that arrived, but do not keep the reactor to ourselves
+        for _ in range(1024):
+            try:
+                data, source = self.socket.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.global_config.log.debug("Receiving ICMP messages failed: %s" % str(e))
+                return
+            self.__received(data, source[0])
+
+    def __received(self, data, source):
+        # raw IPv4 sockets receive the IP header as well
+        if self.raw and self.family == socket.AF_INET:
+            data = data[(data[0] & 0x0f) * 4:]
+        if len(data) < 8:
+            return
+
+        kind, _, _, identifier, sequence = struct.unpack("!BBHHH", data[:8])
+        if kind == self.reply_type:
+            self.__resolve(identifier, sequence, source, None)
+        elif kind in self.error_types:
+            # the error quotes the header of our echo request after the IP header of the original packet
+            quoted = data[8:]
+            if self.family == socket.AF_INET:
+                if not quoted:
+                    return
+                destination = socket.inet_ntop(socket.AF_INET, quoted[16:20]) if len(quoted) >= 20 else None
+                quoted = quoted[(quoted[0] & 0x0f) * 4:]
+            else:
+                destination = socket.inet_ntop(socket.AF_INET6, quoted[24:40]) if len(quoted) >= 40 else None
+                quoted = quoted[40:]
+            if len(quoted) < 8 or quoted[0] != self.request_type or destination is None:
+                return
+            identifier, sequence = struct.unpack("!HH", quoted[4:8])
+            self.__resolve(identifier, sequence, destination,
+                           error.NoRouteError(string="%s is unreachable (reported by %s)" % (destination, source)))
+
+    def __resolve(self, identifier, sequence, address, failure):
+        if self.raw and identifier != self.identifier:
+            return  # a reply to another process
+        entry = self.waiting.get(sequence)
+        if entry is None or entry[0] != address:
+            return
+
+        _, d, timer = self.waiting.pop(sequence)
+        if timer.active():
+            timer.cancel()
+        if failure is None:
+            d.callback(address)
+        else:
+            d.errback(failure)
+
+
+def check(virtual, real, global_config):
+    family = socket.AF_INET if real.ip.version == 4 else socket.AF_INET6
+
+    pinger = global_config.pingers.get(family)
+    if pinger is None:
+        try:
+            pinger = global_config.pingers[family] = _Pinger(family, global_config)
+        except OSError as e:
+            return fail(e)
+
+    return pinger.ping(real.ip.compressed, virtual.checktimeout)
@@ -0,0 +1,277 @@
+"""
+Ordered pipeline for asynchronous changes of the ipvs table.
+
+Commands are collected for 'ipvsbatchwindow' milliseconds and handed to the backend in batches. For every virtual
+service and every (virtual service, real server) pair at most one command is executed at a time, a command submitted in
+the meantime supersedes any other one still waiting for the same entry. Independent entries are changed concurrently
+up to 'ipvsconcurrency' commands. The confirmed state (is_present, current_weight) of an entry is only updated once
+the backend reported success, failed commands are retried with an exponential backoff.
+"""
+from twisted.internet import reactor
+
+import external
+import ipvs
+from enums import *
+
+
+def _is_virtual_key(key):
+    return isinstance(key[0], Protocol)
+
+
+class CommandPipeline(object):
+    def __init__(self, global_config, table):
+        """
+        :param global_config: the global configuration
+        :param table: the current ipvs table of the kernel as returned by ipvs.read_ipvs_table
+        """
+        self.global_config = global_config
+
+        # variable initialization
+        self.pending = dict()
+        self.in_flight = dict()
+        self.attempts = dict()
+        self.retry_at = dict()
+        self.known = dict()
+        self.dispatch_call = None
+
+        # counters
+        self.submitted = 0
+        self.coalesced = 0
+        self.executed = 0
+        self.failed = 0
+        self.drifted = 0
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.latency_max = 0.0
+
+        # start with the state the kernel is in right now
+        for key, (scheduler, reals) in table.items():
+            self.known[key] = (True, scheduler)
+            for (ip, port), (_, weight) in reals.items():
+                self.known[(key, ip, port)] = (True, weight)
+
+    def stats(self):
+        """
+        :return: a dict containing the current queue depth as well as the counters of the pipeline
+        """
+        return {"queue_depth": len(self.pending),
+                "in_flight": len(self.in_flight),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "executed": self.executed,
+                "failed": self.failed,
+                "drifted": self.drifted,
+                "latency_avg": self.latency_sum / self.latency_count if self.latency_count else 0.0,
+                "latency_max": self.latency_max}
+
+    def submit(self, command):
+        """
+        Queues a command. Its latency is measured from the submission of the oldest command it superseded.
+        """
+        self.submitted += 1
+        command.submitted = reactor.seconds()
+
+        superseded = self.pending.get(command.key)
+        if superseded is not None:
+            self.coalesced += 1
+            command.submitted = superseded.submitted
+        self.pending[command.key] = command
+
+        self.__schedule(self.global_config.ipvsbatchwindow / 1000)
+
+    def applied(self, command):
+        """
+        Records a command the kernel has confirmed and updates the state of the affected configuration objects.
+        """
+        key = command.key
+        if command.present:
+            self.known[key] = (True, command.value)
+        else:
+            self.known.pop(key, None)
+
+        if command.real is None:
+            command.virtual.is_present = command.present
+
+            # deleting a virtual service implicitly deletes all of its real servers
+            if not command.present:
+                self.__forget_reals(command)
+        else:
+            command.real.is_present = command.present
+            command.real.current_weight = command.value if command.present else 0
+
+    def __forget_reals(self, command):
+        for other in [other for other in self.known if other[0] == command.key]:
+            del self.known[other]
+        reals = command.virtual.real + ([command.virtual.fallback] if command.virtual.fallback else [])
+        for real in reals:
+            real.is_present = False
+            real.current_weight = 0
+
+    def busy(self, key):
+        """
+        :return: whether a change of the given entry is waiting or being executed
+        """
+        return key in self.pending or key in self.in_flight
+
+    def observed(self, command, state):
+        """
+        Records the state the kernel reported for the entry of a command, regardless of what we expected it to be.
+
+        :param command: a command concerning the entry
+        :param state: the state of the entry as returned by ipvs.lookup
+        """
+        if state is None:
+            self.known.pop(command.key, None)
+        else:
+            self.known[command.key] = state
+
+        if command.real is None:
+            command.virtual.is_present = state is not None
+            if state is None:
+                self.__forget_reals(command)
+        else:
+            command.real.is_present = state is not None
+            command.real.current_weight = state[1] if state is not None else 0
+
+    def __refresh(self, commands):
+        """
+        Re-reads the state of the entries concerned by the given commands from the kernel, e.g. after they failed.
+        """
+        table = ipvs.read_ipvs_table(self.global_config)
+        for command in commands:
+            self.observed(command, ipvs.lookup(table, command.key))
+
+    def __resolve(self, command):
+        """
+        Determines the action needed to bring an entry from its known state to the requested one.
+
+        :return: False if nothing needs to be done
+        """
+        known = self.known.get(command.key)
+        if command.present:
+            if known is None:
+                command.action = IPVSCommand.add
+            elif known[1] != command.value:
+                command.action = IPVSCommand.edit
+            else:
+                return False
+        else:
+            if known is None:
+                return False
+            command.action = IPVSCommand.delete
+        return True
+
+    def __schedule(self, delay):
+        if self.dispatch_call is not None and self.dispatch_call.active():
+            if self.dispatch_call.getTime() > reactor.seconds() + delay:
+                self.dispatch_call.reset(delay)
+        else:
+            self.dispatch_call = reactor.callLater(delay, self.__dispatch)
+
+    def __blocked(self, key, command):
+        # a real server has to wait for changes of its virtual service and vice versa
+        if key in self.in_flight:
+            return True
+        elif command.real is not None:
+            # including a change of the virtual service waiting to be retried, the kernel would refuse the real server
+            return key[0] in self.in_flight or key[0] in self.retry_at
+        elif not command.present:
+            return any(not _is_virtual_key(other) and other[0] == key for other in self.in_flight)
+        return False
+
+    def __confirmed(self, command, now):
+        self.applied(command)
+        self.attempts.pop(command.key, None)
+        self.retry_at.pop(command.key, None)
+
+        latency = now - command.submitted
+        self.latency_sum += latency
+        self.latency_count += 1
+        self.latency_max = max(self.latency_max, latency)
+
+    def __dispatch(self):
+        self.dispatch_call = None
+        if self.global_config.terminated:
+            return
+
+        now = reactor.seconds()
+        capacity = self.global_config.ipvsconcurrency - len(self.in_flight)
+        next_retry = None
+        batch = []
+
+        for key, command in list(self.pending.items()):
+            if capacity <= 0:
+                break
+
+            retry_at = self.retry_at.get(key)
+            if retry_at is not None and retry_at > now:
+                next_retry = retry_at if next_retry is None else min(next_retry, retry_at)
+                continue
+            if self.__blocked(key, command):
+                continue
+
+            del self.pending[key]
+            if not self.__resolve(command):
+                self.__confirmed(command, now)
+                continue
+
+            self.in_flight[key] = command
+            batch.append(command)
+            capacity -= 1
+
+        if next_retry is not None:
+            self.__schedule(next_retry - now)
+
+        if not batch:
+            return
+
+        # create virtual services first and delete them last
+        batch.sort(key=lambda c: 1 if c.real is not None else (0 if c.present else 2))
+
+        for command in batch:
+            self.global_config.log.debug(str(command))
+
+        try:
+            d = self.global_config.ipvs.execute(batch, self.global_config)
+        except Exception as e:
+            self.global_config.log.error("Executing %d ipvs command(s) failed: %s" % (len(batch), str(e)))
+            self.__cb_executed([False] * len(batch), batch)
+            return
+        d.addErrback(self.__cb_error, batch)
+        d.addCallback(self.__cb_executed, batch)
+
+    def __cb_error(self, failure, batch):
+        self.global_config.log.error("Executing %d ipvs command(s) failed: %s" % (len(batch), str(failure.value)))
+        return [False] * len(batch)
+
+    def __cb_executed(self, results, batch):
+        now = reactor.seconds()
+        failed = []
+
+        for command, success in zip(batch, results):
+            del self.in_flight[command.key]
+
+            if success:
+                self.executed += 1
+                self.__confirmed(command, now)
+                continue
+
+            # retry later unless the command has been superseded in the meantime
+            self.failed += 1
+            attempts = self.attempts.get(command.key, 0) + 1
+            self.attempts[command.key] = attempts
+            delay = min(external.ipvs_retry_delay * 2 ** (attempts - 1), external.ipvs_retry_max_delay)
+            self.retry_at[command.key] = now + delay
+            self.pending.setdefault(command.key, command)
+            failed.append(command)
+            self.global_config.log.error("ipvs command '%s' failed (attempt %d), retrying in %.1fs"
+                                         % (str(command), attempts, delay))
+
+        # find out what the kernel actually did before trying again
+        if failed:
+            self.__refresh(failed)
+
+        self.global_config.log.debug("ipvs pipeline: %s" % self.stats())
+
+        if self.pending:
+            self.__schedule(self.global_config.ipvsbatchwindow / 1000)
@@ -0,0 +1,84 @@
+"""
+Deduplication of checks. The same real server is often part of several virtual services (e.g. SMTP, IMAP and IMAPS on
+one host), checking it once per virtual service would run identical probes several times per interval. Instead, every
+unique combination of the parameters a check actually uses is probed once and its result is handed to all (virtual
+service, real server) pairs subscribed to it.
+"""
+import metrics
+from enums import Checktype
+
+# check-modules that connect to the virtual service rather than to the real server
+__VIRTUAL_SERVICE_CHECKS = ("ssh",)
+
+
+def probe_key(virtual, real):
+    """
+    Identifies a check by the parameters the check-modules use, real servers with equal keys share a single probe.
+    """
+    return (virtual.checktype,
+            virtual.service,
+            virtual.checkcommand,
+            virtual.externalhelpers,
+            real.ip.exploded,
+            None if virtual.checktype == Checktype.ping else virtual.checkport if virtual.checkport else real.port,
+            real.request if real.request else virtual.request,
+            real.receive if real.receive else virtual.receive,
+            virtual.hostname,
+            virtual.httpmethod,
+            virtual.httpkeepalive,
+            virtual.httpreconnect,
+            virtual.dbkeepalive,
+            virtual.login,
+            virtual.passwd,
+            virtual.database,
+            virtual.secret,
+            virtual.fingerprint,
+            virtual.checktimeout,
+            virtual.negotiatetimeout,
+            virtual.checkdeadline,
+            virtual.checkinterval,
+            virtual.maxcheckinterval,
+            virtual.fastcheckinterval,
+            virtual.failurecount,  # it ends the 'fastcheckinterval'
+            virtual.checkjitter,
+            virtual.stablecount,
+            # external commands get the virtual service as arguments, some check-modules connect to it
+            (virtual.ip.exploded, virtual.port) if virtual.checktype == Checktype.external
+            else virtual.ip.exploded if virtual.service in __VIRTUAL_SERVICE_CHECKS else None)
+
+
+class Probe(object):
+    """
+    A check shared by all real servers with the same probe key. It is executed with the configuration of one of its
+    subscribers, which is interchangeable with all the others.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+        # variable initialization
+        self.subscribers = []
+        self.scheduled_check = None
+        self.outcome = None  # (success, result or failure) of the last execution
+        self.successes = 0
+        self.failures = 0
+        self.expired = False
+        self.spec = None  # serialized configuration sent to check workers
+        self.metrics = metrics.CheckMetrics()
+        self.target = None  # instance of a stateful check-module
+
+    @property
+    def virtual(self):
+        return self.subscribers[0][0]
+
+    @property
+    def real(self):
+        return self.subscribers[0][1]
+
+    def subscribe(self, virtual, real):
+        self.subscribers.append((virtual, real))
+        real.probe = self
+
+    def unsubscribe(self, real):
+        self.subscribers = [(v, r) for v, r in self.subscribers if r is not real]
+        real.probe = None
@@ -4,3 +4,18 @@ class UnexpectedResultException(Exception):
 
 class IllegalConfigurationException(Exception):
     pass
+
+
+class IPVSException(Exception):
+    pass
+
+
+class CheckTimeoutException(Exception):
+    pass
+
+
+class RemoteCheckException(Exception):
+    def __init__(self, kind, reason, outcome=None):
+        super(RemoteCheckException, self).__init__(reason)
+        self.kind = kind  # name of the exception raised in the check worker
+        self.outcome = outcome  # name of its outcome class as determined by the check worker
@@ -2,10 +2,13 @@
 """
 PyDirectord is a replacement of 'ldirectord' in python using the twisted framework.
 """
+import json
 import logging
 import optparse
 import os
+import signal
 import sys
+import time
 from pathlib import Path
 
 from twisted.internet import reactor
@@ -14,8 +17,15 @@ from twisted.logger import globalLogBeginner
 import check
 import config
 import external
+import exporter
+import ipvsadm
+import metrics
+import netlink
+import reload
+import worker
 from daemon import Daemon
 from enums import *
+from pydexceptions import IllegalConfigurationException, IPVSException
 
 __author__ = "Martin Herrmann"
 __copyright__ = "Copyright 2016, Martin Herrmann"
@@ -28,7 +38,7 @@ __status__ = "Alpha"
 
 
 def parse_args():
-    usage = """%prog [options] start | stop | restart | status
+    usage = """%prog [options] start | stop | restart | reload | status | stats
 
     PyDirectord Copyright (C) 2016 Martin Herrmann
     This program comes with ABSOLUTELY NO WARRANTY.
@@ -40,6 +50,8 @@ def parse_args():
                       help="don't start as daemon and log verbosely")
     parser.add_option("-f", "--file", dest="config_file", default=external.config_file,
                       help="use this configuration file [default: %default]", metavar="CONFIG")
+    parser.add_option("--check-worker", action="store_true", dest="check_worker", default=False,
+                      help=optparse.SUPPRESS_HELP)
     (options, args) = parser.parse_args()
 
     config.parse_config(options.config_file)
@@ -50,7 +62,12 @@ def parse_args():
     # insert PyDirectord version information into global_config
     global_config.version = __version__
 
+    # daemonizing changes the working directory, check workers are started with these paths later on
+    global_config.script = os.path.abspath(sys.argv[0])
+    global_config.configfile = os.path.abspath(global_config.configfile)
+
     # make some changes depending on the command-line arguments
+    global_config.is_check_worker = options.check_worker
     if options.debug:
         global_config.supervised = True
         global_config.log_level = logging.DEBUG
@@ -58,7 +75,7 @@ def parse_args():
         # determine initial action
         action = args[0] if len(args) >= 1 else None
         if action is None:
-            if global_config.supervised:
+            if global_config.supervised or global_config.is_check_worker:
                 pass  # nothing to do, this is fine
             else:
                 print("No action specified, terminating...", file=sys.stderr)
@@ -73,6 +90,8 @@ def parse_args():
             global_config.initial_action = Action.reload
         elif action == "status":
             global_config.initial_action = Action.status
+        elif action == "stats":
+            global_config.initial_action = Action.stats
         else:
             print("Unknown action '%s', terminating..." % action, file=sys.stderr)
             sys.exit(4)
@@ -80,22 +99,25 @@ def parse_args():
     return global_config, virtuals
 
 
-def check_config_updated(global_config):
-    statinfo = os.stat(global_config.configfile)
+def stats_file(global_config):
+    return external.pid_path + "pydirectord." + os.path.basename(global_config.configfile) + ".stats"
 
-    # has the config file been modified?
-    if statinfo.st_mtime > global_config.last_modified:
-        # parse the changed config file
-        global_config.new_global_config, global_config.new_virtuals = config.parse_config(global_config.configfile)
 
-        # do a force start just before we terminate
-        global_config.action_on_stop = Action.force_start
+def write_stats(virtuals, global_config):
+    """
+    Writes the statistics of the checks to the stats file, 'pydirectord stats' requests this by sending SIGUSR1.
 
-        # stop reactor and therefore eventually kill the program
-        global_config.log.info("The config file '%s' has been updated, restarting..." % global_config.configfile)
-        reactor.stop()
-    else:
-        reactor.callLater(external.config_check_period, check_config_updated, global_config)
+    :param virtuals: the list containing all virtual services.
+    :param global_config: the global configuration
+    :return: nothing
+    """
+    path = stats_file(global_config)
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump(metrics.dump(virtuals, global_config), f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        global_config.log.error("Writing the statistics to '%s' failed: %s" % (path, str(e)))
 
 
 def sanity_check(global_config):
@@ -105,10 +127,21 @@ def sanity_check(global_config):
     :param global_config: the global configuration
     :return:
     """
-    ipvsadm = Path(external.ipvsadm_path)
-    if not ipvsadm.is_file():
+    # try to talk to the kernel directly if requested, 'ipvsadm' is used as a fallback
+    if global_config.ipvsbackend == IPVSBackend.netlink:
+        try:
+            netlink.open_connection(global_config)
+            global_config.ipvs = netlink
+            return
+        except (OSError, IPVSException) as e:
+            global_config.log.warning("The netlink ipvs backend is not available (%s), falling back to 'ipvsadm'"
+                                      % str(e))
+
+    ipvsadm_path = Path(external.ipvsadm_path)
+    if not ipvsadm_path.is_file():
         global_config.log.critical("The 'ipvsadm' tool could not be found at %s" % external.ipvsadm_path)
         sys.exit(1)
+    global_config.ipvs = ipvsadm
 
 
 def main():
@@ -129,8 +162,21 @@ def main():
     handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
     global_config.log.addHandler(handler)
 
+    # load the check-modules in use before daemonizing, so a missing or broken one is reported right away
+    if not global_config.is_check_worker and (global_config.supervised or global_config.initial_action in
+                                              (Action.start, Action.restart, Action.force_start)):
+        try:
+            check.prepare_check_modules(virtuals, global_config)
+        except IllegalConfigurationException as e:
+            global_config.log.critical("Illegal configuration: %s" % str(e))
+            if not global_config.supervised:
+                print("Illegal configuration: %s" % str(e), file=sys.stderr)
+            sys.exit(1)
+
     # check whether to daemonize or not
-    if global_config.supervised:
+    if global_config.is_check_worker:
+        worker.run_worker(global_config)
+    elif global_config.supervised:
         start_reactor(virtuals, global_config)
     else:
         daemon_handling(virtuals, global_config)
@@ -148,15 +194,30 @@ def start_reactor(virtuals, global_config):
     # perform a sanity check of the environment
     sanity_check(global_config)
 
-    # prepare the check-modules
-    check.prepare_check_modules(global_config)
+    # execute the checks in separate processes if requested
+    worker.start_workers(global_config)
 
     # perform the final preparations before starting the reactor
     check.initialize(virtuals, global_config)
 
+    # expose metrics over HTTP if requested
+    exporter.start_exporter(virtuals, global_config)
+
     # configure cleanup on reactor shutdown
     reactor.addSystemEventTrigger("before", "shutdown", check.cleanup, virtuals, global_config)
 
+    # reload the configuration on SIGHUP and, if requested, whenever the config file changes
+    global_config.last_modified = os.stat(global_config.configfile).st_mtime
+    signal.signal(signal.SIGHUP, lambda signum, frame: reactor.callFromThread(reload.reload_config, virtuals,
+                                                                              global_config))
+    reload.schedule_autoreload(virtuals, global_config)
+
+    # dump the statistics of the checks on SIGUSR1
+    signal.signal(signal.SIGUSR1, lambda signum, frame: reactor.callFromThread(write_stats, virtuals, global_config))
+
+    # repair the ipvs table periodically if it has been changed behind our back
+    reload.schedule_reconcile(virtuals, global_config)
+
     # run the reactor
     reactor.run()
 
@@ -193,7 +254,9 @@ def daemon_handling(virtuals, global_config):
     elif global_config.initial_action == Action.status:
         pydirectord.status()
     elif global_config.initial_action == Action.reload:
-        pydirectord.restart()  # FIXME: actually reload instead of restarting
+        pydirectord.reload()
+    elif global_config.initial_action == Action.stats:
+        pydirectord.stats()
     elif global_config.initial_action == Action.force_start:
         pydirectord.force_start()
     else:
@@ -212,6 +275,32 @@ class PyDirectorDaemon(Daemon):
     def run(self):
         start_reactor(self.virtuals, self.global_config)
 
+    def stats(self):
+        """Make the daemon write the statistics of its checks and print them."""
+        path = stats_file(self.global_config)
+        try:
+            last_modified = os.stat(path).st_mtime
+        except OSError:
+            last_modified = 0
+
+        # Ask the daemon for its statistics
+        self.send_signal(signal.SIGUSR1)
+
+        # Wait for the daemon to write them
+        deadline = time.time() + external.stats_timeout
+        while time.time() < deadline:
+            try:
+                if os.stat(path).st_mtime != last_modified:
+                    with open(path, 'r') as f:
+                        print(f.read())
+                    return
+            except OSError:
+                pass
+            time.sleep(0.1)
+
+        sys.stderr.write("PyDirectord did not write its statistics to {0}\n".format(path))
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     # check if we are running as root
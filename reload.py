@@ -0,0 +1,260 @@
+"""
+In-process reload of the configuration. The new configuration is compared to the running one and only the differences
+are applied: checks of unchanged real servers keep running with their health state, checks are only started and
+stopped for real servers that have been added or removed, and only the resulting changes are written to the ipvs table.
+"""
+import configparser
+import os
+
+from twisted.internet import reactor
+
+import check
+import command
+import config
+import external
+import ipvs
+from pydexceptions import IllegalConfigurationException
+
+# attributes describing the state of a virtual service at runtime rather than its configuration
+__VIRTUAL_STATE = ("is_present", "target_present", "real", "fallback")
+
+# attributes describing the state of a real server at runtime rather than its configuration
+__REAL_STATE = ("failcount", "current_weight", "is_present", "target_weight", "target_present", "active",
+                "probe", "ramp_started", "ramp_call", "latency", "failed", "successcount", "penalty",
+                "penalty_updated", "suppressed")
+
+
+def __configuration(obj, state):
+    return {name: value for name, value in vars(obj).items() if name not in state}
+
+
+def __real_key(real):
+    return real.ip.exploded, real.port
+
+
+def __fallback_config(fallback):
+    return fallback.ip.exploded, fallback.port, fallback.method
+
+
+def __remove_virtual(virtual, global_config):
+    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+    global_config.log.info("Removing virtual service " + virtual_hostname + " which is no longer configured")
+
+    for real in virtual.real:
+        check.stop_check(real, global_config)
+
+    if virtual.target_present:
+        ipvs.delete_virtual_service(virtual, global_config)
+
+
+def __add_virtual(virtual, global_config):
+    virtual_hostname = virtual.ip.exploded + ":" + str(virtual.port)
+    global_config.log.info("Adding virtual service " + virtual_hostname)
+
+    ipvs.add_virtual_service(virtual, global_config)
+    if virtual.quiescent:
+        for real in virtual.real:
+            ipvs.add_real_server(virtual, real, global_config)
+    check.update_fallback(virtual, global_config)
+
+    for real in virtual.real:
+        check.start_check(virtual, real, global_config)
+
+
+def __update_virtual(old, new, global_config):
+    virtual_hostname = old.ip.exploded + ":" + str(old.port)
+
+    # take over the new settings of the virtual service itself, running checks will use them from now on
+    scheduler = old.scheduler
+    for name, value in __configuration(new, __VIRTUAL_STATE).items():
+        setattr(old, name, value)
+    if old.scheduler != scheduler:
+        global_config.log.info("Setting scheduler of virtual service " + virtual_hostname + " to " + old.scheduler.name)
+        ipvs.edit_virtual_service(old, global_config)
+
+    current = {__real_key(real): real for real in old.real}
+    reals = []
+    for real in new.real:
+        real_hostname = real.ip.exploded + ":" + str(real.port)
+        existing = current.pop(__real_key(real), None)
+
+        # a new real server is set up like during startup
+        if existing is None:
+            global_config.log.info("Adding real server " + real_hostname + " to " + virtual_hostname)
+            if old.quiescent:
+                ipvs.add_real_server(old, real, global_config)
+            reals.append(real)
+            check.start_check(old, real, global_config)
+            continue
+
+        # the real server keeps its health state and its check, only changed settings are taken over
+        reals.append(existing)
+        if __configuration(existing, __REAL_STATE) == __configuration(real, __REAL_STATE):
+            continue
+
+        method = existing.method
+        for name, value in __configuration(real, __REAL_STATE).items():
+            setattr(existing, name, value)
+
+        weight = existing.target_weight
+        # a running slow-start takes care of a raised weight by itself
+        if existing.target_weight > existing.weight or (existing.target_weight > 0 and existing.failcount == 0
+                                                        and existing.ramp_call is None):
+            existing.target_weight = existing.weight
+        if existing.target_present and (existing.target_weight != weight or existing.method != method):
+            global_config.log.info("Setting real " + real_hostname + " to " + str(existing.target_weight))
+            ipvs.edit_real_server(old, existing, global_config)
+
+    # real servers which are not configured anymore
+    for real in current.values():
+        real_hostname = real.ip.exploded + ":" + str(real.port)
+        global_config.log.info("Removing real server " + real_hostname + " from " + virtual_hostname)
+        check.stop_check(real, global_config)
+        if real.target_present:
+            ipvs.delete_real_server(old, real, global_config)
+    old.real = reals
+
+    # changed settings of the virtual service or its real servers might call for other probes
+    for real in reals:
+        check.update_check(old, real, global_config)
+
+    # replace the fallback if it changed
+    fallback = old.fallback
+    if fallback is None or new.fallback is None or __fallback_config(fallback) != __fallback_config(new.fallback):
+        if fallback is not None and fallback.target_present:
+            global_config.log.info("Removing fallback from " + virtual_hostname)
+            ipvs.delete_real_server(old, fallback, global_config)
+        old.fallback = new.fallback
+    check.update_fallback(old, global_config)
+
+
+def reload_config(virtuals, global_config):
+    """
+    Parses the configuration file again and applies the differences to the running configuration.
+
+    :param virtuals: the list containing all virtual services, it is updated in place.
+    :param global_config: the global configuration
+    :return: nothing
+    """
+    global_config.log.info("Reloading the configuration from '%s'" % global_config.configfile)
+    try:
+        global_config.last_modified = os.stat(global_config.configfile).st_mtime
+    except OSError as e:
+        global_config.log.error("The configuration file '%s' cannot be read (%s), keeping the running configuration"
+                                % (global_config.configfile, str(e)))
+        return
+
+    try:
+        new_global_config, new_virtuals = config.parse_config(global_config.configfile)
+    except (SystemExit, ValueError, KeyError, TypeError, configparser.Error) as e:
+        # e.g. a file saved while being edited, SystemExit has been logged by the parser already
+        reason = "" if isinstance(e, SystemExit) else " (%s)" % str(e).splitlines()[0]
+        global_config.log.error("The configuration file '%s' is invalid%s, keeping the running configuration"
+                                % (global_config.configfile, reason))
+        return
+
+    # an empty or truncated file, e.g. saved while being edited, would remove every virtual service
+    if new_global_config is None or not new_virtuals:
+        global_config.log.error("The configuration file '%s' has no [global] section or no virtual services, keeping "
+                                "the running configuration" % global_config.configfile)
+        return
+
+    # check-modules of services that were not in use before are loaded now, the configuration is rejected if one fails
+    try:
+        check.prepare_check_modules(new_virtuals, global_config)
+    except IllegalConfigurationException as e:
+        global_config.log.error("The configuration file '%s' is invalid (%s), keeping the running configuration"
+                                % (global_config.configfile, str(e)))
+        return
+
+    # settings that can be changed at runtime
+    if new_global_config.ipvsbackend != global_config.ipvsbackend:
+        global_config.log.warning("Changing 'ipvsbackend' requires a restart")
+    if new_global_config.checkworkers != global_config.checkworkers:
+        global_config.log.warning("Changing 'checkworkers' requires a restart")
+    if new_global_config.metricsaddress != global_config.metricsaddress:
+        global_config.log.warning("Changing 'metricsaddress' requires a restart")
+    autoreload_changed = new_global_config.autoreload != global_config.autoreload
+    reconcile_changed = new_global_config.reconcileinterval != global_config.reconcileinterval
+    global_config.autoreload = new_global_config.autoreload
+    global_config.ipvsbatchwindow = new_global_config.ipvsbatchwindow
+    global_config.ipvsconcurrency = new_global_config.ipvsconcurrency
+    global_config.reconcileinterval = new_global_config.reconcileinterval
+    global_config.checkconcurrency = new_global_config.checkconcurrency
+    global_config.checkmoduleconcurrency = new_global_config.checkmoduleconcurrency
+
+    # the periodic tasks follow their new settings right away
+    if autoreload_changed:
+        schedule_autoreload(virtuals, global_config)
+    if reconcile_changed:
+        schedule_reconcile(virtuals, global_config)
+
+    current = {ipvs.virtual_key(virtual): virtual for virtual in virtuals}
+    result = []
+    for virtual in new_virtuals:
+        existing = current.pop(ipvs.virtual_key(virtual), None)
+        if existing is None:
+            __add_virtual(virtual, global_config)
+            result.append(virtual)
+        else:
+            __update_virtual(existing, virtual, global_config)
+            result.append(existing)
+
+    for virtual in current.values():
+        __remove_virtual(virtual, global_config)
+
+    virtuals[:] = result
+    command.prune(virtuals, global_config)
+    global_config.log.info("Reloading the configuration done")
+
+
+def __cancel(call):
+    if call is not None and call.active():
+        call.cancel()
+
+
+def __check_config_updated(virtuals, global_config):
+    global_config.autoreload_call = None
+    try:
+        modified = os.stat(global_config.configfile).st_mtime > global_config.last_modified
+    except OSError:
+        modified = False  # it is probably being replaced, we will see the new one next time
+
+    try:
+        if modified:
+            global_config.log.info("The config file '%s' has been updated, reloading..." % global_config.configfile)
+            reload_config(virtuals, global_config)
+    finally:
+        # whatever went wrong with this reload, the next change of the file has to be picked up
+        schedule_autoreload(virtuals, global_config)
+
+
+def schedule_autoreload(virtuals, global_config):
+    """
+    (Re-)arms the periodic check whether the configuration file has changed, as long as 'autoreload' is enabled.
+    """
+    __cancel(global_config.autoreload_call)
+    global_config.autoreload_call = None
+    if global_config.autoreload and not global_config.terminated:
+        global_config.autoreload_call = reactor.callLater(external.config_check_period, __check_config_updated,
+                                                          virtuals, global_config)
+
+
+def __check_ipvs_drift(virtuals, global_config):
+    global_config.reconcile_call = None
+    if global_config.terminated:
+        return
+
+    ipvs.reconcile(virtuals, global_config)
+    schedule_reconcile(virtuals, global_config)
+
+
+def schedule_reconcile(virtuals, global_config):
+    """
+    (Re-)arms the periodic repair of the ipvs table, as long as 'reconcileinterval' is set.
+    """
+    __cancel(global_config.reconcile_call)
+    global_config.reconcile_call = None
+    if global_config.reconcileinterval and not global_config.terminated:
+        global_config.reconcile_call = reactor.callLater(global_config.reconcileinterval, __check_ipvs_drift,
+                                                         virtuals, global_config)
@@ -12,7 +12,10 @@ class GlobalConfig(object):
     """
 
     def __init__(self, autoreload=False, callback=None, logfile="/var/log/pydirectord.log", smtp=None,
-                 supervised=False, maintenancedir=None, configfile="/etc/pydirectord/pydirectord.conf"):
+                 supervised=False, maintenancedir=None, configfile="/etc/pydirectord/pydirectord.conf",
+                 ipvsbackend=IPVSBackend.ipvsadm, ipvsbatchwindow=20, ipvsconcurrency=256,
+                 reconcileinterval=60, checkconcurrency=1024, checkmoduleconcurrency=None,
+                 checkworkers=0, metricsaddress=None):
         if isinstance(autoreload, bool):
             self.autoreload = autoreload
         else:
@@ -33,6 +36,49 @@ class GlobalConfig(object):
         else:
             raise ValueError
 
+        if isinstance(ipvsbackend, IPVSBackend):
+            self.ipvsbackend = ipvsbackend
+        else:
+            raise ValueError
+
+        if isinstance(ipvsbatchwindow, int) and ipvsbatchwindow >= 0:
+            self.ipvsbatchwindow = ipvsbatchwindow
+        else:
+            raise ValueError
+
+        if isinstance(ipvsconcurrency, int) and ipvsconcurrency > 0:
+            self.ipvsconcurrency = ipvsconcurrency
+        else:
+            raise ValueError
+
+        if isinstance(reconcileinterval, int) and reconcileinterval >= 0:
+            self.reconcileinterval = reconcileinterval
+        else:
+            raise ValueError
+
+        if isinstance(checkconcurrency, int) and checkconcurrency >= 0:
+            self.checkconcurrency = checkconcurrency
+        else:
+            raise ValueError
+
+        if isinstance(checkmoduleconcurrency, dict) and all(isinstance(limit, int) and limit > 0
+                                                            for limit in checkmoduleconcurrency.values()):
+            self.checkmoduleconcurrency = checkmoduleconcurrency
+        elif checkmoduleconcurrency is None:
+            self.checkmoduleconcurrency = dict()
+        else:
+            raise ValueError
+
+        if isinstance(checkworkers, int) and checkworkers >= 0:
+            self.checkworkers = checkworkers
+        else:
+            raise ValueError
+
+        if metricsaddress is None or (isinstance(metricsaddress, tuple) and len(metricsaddress) == 2):
+            self.metricsaddress = metricsaddress
+        else:
+            raise ValueError
+
         # program information
         self.version = None
 
@@ -40,10 +86,31 @@ class GlobalConfig(object):
         self.log = None
         self.log_level = logging.INFO
         self.checks = dict()
+        self.probes = dict()
+        self.check_limiter = None
+        self.check_wheel = None
+        self.check_timeouts = 0
+        self.check_metrics = dict()
+        self.check_workers = None
+        self.exporter = None
+        self.pingers = dict()
+        self.helper_pools = dict()
+        self.tls_contexts = dict()
+        self.db_threadpool = None
+        self.udp_sockets = dict()
+        self.is_check_worker = False
+        self.script = None  # absolute path of pydirectord.py, resolved before daemonizing
         self.initial_action = None
         self.last_modified = 0
+        self.autoreload_call = None
+        self.reconcile_call = None
         self.terminated = False
 
+        # ipvs backend actually in use (might differ from 'ipvsbackend' if we had to fall back to 'ipvsadm')
+        self.ipvs = None
+        self.netlink = None
+        self.pipeline = None
+
         # restart capabilities
         self.action_on_stop = None
         self.new_global_config = None
@@ -60,7 +127,11 @@ class __Virtual(object):
                  emailalertfreq=0, emailalertstatus=ServerStatus.all, fallbackcommand=None,
                  quiescent=True, readdquiescent=True, service=None, checkcommand=None, checkport=None, request=None,
                  receive=None, httpmethod=HTTPMethod.GET, hostname=None, login=None, passwd=None, database=None,
-                 secret=None, fingerprint=None, scheduler=Scheduler.wrr, persistent=None, protocol=None, **kwargs):
+                 secret=None, fingerprint=None, scheduler=Scheduler.wrr, persistent=None, protocol=None, slowstart=0,
+                 weighting=Weighting.static, checkjitter=0, checkpriority=0,
+                 maxcheckinterval=0, fastcheckinterval=0, stablecount=5, risecount=1, flapdamping=False,
+                 checkdeadline=0, externalhelpers=0, httpkeepalive=0, httpreconnect=100, dbkeepalive=0,
+                 **kwargs):
         self.ip = None
 
         if isinstance(port, int) and 0 < port <= 65535:
@@ -185,7 +256,7 @@ class __Virtual(object):
 
         if isinstance(fingerprint, basestring):
             self.fingerprint = fingerprint
-        elif secret is None:
+        elif fingerprint is None:
             self.fingerprint = None
         else:
             raise ValueError
@@ -205,11 +276,82 @@ class __Virtual(object):
         else:
             raise ValueError
 
+        if isinstance(slowstart, int) and slowstart >= 0:
+            self.slowstart = slowstart
+        else:
+            raise ValueError
+
+        if isinstance(weighting, Weighting):
+            self.weighting = weighting
+        else:
+            raise ValueError
+
+        if isinstance(checkjitter, int) and 0 <= checkjitter <= 100:
+            self.checkjitter = checkjitter
+        else:
+            raise ValueError
+
+        if isinstance(checkpriority, int):
+            self.checkpriority = checkpriority
+        else:
+            raise ValueError
+
+        if isinstance(maxcheckinterval, int) and (maxcheckinterval == 0 or maxcheckinterval >= self.checkinterval):
+            self.maxcheckinterval = maxcheckinterval
+        else:
+            raise ValueError
+
+        if isinstance(fastcheckinterval, int) and 0 <= fastcheckinterval <= self.checkinterval:
+            self.fastcheckinterval = fastcheckinterval
+        else:
+            raise ValueError
+
+        if isinstance(stablecount, int) and stablecount > 0:
+            self.stablecount = stablecount
+        else:
+            raise ValueError
+
+        if isinstance(risecount, int) and risecount > 0:
+            self.risecount = risecount
+        else:
+            raise ValueError
+
+        if isinstance(flapdamping, bool):
+            self.flapdamping = flapdamping
+        else:
+            raise ValueError
+
+        if isinstance(checkdeadline, int) and checkdeadline >= 0:
+            self.checkdeadline = checkdeadline
+        else:
+            raise ValueError
+
+        if isinstance(externalhelpers, int) and externalhelpers >= 0:
+            self.externalhelpers = externalhelpers
+        else:
+            raise ValueError
+
+        if isinstance(httpkeepalive, int) and httpkeepalive >= 0:
+            self.httpkeepalive = httpkeepalive
+        else:
+            raise ValueError
+
+        if isinstance(httpreconnect, int) and httpreconnect >= 0:
+            self.httpreconnect = httpreconnect
+        else:
+            raise ValueError
+
+        if isinstance(dbkeepalive, int) and dbkeepalive >= 0:
+            self.dbkeepalive = dbkeepalive
+        else:
+            raise ValueError
+
         # store any custom attributes
         self.custom = kwargs
 
-        # variable initialization
+        # variable initialization (is_present is only set once the kernel confirmed it, target_present immediately)
         self.is_present = False
+        self.target_present = False
 
 
 class Virtual4(__Virtual):
@@ -324,10 +466,22 @@ class __Real(object):
         # store any custom attributes
         self.custom = kwargs
 
-        # variable initialization
+        # variable initialization (current_weight and is_present are only set once the kernel confirmed them)
         self.failcount = 0
         self.current_weight = 0
         self.is_present = False
+        self.target_weight = 0
+        self.target_present = False
+        self.active = False
+        self.probe = None
+        self.ramp_started = None
+        self.ramp_call = None
+        self.latency = None
+        self.failed = False
+        self.successcount = 0
+        self.penalty = 0.0
+        self.penalty_updated = 0.0
+        self.suppressed = False
 
 
 class Real4(__Real):
@@ -377,10 +531,12 @@ class __Fallback(object):
         else:
             raise ValueError
 
-        # variable initialization
+        # variable initialization (current_weight and is_present are only set once the kernel confirmed them)
         self.weight = 1
-        self.current_weight = 1
+        self.current_weight = 0
         self.is_present = False
+        self.target_weight = 1
+        self.target_present = False
 
 
 class Fallback4(__Fallback):
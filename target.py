@@ -0,0 +1,95 @@
+"""
+Stateful interface of check-modules. A check-module either provides a function 'check(virtual, real, global_config)'
+which is called for every single check, or a subclass of CheckTarget named 'Target'. The latter is instantiated once per
+probe and kept as long as the probe exists, so it can keep connections, TLS sessions, compiled matchers or prepared
+queries between the checks:
+
+* '__init__(virtual, real, global_config)' validates and prepares the configuration, it raises an
+  IllegalConfigurationException just like a 'check' function would,
+* 'setup()' is called before the first check and may return a Deferred, if it fails, the check fails and the next one
+  starts over with a new instance,
+* 'probe()' performs a single check and returns a Deferred just like a 'check' function,
+* 'teardown()' releases everything once the probe is stopped.
+"""
+from twisted.internet.defer import maybeDeferred
+
+
+class CheckTarget(object):
+    def __init__(self, virtual, real, global_config):
+        self.virtual = virtual
+        self.real = real
+        self.global_config = global_config
+
+    def setup(self):
+        pass
+
+    def probe(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+def is_valid(module):
+    """
+    :return: whether a module implements either interface of check-modules
+    """
+    return hasattr(module, 'check') or hasattr(module, 'Target')
+
+
+def __cb_setup_failed(failure, holder, instance, global_config):
+    holder.target = None
+    release(instance, global_config)
+    return failure
+
+
+def __cb_probe(_, instance, outer):
+    d = instance.probe()
+    d.addBoth(__cb_adopt, d, outer)
+    return d
+
+
+def __cb_adopt(result, inner, outer):
+    # what the check-module reported about the check belongs to the Deferred the caller got
+    for attribute in ("marks", "handshake"):
+        if hasattr(inner, attribute):
+            setattr(outer, attribute, getattr(inner, attribute))
+    return result
+
+
+def run(module, holder, virtual, real, global_config):
+    """
+    Performs a check with a check-module of either interface.
+
+    :param module: the check-module.
+    :param holder: the object keeping the instance of a stateful check-module in its attribute 'target', e.g. the probe.
+    :param virtual: the virtual service this check is concerned with.
+    :param real: the specific real server this check is concerned with.
+    :param global_config: the global configuration object.
+    :return: the Deferred of the check
+    """
+    if not hasattr(module, 'Target'):
+        return module.check(virtual, real, global_config)
+
+    if holder.target is not None:
+        return holder.target.probe()
+
+    instance = holder.target = module.Target(virtual, real, global_config)
+    d = maybeDeferred(instance.setup)
+    d.addCallbacks(__cb_probe, __cb_setup_failed, callbackArgs=(instance, d),
+                   errbackArgs=(holder, instance, global_config))
+    return d
+
+
+def release(instance, global_config):
+    """
+    Tears down an instance of a stateful check-module, if there is one.
+    """
+    if instance is None:
+        return
+
+    try:
+        instance.teardown()
+    except Exception as e:
+        global_config.log.error("Tearing down the check of %s:%d failed: %s"
+                                % (instance.real.ip.exploded, instance.real.port, str(e)))
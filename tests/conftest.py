@@ -0,0 +1,26 @@
+import logging
+import os
+import sys
+import textwrap
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture
+def parse(tmp_path):
+    """
+    Parses a configuration consisting of a global section and a single virtual service with the given settings.
+    """
+    def parse(settings, host="192.168.0.1", port=80, global_settings="", service="http"):
+        path = tmp_path / "pydirectord.conf"
+        path.write_text("[global]\n" + global_settings
+                        + "\n[HTTP]\nhost=%s\nport=%d\nprotocol=tcp\nservice=%s\n" % (host, port, service)
+                        + textwrap.dedent(settings))
+        global_config, virtuals = config.parse_config(str(path))
+        global_config.log = logging.getLogger("pydirectord")
+        return global_config, virtuals[0]
+    return parse
@@ -0,0 +1,135 @@
+import types
+
+import pytest
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+
+import check
+import ipvs
+import probe
+
+
+def __record_weights(monkeypatch):
+    weights = []
+
+    def record(virtual, real, global_config):
+        weights.append(real.target_weight)
+
+    monkeypatch.setattr(ipvs, "add_real_server", record)
+    monkeypatch.setattr(ipvs, "edit_real_server", record)
+    return weights
+
+
+def test_real_weight_is_parsed(parse):
+    _, virtual = parse('real=["10.0.1.1:80 gate 10", "10.0.1.2:80 masq"]\n')
+    assert [real.weight for real in virtual.real] == [10, 1]
+
+
+def test_recovered_real_ramps_up_to_its_weight(parse, monkeypatch):
+    global_config, virtual = parse('slowstart=10\nreal=["10.0.1.1:80 gate 10"]\n')
+    real = virtual.real[0]
+    clock = Clock()
+    monkeypatch.setattr(check, "reactor", clock)
+    weights = __record_weights(monkeypatch)
+
+    real.active = True
+    real.failed = True
+    getattr(check, "__cb_running")(None, virtual, real, global_config)
+    assert weights == [1]
+
+    for _ in range(10):
+        clock.advance(1)
+    assert weights == sorted(weights)
+    assert weights[-1] == 10
+    assert len(weights) > 2
+    assert real.ramp_call is None
+
+
+def test_latency_weighting_prefers_the_faster_real(parse, monkeypatch):
+    global_config, virtual = parse('weighting=latency\nreal=["10.0.1.1:80 gate 10", "10.0.1.2:80 gate 10"]\n')
+    fast, slow = virtual.real
+    weights = __record_weights(monkeypatch)
+
+    fast.latency = 0.01
+    slow.latency = 0.04
+    for real in virtual.real:
+        real.active = True
+        real.target_present = True
+        real.target_weight = real.weight
+        getattr(check, "__cb_running")(None, virtual, real, global_config)
+
+    # the slower real server is scaled down, the faster one keeps its configured weight
+    assert weights == [slow.target_weight]
+    assert fast.target_weight == 10 > slow.target_weight > 1
+
+
+def test_risecount_requires_consecutive_successes(parse, monkeypatch):
+    global_config, virtual = parse('risecount=3\nfailurecount=3\nreal=["10.0.1.1:80 gate"]\n')
+    real = virtual.real[0]
+    weights = __record_weights(monkeypatch)
+
+    real.active = True
+    real.failed = True
+    real.failcount = virtual.failurecount
+    for ok in (True, True, False, True):
+        if ok:
+            getattr(check, "__cb_running")(None, virtual, real, global_config)
+        else:
+            getattr(check, "__cb_error")(Failure(Exception("down")), virtual, real, global_config)
+    assert weights == []
+    assert real.failed
+
+    getattr(check, "__cb_running")(None, virtual, real, global_config)
+    getattr(check, "__cb_running")(None, virtual, real, global_config)
+    assert weights == [1]
+    assert not real.failed
+
+
+class _Timer(object):
+    def __init__(self, function):
+        self.function = function
+        self.cancelled = False
+
+    def active(self):
+        return not self.cancelled
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Wheel(object):
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, function, *args):
+        timer = _Timer(function)
+        self.timers.append(timer)
+        return timer
+
+
+def test_probe_of_a_raising_check_module_is_rescheduled(parse, monkeypatch):
+    global_config, virtual = parse('real=["10.0.1.1:80 gate"]\n')
+    real = virtual.real[0]
+    __record_weights(monkeypatch)
+    monkeypatch.setattr(ipvs, "delete_real_server", lambda virtual, real, global_config: None)
+    global_config.check_wheel = _Wheel()
+
+    def broken(virtual, real, global_config):
+        raise RuntimeError("bug in the check-module")
+
+    shared = probe.Probe(probe.probe_key(virtual, real))
+    shared.subscribe(virtual, real)
+    real.active = True
+    getattr(check, "__run_check")(shared, "broken", types.SimpleNamespace(check=broken), global_config)
+
+    assert shared.failures == 1
+    assert real.failed
+    assert [timer.function for timer in global_config.check_wheel.timers if timer.active()] == [check.do_check]
+    assert shared.scheduled_check is global_config.check_wheel.timers[-1]
+
+
+def test_fractional_deadline_is_reported():
+    shared = types.SimpleNamespace(expired=True)
+    failure = Failure(check.CancelledError())
+    with pytest.raises(check.CheckTimeoutException, match="within 0.5s"):
+        getattr(check, "__cb_expired")(failure, shared, 0.5)
@@ -0,0 +1,81 @@
+import types
+
+import pytest
+from twisted.internet import error
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+from twisted.protocols.policies import TimeoutMixin
+from twisted.python.failure import Failure
+
+import check
+import probe
+from enums import Outcome
+
+
+class _Connector(object):
+    """
+    Behaves like the connectors of the reactor: disconnecting while connecting fails the connection right away, an
+    established connection is reported to be lost in the next iteration.
+    """
+
+    def __init__(self, factory, clock):
+        self.factory = factory
+        self.clock = clock
+        self.protocol = None
+
+    def connect(self):
+        self.protocol = self.factory.buildProtocol(None)
+        self.protocol.makeConnection(StringTransport())
+
+    def disconnect(self):
+        if self.protocol is None:
+            self.factory.clientConnectionFailed(self, Failure(error.UserError()))
+        else:
+            self.clock.callLater(0, self.__lost)
+
+    def __lost(self):
+        self.protocol.connectionLost(Failure(error.ConnectionDone()))
+        self.factory.clientConnectionLost(self, Failure(error.ConnectionDone()))
+
+
+class _Reactor(Clock):
+    def __init__(self):
+        super(_Reactor, self).__init__()
+        self.connectors = []
+
+    def connectTCP(self, host, port, factory, timeout=30):
+        self.connectors.append(_Connector(factory, self))
+        return self.connectors[-1]
+
+    def connectSSL(self, host, port, factory, contextFactory, timeout=30):
+        return self.connectTCP(host, port, factory, timeout)
+
+
+@pytest.mark.parametrize("connected", [False, True])
+@pytest.mark.parametrize("service", ["imap", "imaps", "smtp", "ssh"])
+def test_stalled_check_times_out_once(parse, monkeypatch, service, connected):
+    clock = _Reactor()
+    module = pytest.importorskip("checks." + service)
+    for patched in (module, check):
+        monkeypatch.setattr(patched, "reactor", clock)
+    monkeypatch.setattr(TimeoutMixin, "callLater", clock.callLater)
+
+    global_config, virtual = parse('fingerprint=00:11\ncheckdeadline=5\nnegotiatetimeout=60\nreal=["10.0.1.1:80 gate"]\n',
+                                   service=service)
+    global_config.check_wheel = types.SimpleNamespace(call_later=clock.callLater)
+    shared = probe.Probe(probe.probe_key(virtual, virtual.real[0]))
+    shared.subscribe(virtual, virtual.real[0])
+    outcomes = []
+    monkeypatch.setattr(check, "__cb_failure", lambda failure, probe, global_config: outcomes.append(failure))
+    monkeypatch.setattr(check, "__cb_repeat", lambda _, probe, global_config: None)
+
+    getattr(check, "__run_check")(shared, service, module, global_config)
+    if connected:
+        clock.connectors[0].connect()
+    clock.advance(5)
+    clock.advance(0)
+
+    assert len(outcomes) == 1
+    assert outcomes[0].check(check.CheckTimeoutException)
+    assert shared.metrics.outcomes[Outcome.timeout.value] == 1
+    assert sum(shared.metrics.outcomes) == 1
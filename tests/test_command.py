@@ -0,0 +1,94 @@
+import logging
+import signal
+import types
+
+import pytest
+from twisted.internet import error
+from twisted.internet.defer import CancelledError
+from twisted.internet.task import Clock
+
+import command
+from pydexceptions import UnexpectedResultException
+
+
+class _Transport(object):
+    def __init__(self):
+        self.written = []
+        self.signals = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def signalProcess(self, signal_number):
+        self.signals.append(signal_number)
+
+
+class _Reactor(Clock):
+    def __init__(self):
+        super(_Reactor, self).__init__()
+        self.helpers = []
+
+    def spawnProcess(self, protocol, executable, args, env=None):
+        protocol.makeConnection(_Transport())
+        self.helpers.append(protocol)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(command, "reactor", _Reactor())
+    global_config = types.SimpleNamespace(terminated=False, log=logging.getLogger("pydirectord"))
+    return command.HelperPool("/usr/local/bin/check", 1, global_config)
+
+
+def __results(d):
+    results = []
+    d.addBoth(results.append)
+    return results
+
+
+def test_requests_wait_for_a_free_helper(pool):
+    first = __results(pool.run("a", 5))
+    second = __results(pool.run("b", 5))
+    helper, = command.reactor.helpers
+    assert helper.transport.written == [b"a\n"]
+
+    helper.outReceived(b"OK fine\n")
+    assert first == ["OK fine"]
+    assert helper.transport.written == [b"a\n", b"b\n"]
+
+    helper.outReceived(b"connection refused\n")
+    assert isinstance(second[0].value, UnexpectedResultException)
+    assert not command.reactor.getDelayedCalls()
+
+
+def test_helper_exceeding_the_timeout_is_killed(pool):
+    results = __results(pool.run("a", 5))
+    helper, = command.reactor.helpers
+
+    command.reactor.advance(5)
+    assert isinstance(results[0].value, error.TimeoutError)
+    assert helper.transport.signals == [signal.SIGKILL]
+
+
+def test_cancelled_request_does_not_time_out_later(pool):
+    d = pool.run("a", 5)
+    results = __results(d)
+    helper, = command.reactor.helpers
+
+    d.cancel()
+    assert isinstance(results[0].value, CancelledError)
+    assert helper.transport.signals == [signal.SIGKILL]
+    assert not command.reactor.getDelayedCalls()
+    command.reactor.advance(5)
+
+
+def test_cancelled_request_is_removed_from_the_queue(pool):
+    __results(pool.run("a", 5))
+    d = pool.run("b", 5)
+    __results(d)
+    d.cancel()
+    helper, = command.reactor.helpers
+
+    helper.outReceived(b"OK\n")
+    assert helper.transport.written == [b"a\n"]
+    assert helper.transport.signals == []
@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+
+import database
+from pydexceptions import UnexpectedResultException
+
+
+class _Reactor(Clock):
+    def callFromThread(self, function, *args, **kwargs):
+        function(*args, **kwargs)
+
+
+class _ThreadPool(object):
+    """
+    Runs the work handed to it right away instead of in a thread.
+    """
+
+    def callInThread(self, function, *args, **kwargs):
+        function(*args, **kwargs)
+
+    def callInThreadWithCallback(self, on_result, function, *args, **kwargs):
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            on_result(False, Failure())
+        else:
+            on_result(True, result)
+
+
+class _Target(database.DatabaseTarget):
+    name = "SQLite"
+
+    def __init__(self, virtual, real, global_config, path):
+        super(_Target, self).__init__(virtual, real, global_config)
+        self.path = path
+        self.connections = 0
+
+    def connect(self):
+        self.connections += 1
+        return sqlite3.connect(self.path)
+
+
+@pytest.fixture
+def target(parse, tmp_path, monkeypatch):
+    def target(settings=""):
+        global_config, virtual = parse('login=check\ndatabase=checks\nrequest=SELECT 1\nreal=["10.0.1.1:80 gate"]\n'
+                                       + settings)
+        global_config.db_threadpool = _ThreadPool()
+        return _Target(virtual, virtual.real[0], global_config, str(tmp_path / "checks.db"))
+
+    monkeypatch.setattr(database, "reactor", _Reactor())
+    return target
+
+
+def __run(target):
+    results = []
+    target.probe().addBoth(results.append)
+    return results[0]
+
+
+def test_connection_is_closed_after_each_check(target):
+    instance = target()
+    assert __run(instance) is None
+    assert __run(instance) is None
+    assert instance.connections == 2
+    assert instance.connection is None
+
+
+def test_connection_is_kept_with_dbkeepalive(target):
+    instance = target("dbkeepalive=30\n")
+    assert __run(instance) is None
+    assert __run(instance) is None
+    assert instance.connections == 1
+    assert instance.connection is not None
+
+    database.reactor.advance(30)
+    assert instance.connection is None
+
+
+def test_kept_connection_is_closed_after_a_failed_check(target):
+    instance = target("dbkeepalive=30\n")
+    instance.virtual.request = "SELECT 1 WHERE 0"
+    assert isinstance(__run(instance).value, UnexpectedResultException)
+    assert instance.connection is None
+
+    instance.teardown()
+    assert not database.reactor.getDelayedCalls()
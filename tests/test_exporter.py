@@ -0,0 +1,45 @@
+import logging
+import types
+
+from twisted.internet.task import Clock, Cooperator
+from twisted.web.test.requesthelper import DummyRequest
+
+import exporter
+
+
+class _Request(DummyRequest):
+    lost = False
+
+    def loseConnection(self):
+        self.lost = True
+
+
+def __render(monkeypatch, chunks):
+    clock = Clock()
+    monkeypatch.setattr(exporter, "cooperate", Cooperator(scheduler=lambda work: clock.callLater(0, work)).cooperate)
+    global_config = types.SimpleNamespace(log=logging.getLogger("pydirectord"))
+    resource = exporter._MetricsResource(types.SimpleNamespace(render=chunks, global_config=global_config))
+
+    request = _Request([b"metrics"])
+    resource.render_GET(request)
+    while clock.getDelayedCalls():
+        clock.advance(0)
+    return request
+
+
+def test_metrics_are_rendered(monkeypatch):
+    request = __render(monkeypatch, lambda: iter(["a 1\n", "b 2\n"]))
+    assert b"".join(request.written) == b"a 1\nb 2\n"
+    assert request.finished
+    assert not request.lost
+
+
+def test_failed_rendering_drops_the_connection(monkeypatch, caplog):
+    def chunks():
+        yield "a 1\n"
+        raise RuntimeError("broken gauge")
+
+    request = __render(monkeypatch, chunks)
+    assert not request.finished
+    assert request.lost
+    assert "broken gauge" in caplog.text
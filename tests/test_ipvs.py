@@ -0,0 +1,60 @@
+import logging
+
+import pytest
+from twisted.internet.task import Clock
+
+import external
+import ipvs
+import pipeline
+from enums import ForwardingMethod, IPVSCommand, Protocol, Scheduler
+
+_TABLE = """IP Virtual Server version 1.2.1 (size=4096)
+Prot LocalAddress:Port Scheduler Flags
+  -> RemoteAddress:Port Forward Weight ActiveConn InActConn
+TCP  C0A80001:0050 wrr
+  -> 0A000101:0050      Route   10     0          0
+  -> 0A000109:0050      Masq    1      0          0
+UDP  [2001:0db8:0000:0000:0000:0000:0000:0001]:0035 mh
+FWM  00000001 wlc
+  -> 0A000102:0050      Masq    1      0          0
+"""
+
+
+@pytest.fixture
+def table(tmp_path, monkeypatch):
+    def table(content):
+        path = tmp_path / "ip_vs"
+        path.write_text(content)
+        monkeypatch.setattr(external, "ipvs_proc_path", str(path))
+        return ipvs.read_ipvs_table(None)
+    return table
+
+
+def test_ipvs_table_is_parsed(table):
+    assert table(_TABLE) == {
+        (Protocol.tcp, "192.168.0.1", 80): (Scheduler.wrr, {("10.0.1.1", 80): (ForwardingMethod.gate, 10),
+                                                            ("10.0.1.9", 80): (ForwardingMethod.masq, 1)}),
+        (Protocol.udp, "2001:0db8:0000:0000:0000:0000:0000:0001", 53): (None, dict()),
+    }
+
+
+def test_reconcile_repairs_only_what_drifted(parse, table, monkeypatch):
+    global_config, virtual = parse('real=["10.0.1.1:80 gate 10", "10.0.1.2:80 gate 10", "10.0.1.3:80 gate 10"]\n')
+    global_config.log = logging.getLogger("pydirectord")
+    current = table(_TABLE)
+    global_config.pipeline = pipeline.CommandPipeline(global_config, current)
+    monkeypatch.setattr(pipeline, "reactor", Clock())
+
+    virtual.target_present = True
+    first, second, third = virtual.real
+    first.target_present, first.target_weight = True, 10  # as it is in the kernel
+    second.target_present, second.target_weight = True, 5  # missing in the kernel
+    third.target_present, third.target_weight = False, 0  # missing as it should be
+
+    assert ipvs.reconcile([virtual], global_config) == 2
+    pending = {key: command.action for key, command in global_config.pipeline.pending.items()}
+    assert pending == {ipvs.real_key(virtual, second): IPVSCommand.add,
+                       (ipvs.virtual_key(virtual), "10.0.1.9", 80): IPVSCommand.delete}
+
+    # entries with a change on its way are left alone
+    assert ipvs.reconcile([virtual], global_config) == 0
@@ -0,0 +1,76 @@
+import logging
+import types
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+
+import limiter
+
+
+class _Clock(Clock):
+    """
+    Time passes between any two readings, like it does with the reactor.
+    """
+
+    def seconds(self):
+        self.rightNow += 0.000001
+        return self.rightNow
+
+
+def __limiter(monkeypatch, checkconcurrency=1, checkmoduleconcurrency=None):
+    clock = _Clock()
+    monkeypatch.setattr(limiter, "reactor", clock)
+    global_config = types.SimpleNamespace(checkconcurrency=checkconcurrency,
+                                          checkmoduleconcurrency=checkmoduleconcurrency or dict(),
+                                          log=logging.getLogger("pydirectord"))
+    return limiter.CheckLimiter(global_config), clock
+
+
+def test_checks_started_right_away_are_not_delayed(monkeypatch):
+    check_limiter, clock = __limiter(monkeypatch)
+    for _ in range(10):
+        clock.advance(1)
+        check_limiter.submit("http", 0, succeed, None)
+
+    stats = check_limiter.stats()
+    assert (stats["started"], stats["delayed"], stats["running"]) == (10, 0, 0)
+
+
+def test_only_queued_checks_are_delayed(monkeypatch, caplog):
+    check_limiter, clock = __limiter(monkeypatch)
+    checks = [Deferred() for _ in range(3)]
+    for d in checks:
+        check_limiter.submit("http", 0, lambda d=d: d)
+    assert check_limiter.stats()["waiting"] == 2
+
+    clock.advance(2)
+    with caplog.at_level(logging.DEBUG, logger="pydirectord"):
+        checks[0].callback(None)
+        checks[1].callback(None)
+    checks[2].callback(None)
+
+    stats = check_limiter.stats()
+    assert (stats["started"], stats["delayed"], stats["running"], stats["waiting"]) == (3, 2, 0, 0)
+    assert 2 <= stats["wait_max"] < 2.001
+    assert caplog.text.count("waited") == 2
+
+
+def test_queued_checks_start_by_priority_and_module_limit(monkeypatch):
+    check_limiter, clock = __limiter(monkeypatch, checkconcurrency=2, checkmoduleconcurrency={"mysql": 1})
+    started = []
+
+    def run(name):
+        started.append(name)
+        return running.setdefault(name, Deferred())
+
+    running = dict()
+    check_limiter.submit("mysql", 0, run, "mysql 1")
+    check_limiter.submit("mysql", 5, run, "mysql 2")
+    check_limiter.submit("http", 0, run, "http 1")
+    check_limiter.submit("http", 1, run, "http 2")
+    assert started == ["mysql 1", "http 1"]
+
+    running["http 1"].callback(None)
+    assert started == ["mysql 1", "http 1", "http 2"]
+    running["mysql 1"].callback(None)
+    assert started == ["mysql 1", "http 1", "http 2", "mysql 2"]
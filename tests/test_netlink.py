@@ -0,0 +1,54 @@
+import errno
+import logging
+import types
+
+from twisted.internet.task import Clock
+
+import netlink
+from pydexceptions import IPVSException
+
+
+class _Socket(object):
+    def __init__(self, error):
+        self.error = error
+
+    def sendto(self, data, address):
+        raise self.error
+
+
+def __connection(monkeypatch, error):
+    monkeypatch.setattr(netlink, "reactor", Clock())
+    connection = object.__new__(netlink._IPVSNetlinkConnection)
+    connection.global_config = types.SimpleNamespace(log=logging.getLogger("pydirectord"))
+    connection.sock = _Socket(error)
+    connection.family = 0x20
+    connection.seq = 0
+    connection.pending = dict()
+    connection.outgoing = []
+    connection.flush_call = None
+    return connection
+
+
+def test_requests_of_a_refused_batch_fail(monkeypatch):
+    connection = __connection(monkeypatch, OSError(errno.ENOBUFS, "No buffer space available"))
+    failures = []
+    for description in ("add server 1", "add server 2"):
+        connection.submit(1, b"", description).addErrback(failures.append)
+
+    connection.flush()
+
+    assert [failure.check(IPVSException) for failure in failures] == [IPVSException, IPVSException]
+    assert "add server 2" in str(failures[1].value)
+    assert connection.pending == {}
+    assert connection.outgoing == []
+
+
+def test_batch_is_retried_while_the_socket_is_busy(monkeypatch):
+    connection = __connection(monkeypatch, BlockingIOError())
+    connection.submit(1, b"", "add server 1")
+
+    connection.flush()
+
+    assert len(connection.pending) == 1
+    assert len(connection.outgoing) == 1
+    assert connection.flush_call is not None
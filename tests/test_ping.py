@@ -0,0 +1,129 @@
+import logging
+import socket
+import struct
+import types
+
+import pytest
+from twisted.internet import error
+from twisted.internet.defer import CancelledError
+from twisted.internet.task import Clock
+
+import ping
+
+_ADDRESS = "10.0.1.1"
+
+
+class _Socket(object):
+    def __init__(self, family, kind, protocol):
+        self.kind = kind
+        self.sent = []
+        self.received = []
+
+    def setblocking(self, flag):
+        pass
+
+    def fileno(self):
+        return 42
+
+    def sendto(self, packet, address):
+        self.sent.append((packet, address))
+
+    def recvfrom(self, size):
+        if not self.received:
+            raise BlockingIOError()
+        return self.received.pop(0)
+
+
+class _Reactor(Clock):
+    def addReader(self, reader):
+        pass
+
+
+def _ip_header(source, destination):
+    return struct.pack("!BBHHHBBH4s4s", 0x45, 0, 0, 0, 0, 64, 1, 0, socket.inet_aton(source),
+                       socket.inet_aton(destination))
+
+
+@pytest.fixture
+def pinger(monkeypatch):
+    def pinger(raw=True):
+        def create(family, kind, protocol):
+            if kind == socket.SOCK_RAW and not raw:
+                raise PermissionError()
+            return _Socket(family, kind, protocol)
+        monkeypatch.setattr(ping.socket, "socket", create)
+        monkeypatch.setattr(ping, "reactor", _Reactor())
+        return ping._Pinger(socket.AF_INET, types.SimpleNamespace(log=logging.getLogger("pydirectord")))
+    return pinger
+
+
+def _results(d):
+    results = []
+    d.addBoth(results.append)
+    return results
+
+
+def test_echo_request_is_checksummed(pinger):
+    p = pinger()
+    p.ping(_ADDRESS, 1)
+    packet, address = p.socket.sent[0]
+    assert address == (_ADDRESS, 0)
+    assert ping._checksum(packet) == 0
+    assert struct.unpack("!BBxxHH", packet[:8]) == (8, 0, p.identifier, p.sequence)
+
+
+def test_echo_reply_resolves_its_request(pinger):
+    p = pinger()
+    results = _results(p.ping(_ADDRESS, 1))
+    reply = struct.pack("!BBHHH", 0, 0, 0, p.identifier, p.sequence)
+
+    # replies to another process or from another address are not ours
+    other = struct.pack("!BBHHH", 0, 0, 0, p.identifier + 1, p.sequence)
+    p.socket.received.append((_ip_header(_ADDRESS, "10.0.0.1") + other, (_ADDRESS, 0)))
+    p.socket.received.append((_ip_header("10.0.1.2", "10.0.0.1") + reply, ("10.0.1.2", 0)))
+    p.doRead()
+    assert results == []
+
+    p.socket.received.append((_ip_header(_ADDRESS, "10.0.0.1") + reply, (_ADDRESS, 0)))
+    p.doRead()
+    assert results == [_ADDRESS]
+    assert p.waiting == {} and ping.reactor.getDelayedCalls() == []
+
+
+def test_unreachable_fails_its_request(pinger):
+    p = pinger()
+    results = _results(p.ping(_ADDRESS, 1))
+    request, _ = p.socket.sent[0]
+    quoted = _ip_header("10.0.0.1", _ADDRESS) + request[:8]
+    p.socket.received.append((_ip_header("10.0.0.254", "10.0.0.1") + struct.pack("!BBHI", 3, 1, 0, 0) + quoted,
+                              ("10.0.0.254", 0)))
+    p.doRead()
+    assert results[0].check(error.NoRouteError)
+    assert "reported by 10.0.0.254" in str(results[0].value)
+
+
+def test_datagram_socket_matches_sequence_only(pinger):
+    p = pinger(raw=False)
+    assert not p.raw
+    results = _results(p.ping(_ADDRESS, 1))
+
+    # the kernel replaced the identifier and strips the IP header
+    p.socket.received.append((struct.pack("!BBHHH", 0, 0, 0, 4711, p.sequence), (_ADDRESS, 0)))
+    p.doRead()
+    assert results == [_ADDRESS]
+
+
+def test_timeout_and_cancel_forget_the_request(pinger):
+    p = pinger()
+    timed_out = _results(p.ping(_ADDRESS, 1))
+    d = p.ping("10.0.1.2", 5)
+    cancelled = _results(d)
+    assert p.sequence == 2
+
+    ping.reactor.advance(1)
+    assert timed_out[0].check(error.TimeoutError)
+    assert list(p.waiting) == [2]
+
+    d.cancel()
+    assert cancelled[0].check(CancelledError)
+    assert p.waiting == {} and ping.reactor.getDelayedCalls() == []
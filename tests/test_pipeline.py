@@ -0,0 +1,180 @@
+import logging
+
+import pytest
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+
+import external
+import ipvs
+import pipeline
+from enums import IPVSCommand
+
+
+class _Kernel(object):
+    """
+    Applies the commands to a table in the format of ipvs.read_ipvs_table, real servers of a missing virtual service
+    cannot be added, like with the actual kernel.
+    """
+
+    def __init__(self):
+        self.table = dict()
+        self.batches = []
+        self.failing = set()
+        self.held = None
+
+    def execute(self, batch, global_config):
+        self.batches.append([(command.action, command.key) for command in batch])
+        if self.held is not None:
+            self.held.append((batch, Deferred()))
+            return self.held[-1][1]
+        return succeed([self.apply(command) for command in batch])
+
+    def apply(self, command):
+        if command.key in self.failing:
+            return False
+        if command.real is None:
+            if command.action == IPVSCommand.delete:
+                del self.table[command.key]
+            else:
+                self.table[command.key] = (command.value, self.table.get(command.key, (None, dict()))[1])
+            return True
+
+        if command.key[0] not in self.table:
+            return False
+        reals = self.table[command.key[0]][1]
+        if command.action == IPVSCommand.delete:
+            del reals[command.key[1:]]
+        else:
+            reals[command.key[1:]] = (command.real.method, command.value)
+        return True
+
+
+@pytest.fixture
+def setup(parse, monkeypatch):
+    clock = Clock()
+    kernel = _Kernel()
+    monkeypatch.setattr(pipeline, "reactor", clock)
+    monkeypatch.setattr(ipvs, "read_ipvs_table", lambda global_config: kernel.table)
+    global_config, virtual = parse('real=["10.0.1.1:80 gate 10", "10.0.1.2:80 gate 10"]\n')
+    global_config.log = logging.getLogger("pydirectord")
+    global_config.ipvs = kernel
+    global_config.pipeline = pipeline.CommandPipeline(global_config, kernel.table)
+    return global_config, virtual, kernel, clock
+
+
+def __window(global_config):
+    return global_config.ipvsbatchwindow / 1000
+
+
+def __add(virtual, real, weight, global_config):
+    real.target_present = True
+    real.target_weight = weight
+    ipvs.add_real_server(virtual, real, global_config)
+
+
+def test_changes_within_a_window_are_coalesced(setup):
+    global_config, virtual, kernel, clock = setup
+    virtual.target_present = True
+    ipvs.add_virtual_service(virtual, global_config)
+    real = virtual.real[0]
+    for weight in (1, 5, 10):
+        __add(virtual, real, weight, global_config)
+    clock.advance(__window(global_config))
+    clock.advance(__window(global_config))
+
+    assert kernel.batches == [[(IPVSCommand.add, ipvs.virtual_key(virtual))],
+                              [(IPVSCommand.add, ipvs.real_key(virtual, real))]]
+    assert kernel.table[ipvs.virtual_key(virtual)][1][(real.ip.exploded, real.port)][1] == 10
+    assert (real.is_present, real.current_weight) == (True, 10)
+    assert global_config.pipeline.stats()["coalesced"] == 2
+
+
+def test_changes_of_an_entry_are_executed_one_after_another(setup):
+    global_config, virtual, kernel, clock = setup
+    kernel.table[ipvs.virtual_key(virtual)] = (virtual.scheduler, dict())
+    global_config.pipeline = pipeline.CommandPipeline(global_config, kernel.table)
+    kernel.held = []
+    first, second = virtual.real
+
+    __add(virtual, first, 5, global_config)
+    clock.advance(__window(global_config))
+    __add(virtual, first, 10, global_config)
+    __add(virtual, second, 10, global_config)
+    clock.advance(__window(global_config))
+    assert kernel.batches == [[(IPVSCommand.add, ipvs.real_key(virtual, first))],
+                              [(IPVSCommand.add, ipvs.real_key(virtual, second))]]
+
+    # the second change of the first real server waits until the kernel confirmed the first one
+    batch, d = kernel.held.pop(0)
+    d.callback([kernel.apply(command) for command in batch])
+    clock.advance(__window(global_config))
+    assert kernel.batches[-1] == [(IPVSCommand.edit, ipvs.real_key(virtual, first))]
+
+
+def test_failed_changes_are_retried_with_backoff_and_in_order(setup):
+    global_config, virtual, kernel, clock = setup
+    key = ipvs.virtual_key(virtual)
+    real = virtual.real[0]
+    kernel.failing.add(key)
+    virtual.target_present = True
+    ipvs.add_virtual_service(virtual, global_config)
+    clock.advance(__window(global_config))
+    __add(virtual, real, 10, global_config)
+
+    # the real server waits for its virtual service while that is waiting to be retried
+    times = []
+    for _ in range(2):
+        executed = len(kernel.batches)
+        while len(kernel.batches) == executed:
+            clock.advance(0.01)
+        times.append(clock.seconds())
+    assert times[1] - times[0] == pytest.approx(external.ipvs_retry_delay * 2, abs=0.02)
+    assert all(batch == [(IPVSCommand.add, key)] for batch in kernel.batches)
+
+    kernel.failing.clear()
+    clock.advance(external.ipvs_retry_delay * 4)
+    clock.advance(__window(global_config))
+    assert kernel.batches[-2:] == [[(IPVSCommand.add, key)], [(IPVSCommand.add, ipvs.real_key(virtual, real))]]
+    assert virtual.is_present and real.is_present
+    assert global_config.pipeline.stats()["failed"] == 3
+
+
+def test_retried_change_is_superseded_by_a_newer_one(setup):
+    global_config, virtual, kernel, clock = setup
+    kernel.table[ipvs.virtual_key(virtual)] = (virtual.scheduler, dict())
+    global_config.pipeline = pipeline.CommandPipeline(global_config, kernel.table)
+    real = virtual.real[0]
+    kernel.failing.add(ipvs.real_key(virtual, real))
+    __add(virtual, real, 5, global_config)
+    clock.advance(__window(global_config))
+
+    real.target_present = False
+    ipvs.delete_real_server(virtual, real, global_config)
+    kernel.failing.clear()
+    clock.advance(external.ipvs_retry_delay)
+    assert kernel.batches == [[(IPVSCommand.add, ipvs.real_key(virtual, real))]]  # never added, nothing to delete
+    assert not real.is_present
+    assert not global_config.pipeline.stats()["queue_depth"]
+
+
+def test_virtual_service_no_longer_retried_does_not_block_its_real_servers(setup):
+    global_config, virtual, kernel, clock = setup
+    key = ipvs.virtual_key(virtual)
+    real = virtual.real[0]
+    kernel.failing.add(key)
+    virtual.target_present = True
+    ipvs.add_virtual_service(virtual, global_config)
+    clock.advance(__window(global_config))
+
+    # the failed addition is superseded by a deletion of the virtual service that never made it into the kernel
+    virtual.target_present = False
+    ipvs.delete_virtual_service(virtual, global_config)
+    clock.advance(external.ipvs_retry_delay)
+    kernel.failing.clear()
+
+    virtual.target_present = True
+    ipvs.add_virtual_service(virtual, global_config)
+    __add(virtual, real, 10, global_config)
+    clock.advance(__window(global_config))
+    clock.advance(__window(global_config))
+    assert virtual.is_present and real.is_present
@@ -0,0 +1,30 @@
+import pytest
+
+import probe
+
+
+def test_external_checks_of_different_virtual_services_are_not_shared(parse):
+    settings = 'checktype=external\ncheckcommand=/bin/true\nreal=["10.0.1.1:80 gate"]\n'
+    _, first = parse(settings, host="192.168.0.1")
+    _, second = parse(settings, host="192.168.0.2")
+    _, third = parse(settings, host="192.168.0.1", port=8080)
+
+    keys = {probe.probe_key(virtual, virtual.real[0]) for virtual in (first, second, third)}
+    assert len(keys) == 3
+
+
+def test_identical_checks_are_shared(parse):
+    settings = 'request=index.html\nreceive=ok\nreal=["10.0.1.1:80 gate"]\n'
+    _, first = parse(settings, host="192.168.0.1")
+    _, second = parse(settings, host="192.168.0.2")
+
+    assert probe.probe_key(first, first.real[0]) == probe.probe_key(second, second.real[0])
+
+
+@pytest.mark.parametrize("setting", ["failurecount=3\n", "checkjitter=10\n"])
+def test_checks_scheduled_differently_are_not_shared(parse, setting):
+    settings = 'request=index.html\nreceive=ok\nreal=["10.0.1.1:80 gate"]\n'
+    _, first = parse(settings, host="192.168.0.1")
+    _, second = parse(settings + setting, host="192.168.0.2")
+
+    assert probe.probe_key(first, first.real[0]) != probe.probe_key(second, second.real[0])
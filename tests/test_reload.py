@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from twisted.internet.task import Clock
+
+import external
+import reload
+
+
+@pytest.mark.parametrize("content", ["", "[global]\n", "[HTTP]\nhost=192.168.0.1\nport=80\nprotocol=tcp\n",
+                                     "real = oops\n[global]\n", "[global]\n[global]\n"])
+def test_incomplete_configuration_is_rejected(parse, content):
+    global_config, virtual = parse('real=["10.0.1.1:80 gate"]\n')
+    virtuals = [virtual]
+
+    with open(global_config.configfile, "w") as f:
+        f.write(content)
+    reload.reload_config(virtuals, global_config)
+    assert virtuals == [virtual]
+
+
+def test_missing_configuration_is_rejected(parse):
+    global_config, virtual = parse('real=["10.0.1.1:80 gate"]\n')
+    virtuals = [virtual]
+
+    os.unlink(global_config.configfile)
+    reload.reload_config(virtuals, global_config)
+    assert virtuals == [virtual]
+
+
+def test_periodic_tasks_follow_a_reload(parse, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(reload, "reactor", clock)
+    monkeypatch.setattr(external, "check_path", os.path.join(os.path.dirname(os.path.dirname(__file__)), "checks", ""))
+    global_config, virtual = parse('real=["10.0.1.1:80 gate"]\n', global_settings="reconcileinterval=0\n")
+    virtuals = [virtual]
+    reload.schedule_autoreload(virtuals, global_config)
+    reload.schedule_reconcile(virtuals, global_config)
+    assert global_config.autoreload_call is None
+    assert global_config.reconcile_call is None
+
+    parse('real=["10.0.1.1:80 gate"]\n', global_settings="autoreload=yes\nreconcileinterval=30\n")
+    reload.reload_config(virtuals, global_config)
+    assert global_config.autoreload_call.active()
+    assert global_config.reconcile_call.getTime() == 30
+
+    parse('real=["10.0.1.1:80 gate"]\n', global_settings="autoreload=no\nreconcileinterval=0\n")
+    reload.reload_config(virtuals, global_config)
+    assert global_config.autoreload_call is None
+    assert global_config.reconcile_call is None
+    assert not clock.getDelayedCalls()
+
+
+def test_autoreload_survives_a_broken_configuration(parse, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(reload, "reactor", clock)
+    global_config, virtual = parse('real=["10.0.1.1:80 gate"]\n', global_settings="autoreload=yes\n")
+    global_config.last_modified = os.stat(global_config.configfile).st_mtime
+    virtuals = [virtual]
+    reload.schedule_autoreload(virtuals, global_config)
+
+    with open(global_config.configfile, "w") as f:
+        f.write("real = oops\n[global]\n")
+    os.utime(global_config.configfile, (global_config.last_modified + 1, global_config.last_modified + 1))
+    clock.advance(external.config_check_period)
+    assert virtuals == [virtual]
+    assert global_config.autoreload_call.active()
+
+    def broken(virtuals, global_config):
+        raise RuntimeError("bug while reloading")
+
+    monkeypatch.setattr(reload, "reload_config", broken)
+    os.utime(global_config.configfile, (global_config.last_modified + 2, global_config.last_modified + 2))
+    with pytest.raises(RuntimeError):
+        clock.advance(external.config_check_period)
+    assert global_config.autoreload_call.active()
@@ -0,0 +1,46 @@
+import os
+import types
+
+import twisted.test
+from twisted.internet.ssl import Certificate
+
+import metrics
+import tls
+
+
+class _Connection(object):
+    def __init__(self, cipher="TLS_AES_128_GCM_SHA256"):
+        self.cipher = cipher
+
+    def get_cipher_name(self):
+        return self.cipher
+
+    def get_session(self):
+        return "session"
+
+
+def test_handshake_without_private_bindings_is_unknown(monkeypatch):
+    monkeypatch.setattr(tls, "_lib", None)
+    session = object.__new__(tls.Session)
+    session.session = None
+    session.pending = (types.SimpleNamespace(_handshakeDone=True), _Connection())
+
+    assert session.settle() == metrics.UNKNOWN
+    assert session.session == "session"
+
+
+def test_handshake_is_detected_without_private_protocol_state():
+    assert tls._handshake_done(object(), _Connection())
+    assert not tls._handshake_done(object(), _Connection(cipher=None))
+
+
+def test_client_context_is_shared_per_certificate(monkeypatch):
+    monkeypatch.setattr(tls, "optionsForClientTLS", lambda hostname, trustRoot, extraCertificateOptions: object())
+    global_config = types.SimpleNamespace(tls_contexts=dict())
+    with open(os.path.join(os.path.dirname(twisted.test.__file__), "server.pem"), "rb") as f:
+        pem = f.read()
+    first, second = Certificate.loadPEM(pem), Certificate.loadPEM(pem)
+
+    options = tls.client_options("example.com", global_config, first)
+    assert tls.client_options("example.com", global_config, second) is options
+    assert tls.client_options("example.com", global_config) is not options
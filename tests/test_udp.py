@@ -0,0 +1,120 @@
+import hashlib
+import re
+import socket
+import struct
+
+import pytest
+from twisted.internet import error
+from twisted.internet.task import Clock
+from twisted.names import dns
+
+import udp
+from checks import dns as dns_check, radius, sip
+from pydexceptions import UnexpectedResultException
+
+
+_PORTS = {"dns": 53, "radius": 1812, "sip": 5060}
+
+
+class _Transport(object):
+    def __init__(self):
+        self.sent = []
+
+    def write(self, data, peer):
+        self.sent.append((data, peer))
+
+
+class _Reactor(Clock):
+    def listenUDP(self, port, protocol, interface=""):
+        protocol.makeConnection(_Transport())
+
+
+@pytest.fixture
+def udp_check(parse, monkeypatch):
+    """
+    Starts a check of the given UDP check-module and returns its results and a function receiving the request and
+    returning the response of the real server.
+    """
+    monkeypatch.setattr(udp, "reactor", _Reactor())
+
+    def udp_check(module, settings, service):
+        port = _PORTS[service]
+        global_config, virtual = parse('real=["10.0.1.1:%d gate"]\n' % port + settings, port=port, service=service)
+        results = []
+        module.check(virtual, virtual.real[0], global_config).addBoth(results.append)
+        multiplexer = global_config.udp_sockets[socket.AF_INET]
+
+        def respond(answer):
+            request, peer = multiplexer.transport.sent[-1]
+            multiplexer.datagramReceived(answer(request), peer)
+        return results, respond, multiplexer
+    return udp_check
+
+
+def _dns_answer(request, address="10.0.2.1", transaction=None):
+    message = dns.Message()
+    message.fromStr(request)
+    message.answer = True
+    if transaction is not None:
+        message.id = transaction
+    message.answers = [dns.RRHeader(message.queries[0].name.name, dns.A, payload=dns.Record_A(address))]
+    return message.toStr()
+
+
+def test_dns_response_is_matched_by_transaction(udp_check):
+    results, respond, multiplexer = udp_check(dns_check, "request=example.com\nreceive=10.0.2.1\n", "dns")
+
+    # a response to another query is dropped, a malformed one as well
+    respond(lambda request: _dns_answer(request, transaction=struct.unpack("!H", request[:2])[0] ^ 1))
+    respond(lambda request: b"\0")
+    assert results == []
+
+    respond(_dns_answer)
+    assert results == [None]
+    assert multiplexer.waiting == {} and multiplexer.parsers == {} and udp.reactor.getDelayedCalls() == []
+
+
+def test_dns_unexpected_answer(udp_check):
+    results, respond, _ = udp_check(dns_check, "request=example.com\nreceive=10.0.2.1\n", "dns")
+    respond(lambda request: _dns_answer(request, address="10.0.2.2"))
+    assert results[0].check(UnexpectedResultException)
+
+
+def _radius_answer(request, secret=b"secret", code=radius.ACCESS_ACCEPT):
+    header = struct.pack("!BBH", code, request[1], 20)
+    return header + hashlib.md5(header + request[4:20] + secret).digest()
+
+
+@pytest.mark.parametrize("secret, code, ok", [(b"secret", radius.ACCESS_ACCEPT, True),
+                                              (b"secret", radius.ACCOUNTING_RESPONSE, True),
+                                              (b"other", radius.ACCESS_ACCEPT, False),
+                                              (b"secret", 3, False)])
+def test_radius_response_is_verified(udp_check, secret, code, ok):
+    results, respond, _ = udp_check(radius, "secret=secret\n", "radius")
+    respond(lambda request: _radius_answer(request, secret, code))
+    assert (results == [None]) == ok
+    if not ok:
+        assert results[0].check(UnexpectedResultException)
+
+
+def _sip_answer(request, status="200 OK"):
+    via = re.search(rb"^Via: [^\r\n]*", request, re.M).group(0)
+    return b"SIP/2.0 " + status.encode() + b"\r\n" + via + b"\r\nContent-Length: 0\r\n\r\n"
+
+
+def test_sip_waits_for_the_final_response(udp_check):
+    results, respond, _ = udp_check(sip, "", "sip")
+    respond(lambda request: _sip_answer(request, "100 Trying"))
+    assert results == []
+    respond(lambda request: _sip_answer(request, "404 Not Found"))
+    assert results[0].check(UnexpectedResultException)
+
+
+def test_timeout_and_late_response(udp_check):
+    results, respond, multiplexer = udp_check(sip, "", "sip")
+    udp.reactor.advance(60)
+    assert results[0].check(error.TimeoutError)
+    assert multiplexer.waiting == {} and multiplexer.parsers == {}
+
+    respond(_sip_answer)
+    assert len(results) == 1
@@ -0,0 +1,92 @@
+import logging
+import math
+import random
+import types
+
+import pytest
+from twisted.internet.task import Clock
+
+import wheel
+
+
+@pytest.fixture
+def timing_wheel(monkeypatch):
+    monkeypatch.setattr(wheel, "reactor", Clock())
+    global_config = types.SimpleNamespace(log=logging.getLogger("pydirectord"))
+    timing_wheel = wheel.TimingWheel(global_config, tick=1, slots=4, levels=2)
+    timing_wheel.start()
+    return timing_wheel
+
+
+def __advance(seconds):
+    for _ in range(seconds):
+        wheel.reactor.advance(1)
+
+
+@pytest.mark.parametrize("delay", [0, 1, 2.5, 3, 4, 5, 15, 16, 17, 40, 63.2])
+def test_timer_runs_on_the_tick_it_is_due(timing_wheel, delay):
+    __advance(3)  # do not start at a slot boundary
+    fired = []
+    timer = timing_wheel.call_later(delay, lambda: fired.append(wheel.reactor.seconds()))
+    assert timer.active()
+
+    # delays beyond the range of the last level (16 ticks) go through the overflow
+    __advance(max(int(math.ceil(delay)), 1) + 1)
+    assert fired == [3 + max(math.ceil(delay), 1)]
+    assert not timer.active()
+
+
+def test_random_timers_run_in_time(timing_wheel):
+    rng = random.Random(1)
+    fired = []
+    expected = []
+    for _ in range(200):
+        __advance(rng.randrange(3))
+        delay = rng.uniform(0, 40)
+        due = max(math.ceil(wheel.reactor.seconds() + delay), wheel.reactor.seconds() + 1)
+        expected.append(due)
+        timing_wheel.call_later(delay, lambda: fired.append(wheel.reactor.seconds()))
+
+    __advance(100)
+    assert sorted(fired) == sorted(expected)
+
+
+def test_cancelled_timer_does_not_run(timing_wheel):
+    fired = []
+    timers = [timing_wheel.call_later(delay, fired.append, delay) for delay in (2, 10, 30)]
+    for timer in timers:
+        timer.cancel()
+        assert not timer.active()
+    timers[0].cancel()
+
+    __advance(40)
+    assert fired == []
+
+
+def test_timer_cancelled_by_another_of_the_same_tick_does_not_run(timing_wheel):
+    fired = []
+    timers = []
+    for name in ("a", "b"):
+        timers.append(timing_wheel.call_later(2, lambda name=name: (fired.append(name), [t.cancel() for t in timers])))
+
+    __advance(2)
+    assert len(fired) == 1
+
+
+def test_failing_call_does_not_stop_the_wheel(timing_wheel, caplog):
+    fired = []
+    timing_wheel.call_later(1, lambda: 1 / 0)
+    timing_wheel.call_later(2, fired.append, True)
+
+    __advance(2)
+    assert fired == [True]
+    assert "division by zero" in caplog.text
+
+
+def test_wheel_catches_up_after_the_reactor_was_busy(timing_wheel):
+    fired = []
+    for delay in (1, 5, 20):
+        timing_wheel.call_later(delay, fired.append, delay)
+
+    wheel.reactor.advance(25)
+    assert fired == [1, 5, 20]
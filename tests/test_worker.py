@@ -0,0 +1,128 @@
+import sys
+import types
+
+import pytest
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test import iosim
+
+import check
+import metrics
+import probe
+import pydirectord
+import worker
+from enums import Outcome
+from pydexceptions import CheckTimeoutException, RemoteCheckException, UnexpectedResultException
+
+
+def test_workers_are_started_with_paths_resolved_before_daemonizing(parse, monkeypatch, tmp_path):
+    parse('real=["10.0.1.1:80 gate"]\n', global_settings="checkworkers=2\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["./pydirectord.py", "-f", "pydirectord.conf", "start"])
+    global_config, _ = pydirectord.parse_args()
+
+    spawned = []
+
+    def endpoint(reactor, executable, args, **kwargs):
+        spawned.append(args)
+        return types.SimpleNamespace(connect=lambda factory: Deferred())
+
+    monkeypatch.setattr(worker, "ProcessEndpoint", endpoint)
+    monkeypatch.chdir("/")  # like daemonizing does
+    worker.WorkerPool(global_config).start()
+
+    assert len(spawned) == 2
+    assert spawned[0][1:5] == [str(tmp_path / "pydirectord.py"), "--check-worker", "-f",
+                               str(tmp_path / "pydirectord.conf")]
+
+
+def test_hash_ring_only_moves_the_probes_of_a_removed_worker():
+    ring = worker._HashRing()
+    for index in range(3):
+        ring.add(index)
+    keys = ["10.0.1.%d:80" % host for host in range(100)]
+    before = {key: ring.get(key) for key in keys}
+    assert set(before.values()) == {0, 1, 2}
+
+    ring.remove(1)
+    after = {key: ring.get(key) for key in keys}
+    assert all(after[key] == before[key] for key in keys if before[key] != 1)
+    assert set(after.values()) == {0, 2}
+
+    ring.remove(0)
+    ring.remove(2)
+    assert ring.get(keys[0]) is None
+
+
+class _Reactor(Clock):
+    running = False
+
+
+@pytest.fixture
+def connected(parse, monkeypatch):
+    """
+    Connects a coordinator to a check worker through AMP and returns the worker pool, the probe of the only real server
+    and the Deferreds of the checks started by the fake check-module.
+    """
+    monkeypatch.setattr(worker, "reactor", _Reactor())
+    checks = []
+    module = types.SimpleNamespace(check=lambda virtual, real, global_config: checks.append(Deferred()) or checks[-1])
+    monkeypatch.setattr(check, "check_module", lambda virtual, global_config: ("fake", module))
+
+    global_config, virtual = parse('real=["10.0.1.1:80 gate"]\n')
+    shared = probe.Probe(probe.probe_key(virtual, virtual.real[0]))
+    shared.subscribe(virtual, virtual.real[0])
+
+    pool = worker.WorkerPool(global_config)
+    coordinator = worker._CoordinatorProtocol(pool, 0)
+    remote = worker._WorkerProtocol(global_config)
+    pump = iosim.connect(remote, iosim.makeFakeServer(remote), coordinator, iosim.makeFakeClient(coordinator))
+    getattr(pool, "_WorkerPool__cb_connected")(coordinator, 0)
+
+    def run(deadline=5):
+        results = []
+        pool.run(shared, deadline).addBoth(results.append)
+        pump.flush()
+        return results
+    return types.SimpleNamespace(pool=pool, remote=remote, coordinator=coordinator, pump=pump, checks=checks, run=run)
+
+
+def test_worker_reports_success(connected):
+    results = connected.run()
+    connected.checks[0].callback("ok")
+    connected.pump.flush()
+    assert results[0]["ok"] and results[0]["outcome"] == Outcome.ok.name
+
+    # the configuration of a probe is only unpickled once
+    connected.run()
+    assert len(connected.remote.specs) == 1 and len(connected.checks) == 2
+
+
+def test_worker_reports_the_outcome_of_a_failure(connected):
+    results = connected.run()
+    connected.checks[0].errback(UnexpectedResultException("got nothing, expected something"))
+    connected.pump.flush()
+    assert results[0].check(RemoteCheckException)
+    assert results[0].value.kind == "UnexpectedResultException"
+    assert metrics.classify(results[0]) == Outcome.mismatch
+
+
+def test_worker_enforces_the_deadline(connected):
+    results = connected.run(deadline=2.5)
+    worker.reactor.advance(2.5)
+    connected.pump.flush()
+    assert results[0].check(CheckTimeoutException)
+    assert str(results[0].value) == "no result within 2.5s"
+
+
+def test_check_of_a_lost_worker_is_executed_locally(connected):
+    results = connected.run()
+    connected.coordinator.connectionLost(Failure(ConnectionLost()))
+    assert connected.pool.workers == {} and connected.pool.ring.get("10.0.1.1:80") is None
+
+    # the check is executed again by the coordinator instead of failing
+    assert results == [] and len(connected.checks) == 2
+    connected.checks[1].callback("ok")
+    assert results == ["ok"]
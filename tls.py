@@ -0,0 +1,103 @@
+"""
+TLS for the check-modules. A full handshake costs an asymmetric operation on both ends and building the client context
+means loading the trust store, so instead of doing both for every check:
+
+* the client context is built once per (hostname, trust root) and shared by all checks using it,
+* every probe keeps the TLS session of its last connection and offers it for the next handshake, so the real server can
+  resume it by session ticket or session id instead of performing a full handshake.
+
+Check-modules report whether a handshake was resumed with 'metrics.handshake', so it is counted per check-module and
+probe. Telling a resumed handshake from a full one needs the private bindings of pyOpenSSL, without them the handshakes
+are counted as unknown.
+"""
+from twisted.internet._sslverify import Certificate, optionsForClientTLS
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+from zope.interface import implementer
+
+import metrics
+
+try:
+    from OpenSSL._util import lib as _lib
+except ImportError:
+    _lib = None
+
+
+def client_options(hostname, global_config, trustRoot=None):
+    """
+    :return: the shared client connection creator for a hostname and trust root
+    """
+    key = (hostname, _trust_root_key(trustRoot))
+    options = global_config.tls_contexts.get(key)
+    if options is None:
+        options = optionsForClientTLS(hostname, trustRoot=trustRoot,
+                                      extraCertificateOptions={'enableSessionTickets': True})
+        global_config.tls_contexts[key] = options
+    return options
+
+
+def _trust_root_key(trustRoot):
+    """
+    :return: a hashable identifier of a trust root, certificates are not hashable and identified by their digest
+    """
+    if isinstance(trustRoot, Certificate):
+        return trustRoot.digest("sha256")
+    return trustRoot
+
+
+@implementer(IOpenSSLClientConnectionCreator)
+class Session(object):
+    """
+    Client connection creator of a probe, it resumes the TLS session of its previous connection.
+    """
+
+    def __init__(self, hostname, global_config, trustRoot=None):
+        self.options = client_options(hostname, global_config, trustRoot)
+
+        # variable initialization
+        self.session = None
+        self.pending = None  # (TLS protocol, connection) whose session has not been taken over yet
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        self.settle()
+        connection = self.options.clientConnectionForTLS(tlsProtocol)
+        if self.session is not None:
+            connection.set_session(self.session)
+        self.pending = (tlsProtocol, connection)
+        return connection
+
+    def settle(self):
+        """
+        Keeps the session of the last connection for the next one, it is called whenever a check completed.
+
+        :return: the kind of the handshake of the last connection or None if there was no new one
+        """
+        if self.pending is None:
+            return None
+        tlsProtocol, connection = self.pending
+        self.pending = None
+
+        if not _handshake_done(tlsProtocol, connection):
+            self.session = None  # it might have been the session that failed
+            return None
+
+        self.session = connection.get_session()
+        return _handshake_kind(connection)
+
+
+def _handshake_done(tlsProtocol, connection):
+    done = getattr(tlsProtocol, '_handshakeDone', None)
+    if done is None:
+        # a connection only has a cipher once its handshake completed
+        return connection.get_cipher_name() is not None
+    return done
+
+
+def _handshake_kind(connection):
+    """
+    :return: whether the last handshake of a connection resumed its session, metrics.UNKNOWN if it cannot be told
+    """
+    ssl = getattr(connection, '_ssl', None)
+    reused = getattr(_lib, 'SSL_session_reused', None)
+    if ssl is None or reused is None:
+        return metrics.UNKNOWN
+    return metrics.RESUMED if reused(ssl) else metrics.FULL
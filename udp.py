@@ -0,0 +1,106 @@
+"""
+Shared sockets of the UDP check-modules. Instead of opening a socket for every check, all requests of an address family
+are sent from a single UDP socket and the responses are matched to the checks by the address and port they come from
+and the transaction id of the protocol (e.g. the id of a DNS query), which the check-module extracts from them.
+"""
+import random
+import socket
+
+from twisted.internet import error, reactor
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.protocol import DatagramProtocol
+
+
+class _Multiplexer(DatagramProtocol):
+    def __init__(self, global_config):
+        self.global_config = global_config
+
+        # variable initialization
+        self.waiting = dict()  # (address, port) -> {transaction id: (Deferred, timeout)}
+        self.parsers = dict()  # (address, port) -> function extracting the transaction id of a response
+
+    def query(self, address, port, bits, build, parser, timeout):
+        peer = (address, port)
+        entries = self.waiting.get(peer, dict())
+        if len(entries) >= 2 ** bits:
+            return fail(error.ConnectError(string="too many requests to %s:%d in progress" % peer))
+
+        # a random transaction id that is not in use for another request to the same peer
+        transaction = random.getrandbits(bits)
+        while transaction in entries:
+            transaction = random.getrandbits(bits)
+
+        d = Deferred(lambda _: self.__forget(peer, transaction))
+        try:
+            self.transport.write(build(transaction), peer)
+        except OSError as e:
+            d.errback(e)
+            return d
+
+        self.parsers[peer] = parser
+        self.waiting.setdefault(peer, dict())[transaction] = (d, reactor.callLater(timeout, self.__timeout, peer,
+                                                                                   transaction))
+        return d
+
+    def __forget(self, peer, transaction):
+        entries = self.waiting.get(peer)
+        if entries is None or transaction not in entries:
+            return
+        _, timer = entries.pop(transaction)
+        if timer.active():
+            timer.cancel()
+        if not entries:
+            del self.waiting[peer]
+            del self.parsers[peer]
+
+    def __timeout(self, peer, transaction):
+        d, _ = self.waiting[peer][transaction]
+        self.__forget(peer, transaction)
+        d.errback(error.TimeoutError(string="no response from %s:%d" % peer))
+
+    def datagramReceived(self, data, addr):
+        peer = (addr[0], addr[1])
+        parser = self.parsers.get(peer)
+        if parser is None:
+            return  # nobody is waiting for it, e.g. a response that arrived too late
+
+        try:
+            transaction = parser(data)
+        except Exception as e:
+            self.global_config.log.debug("Malformed response from %s:%d: %s" % (peer + (str(e),)))
+            return
+
+        entry = self.waiting[peer].get(transaction)
+        if entry is not None:
+            self.__forget(peer, transaction)
+            entry[0].callback(data)
+
+
+def __multiplexer(ip, global_config):
+    family = socket.AF_INET if ip.version == 4 else socket.AF_INET6
+    multiplexer = global_config.udp_sockets.get(family)
+    if multiplexer is None:
+        multiplexer = _Multiplexer(global_config)
+        reactor.listenUDP(0, multiplexer, interface="0.0.0.0" if family == socket.AF_INET else "::")
+        global_config.udp_sockets[family] = multiplexer
+    return multiplexer
+
+
+def query(ip, port, bits, build, parser, timeout, global_config):
+    """
+    Sends a request and waits for its response.
+
+    :param ip: the address the request is sent to.
+    :param port: the port the request is sent to.
+    :param bits: the size of the transaction ids of the protocol.
+    :param build: a function returning the request for a transaction id.
+    :param parser: a function returning the transaction id of a response.
+    :param timeout: seconds to wait for the response.
+    :param global_config: the global configuration object.
+    :return: a Deferred firing with the response
+    """
+    try:
+        multiplexer = __multiplexer(ip, global_config)
+    except error.CannotListenError as e:
+        return fail(e)
+    return multiplexer.query(ip.compressed, port, bits, build, parser, timeout)
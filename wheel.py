@@ -0,0 +1,122 @@
+"""
+Hierarchical timing wheel holding the deadlines of all checks. Scheduling every check with its own 'reactor.callLater'
+keeps one entry per probe in the heap of the reactor, so each reschedule costs a heap operation. The wheel is driven by
+a single looping call instead: inserting and cancelling a timer is O(1), and all timers falling due within the same tick
+are run together.
+
+Level 0 holds the timers due within the next 'check_wheel_slots' ticks, every further level covers 'check_wheel_slots'
+times the range of the previous one. Whenever a lower level wrapped around, the next slot of the level above is
+cascaded down.
+"""
+import math
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+import external
+
+
+class _Timer(object):
+    """
+    Handle of a scheduled call, offering the part of the interface of twisted's DelayedCall used by PyDirectord.
+    """
+
+    def __init__(self, time, function, args):
+        self.time = time
+        self.function = function
+        self.args = args
+        self.bucket = None
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return self.bucket is not None
+
+    def cancel(self):
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+
+class TimingWheel(object):
+    def __init__(self, global_config, tick=external.check_wheel_tick, slots=external.check_wheel_slots,
+                 levels=external.check_wheel_levels):
+        self.global_config = global_config
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+
+        # variable initialization
+        self.origin = reactor.seconds()
+        self.current = 0
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.overflow = set()
+        self.loop = LoopingCall(self.__advance)
+        self.loop.clock = reactor
+
+    def start(self):
+        self.loop.start(self.tick, now=False)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def call_later(self, delay, function, *args):
+        """
+        Schedules a call like 'reactor.callLater' does, with a resolution of one tick.
+
+        :return: a handle that can be used to cancel the call
+        """
+        timer = _Timer(reactor.seconds() + delay, function, args)
+        self.__insert(timer, self.current + 1)
+        return timer
+
+    def __insert(self, timer, earliest):
+        due = max(int(math.ceil((timer.time - self.origin) / self.tick)), earliest)
+
+        # use the lowest level on which the timer is due before the slot it belongs to comes around again
+        for level in range(self.levels):
+            if due // self.slots ** (level + 1) == self.current // self.slots ** (level + 1):
+                bucket = self.wheels[level][(due // self.slots ** level) % self.slots]
+                break
+        else:
+            bucket = self.overflow
+
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def __cascade(self, bucket):
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            self.__insert(timer, self.current)
+
+    def __advance(self):
+        # catch up on all ticks that passed since the last call, the reactor might have been busy
+        target = int((reactor.seconds() - self.origin) / self.tick)
+        while self.current < target:
+            self.current += 1
+
+            if self.current % self.slots ** self.levels == 0:
+                self.__cascade(self.overflow)
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self.slots ** level == 0:
+                    self.__cascade(self.wheels[level][(self.current // self.slots ** level) % self.slots])
+
+            bucket = self.wheels[0][self.current % self.slots]
+            if bucket:
+                self.wheels[0][self.current % self.slots] = set()
+                self.__run(bucket)
+
+    def __run(self, bucket):
+        for timer in list(bucket):
+            # a timer might have been cancelled by one run before it
+            if timer not in bucket:
+                continue
+            bucket.discard(timer)
+            timer.bucket = None
+            try:
+                timer.function(*timer.args)
+            except Exception as e:
+                self.global_config.log.error("Scheduled call of %s failed: %s" % (timer.function.__name__, str(e)))
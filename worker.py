@@ -0,0 +1,273 @@
+"""
+Optional check worker processes. With 'checkworkers' set, the checks themselves (connecting, TLS handshakes, parsing
+responses) are executed by that many child processes instead of the reactor thread of PyDirectord. The main process
+stays the coordinator: it schedules the checks, owns the health state of all real servers and performs all changes of
+the ipvs table.
+
+Every worker is a PyDirectord process started with '--check-worker' which talks AMP to the coordinator over its
+standard input and output. Probes are assigned to the workers by a consistent hash of the address and port of their
+real server, so a worker that dies and is restarted only affects its own share of the probes. While no worker is
+available, the coordinator executes the checks itself.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError
+from twisted.internet.endpoints import ProcessEndpoint
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.internet.protocol import Factory
+from twisted.internet.stdio import StandardIO
+from twisted.protocols import amp
+from twisted.python.failure import Failure
+
+from enums import Outcome
+
+import check
+import external
+import metrics
+import probe
+import target
+from pydexceptions import *
+
+# attributes of a virtual service describing its state at runtime, these are not sent to the workers
+__VIRTUAL_STATE = ("real", "fallback", "is_present", "target_present")
+
+# attributes of a real server needed by the check-modules
+__REAL_CONFIGURATION = ("ip", "port", "method", "weight", "request", "receive", "custom")
+
+
+class RunCheck(amp.Command):
+    arguments = [(b"spec", amp.String()),
+                 (b"deadline", amp.Float())]
+    response = [(b"ok", amp.Boolean()),
+                (b"kind", amp.Unicode()),
+                (b"reason", amp.Unicode()),
+                (b"outcome", amp.Unicode()),
+                (b"connect", amp.Float(optional=True)),
+                (b"first_byte", amp.Float(optional=True)),
+                (b"handshake", amp.Unicode(optional=True))]
+
+
+def _spec(shared):
+    """
+    Serializes the configuration of a probe, i.e. of the virtual service and real server it is executed with.
+    """
+    if shared.spec is None:
+        virtual = shared.virtual.__class__.__new__(shared.virtual.__class__)
+        virtual.__dict__.update((name, value) for name, value in vars(shared.virtual).items()
+                                if name not in __VIRTUAL_STATE)
+        real = shared.real.__class__.__new__(shared.real.__class__)
+        real.__dict__.update((name, getattr(shared.real, name)) for name in __REAL_CONFIGURATION)
+        shared.spec = pickle.dumps((virtual, real))
+    return shared.spec
+
+
+class _HashRing(object):
+    """
+    Consistent hashing of probes onto the workers currently available.
+    """
+
+    def __init__(self, replicas=external.worker_ring_replicas):
+        self.replicas = replicas
+        self.points = []
+
+    @staticmethod
+    def __hash(value):
+        return int(hashlib.md5(value.encode()).hexdigest()[:8], 16)
+
+    def add(self, index):
+        for replica in range(self.replicas):
+            bisect.insort(self.points, (self.__hash("%d-%d" % (index, replica)), index))
+
+    def remove(self, index):
+        self.points = [point for point in self.points if point[1] != index]
+
+    def get(self, key):
+        if not self.points:
+            return None
+        position = bisect.bisect(self.points, (self.__hash(key), -1)) % len(self.points)
+        return self.points[position][1]
+
+
+class _CoordinatorProtocol(amp.AMP):
+    def __init__(self, pool, index):
+        super(_CoordinatorProtocol, self).__init__()
+        self.pool = pool
+        self.index = index
+
+    def makeConnection(self, transport):
+        # AMP asks the transport for its addresses to log them, the pipes to a process do not have any
+        self._transportPeer = self._transportHost = None
+        amp.BinaryBoxProtocol.makeConnection(self, transport)
+
+    def connectionLost(self, reason):
+        super(_CoordinatorProtocol, self).connectionLost(reason)
+        self.pool.lost(self.index)
+
+
+class WorkerPool(object):
+    def __init__(self, global_config):
+        self.global_config = global_config
+
+        # variable initialization
+        self.workers = dict()
+        self.ring = _HashRing()
+        self.stopped = False
+
+    def start(self):
+        for index in range(self.global_config.checkworkers):
+            self.__spawn(index)
+
+    def stop(self):
+        self.stopped = True
+        for worker in list(self.workers.values()):
+            worker.transport.loseConnection()
+
+    def __spawn(self, index):
+        if self.stopped or self.global_config.terminated:
+            return
+
+        args = [sys.executable, self.global_config.script, "--check-worker", "-f", self.global_config.configfile]
+        if self.global_config.log_level == logging.DEBUG:
+            args.append("-d")
+
+        # the worker writes its log messages directly to our standard error if it has to use it
+        endpoint = ProcessEndpoint(reactor, sys.executable, args, env=os.environ, childFDs={0: "w", 1: "r", 2: 2})
+        d = endpoint.connect(Factory.forProtocol(lambda: _CoordinatorProtocol(self, index)))
+        d.addCallback(self.__cb_connected, index)
+        d.addErrback(self.__cb_spawn_failed, index)
+
+    def __cb_connected(self, protocol, index):
+        self.workers[index] = protocol
+        self.ring.add(index)
+        self.global_config.log.info("Check worker %d started" % index)
+
+    def __cb_spawn_failed(self, failure, index):
+        self.global_config.log.error("Starting check worker %d failed: %s" % (index, str(failure.value)))
+        reactor.callLater(external.worker_restart_delay, self.__spawn, index)
+
+    def lost(self, index):
+        """
+        Called once the connection to a worker is lost, its probes are handed to the other workers until it has been
+        restarted.
+        """
+        self.workers.pop(index, None)
+        self.ring.remove(index)
+        if not self.stopped and not self.global_config.terminated:
+            self.global_config.log.error("Check worker %d terminated, restarting it" % index)
+            reactor.callLater(external.worker_restart_delay, self.__spawn, index)
+
+    @staticmethod
+    def __cb_response(response, d, started):
+        # take over the phases of the check as reported by the worker
+        d.marks = {phase: started + response[phase] for phase in (metrics.CONNECT, metrics.FIRST_BYTE)
+                   if response.get(phase) is not None}
+        metrics.handshake(d, response.get("handshake"))
+
+        if response["ok"]:
+            return response
+        if response["kind"] == CheckTimeoutException.__name__:
+            raise CheckTimeoutException(response["reason"])
+        raise RemoteCheckException(response["kind"], response["reason"], response["outcome"])
+
+    def run(self, shared, deadline):
+        """
+        Executes a probe on the worker responsible for it.
+
+        :return: a Deferred like the one of a check-module or None if no worker is available
+        """
+        index = self.ring.get(shared.real.ip.exploded + ":" + str(shared.real.port))
+        if index is None:
+            return None
+
+        d = self.workers[index].callRemote(RunCheck, spec=_spec(shared), deadline=float(deadline))
+        d.addCallbacks(self.__cb_response, self.__cb_lost, callbackArgs=(d, reactor.seconds()), errbackArgs=(shared,))
+        return d
+
+    def __cb_lost(self, failure, shared):
+        # do not blame the real server for a worker that died, check it ourselves instead
+        failure.trap(ConnectionDone, ConnectionLost)
+        _, module = check.check_module(shared.virtual, self.global_config)
+        return target.run(module, shared, shared.virtual, shared.real, self.global_config)
+
+
+class _WorkerProtocol(amp.AMP):
+    def __init__(self, global_config):
+        super(_WorkerProtocol, self).__init__()
+        self.global_config = global_config
+        self.specs = dict()
+
+    @RunCheck.responder
+    def run_check(self, spec, deadline):
+        # probes are executed over and over again, so only unpickle each configuration once
+        if spec not in self.specs:
+            if len(self.specs) >= external.worker_spec_cache:
+                self.__release()  # configurations left over from before a reload
+            virtual, real = pickle.loads(spec)
+            self.specs[spec] = (virtual, real, probe.Probe(spec))  # the probe keeps a stateful check-module
+        virtual, real, holder = self.specs[spec]
+
+        started = reactor.seconds()
+        try:
+            _, module = check.check_module(virtual, self.global_config)
+            d = target.run(module, holder, virtual, real, self.global_config)
+        except Exception as e:
+            return {"ok": False, "kind": e.__class__.__name__, "reason": str(e), "outcome": Outcome.error.name}
+
+        timer = reactor.callLater(deadline, d.cancel)
+        d.addBoth(self.__cb_done, d, started, timer, deadline)
+        return d
+
+    @staticmethod
+    def __cb_done(result, d, started, timer, deadline):
+        response = metrics.phases(d, started)
+        if getattr(d, "handshake", None) is not None:
+            response["handshake"] = d.handshake
+        if timer.active():
+            timer.cancel()
+        elif isinstance(result, Failure) and result.check(CancelledError):
+            response.update(ok=False, kind=CheckTimeoutException.__name__, reason="no result within %gs" % deadline,
+                            outcome=Outcome.timeout.name)
+            return response
+
+        if isinstance(result, Failure):
+            response.update(ok=False, kind=result.type.__name__, reason=str(result.value),
+                            outcome=metrics.classify(result).name)
+        else:
+            response.update(ok=True, kind="", reason="", outcome=Outcome.ok.name)
+        return response
+
+    def __release(self):
+        for _, _, holder in self.specs.values():
+            target.release(holder.target, self.global_config)
+        self.specs.clear()
+
+    def connectionLost(self, reason):
+        super(_WorkerProtocol, self).connectionLost(reason)
+        self.__release()
+
+        # the coordinator is gone
+        if reactor.running:
+            reactor.stop()
+
+
+def start_workers(global_config):
+    """
+    Starts the check worker processes, if any are configured.
+    """
+    if global_config.checkworkers:
+        global_config.check_workers = WorkerPool(global_config)
+        global_config.check_workers.start()
+
+
+def run_worker(global_config):
+    """
+    Main function of a check worker process. The check-modules are loaded once they are first needed.
+    """
+    StandardIO(_WorkerProtocol(global_config))
+    reactor.run()